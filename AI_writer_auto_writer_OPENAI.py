@@ -3,7 +3,6 @@ from typing import Dict, List, Optional, Tuple
 from enum import Enum
 import json
 import requests
-import time
 from dataclasses import dataclass
 from urllib.parse import urljoin
 from openai import OpenAI
@@ -135,7 +134,7 @@ class ContentPrompts:
         Maintain the interviewee's voice and style while ensuring professional quality and engaging flow, as well as meeting the outline structure and word count requirement."""
 
 class ContentCollaborator:
-    def __init__(self, llm_config: LLMConfig = None):
+    def __init__(self, llm_config: LLMConfig = None, interviewee=None):
         self.state = CollabState.TOPIC_SELECTION
         self.topic = ""
         self.target_length = 0
@@ -144,6 +143,8 @@ class ContentCollaborator:
         self.current_section = None
         self.draft = ""
         self.llm = LocalLLMClient(llm_config or LLMConfig())
+        # Answers interview questions; None means the LLM answers as the expert (see interviewee.py)
+        self.interviewee = interviewee
         self.MAX_PROBING_QUESTIONS = 3  # Default value
         
     def _generate_initial_outline(self) -> Dict:
@@ -621,11 +622,14 @@ class ContentCollaborator:
         Use the Rationale provided to help generate your answer."""
         
         print("\n--- Generating Answer ---")
-        # Get answer from LLM
-        answer = self.llm.generate(
-            answer_prompt,
-            system_prompt="You are an expert being interviewed about this topic."
-        )
+        if self.interviewee:
+            answer = self.interviewee.answer(self.topic, self.current_section, question, rationale)
+        else:
+            # Get answer from LLM
+            answer = self.llm.generate(
+                answer_prompt,
+                system_prompt="You are an expert being interviewed about this topic."
+            )
         print(f"A: {answer}")
         
         # Save the response
@@ -752,7 +756,6 @@ if __name__ == "__main__":
             if collaborator.state == CollabState.INTERVIEW:
                 response = collaborator.process_user_input(None)
                 print(response)
-                time.sleep(2)
                 continue
 
             user_input = input("> ").strip()
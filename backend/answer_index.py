@@ -0,0 +1,213 @@
+import os
+import re
+import sys
+import time
+import zlib
+import struct
+import hashlib
+import argparse
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from file_store import JsonFileStore, get_state_dir
+
+# 哈希特征空间的维度：单条问答只有几十到几百个特征，带符号哈希下 2048 维的冲突影响很小
+DIMENSIONS = 1 << 11
+# 向量文件中每条问答一条记录：问题和回答向量的非零维数，之后依次是各自的维度下标（uint16）和值（float32）
+RECORD_HEADER = struct.Struct('<HH')
+CJK_RUN_PATTERN = re.compile(r'[⺀-鿿가-힯]+')
+WORD_PATTERN = re.compile(r'[a-z0-9]+')
+# 中文虚词和问句套话在问题之间普遍出现，不参与相似度
+STOP_FEATURES = frozenset(['您的', '你的', '我们', '什么', '哪些', '如何', '怎么', '一下', '可以', '是否', '能否', '有没',
+                           '没有', '请问', '分享', '一个', '这个', '那个', 'the', 'a', 'an', 'of', 'to', 'and', 'in',
+                           'you', 'your', 'what', 'how', 'is', 'are', 'do', 'can'])
+
+QUESTION_DEDUP_THRESHOLD = float(os.getenv('QUESTION_DEDUP_THRESHOLD', '0.8'))
+RELATED_MIN_SIMILARITY = float(os.getenv('RELATED_MIN_SIMILARITY', '0.15'))
+
+
+def features(text: str) -> List[str]:
+    """中日韩文字取二元组，其余按单词切分"""
+    text = (text or '').lower()
+    result = []
+    for run in CJK_RUN_PATTERN.findall(text):
+        result.extend(run[i:i + 2] for i in range(max(len(run) - 1, 1)))
+    result.extend(WORD_PATTERN.findall(text))
+    return [feature for feature in result if feature not in STOP_FEATURES]
+
+
+def _bucket(feature: str) -> Tuple[int, float]:
+    """稳定的带符号哈希：低位决定维度，最高位决定符号，进程之间结果一致"""
+    value = zlib.crc32(feature.encode('utf-8'))
+    return value % DIMENSIONS, 1.0 if value & 0x80000000 else -1.0
+
+
+def vectorize(texts: Sequence[str]) -> np.ndarray:
+    """批量把文本映射为 L2 归一化的哈希向量（词频取对数）"""
+    rows, columns, signs = [], [], []
+    for row, text in enumerate(texts):
+        for feature in features(text):
+            column, sign = _bucket(feature)
+            rows.append(row)
+            columns.append(column)
+            signs.append(sign)
+    matrix = np.zeros((len(texts), DIMENSIONS), dtype=np.float32)
+    if rows:
+        np.add.at(matrix, (np.asarray(rows), np.asarray(columns)), np.asarray(signs, dtype=np.float32))
+    matrix = np.sign(matrix) * np.log1p(np.abs(matrix))
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    np.divide(matrix, norms, out=matrix, where=norms > 0)
+    return matrix
+
+
+def _encode(question: np.ndarray, answer: np.ndarray) -> bytes:
+    parts = []
+    for vector in (question, answer):
+        columns = np.flatnonzero(vector)
+        parts.append(columns.astype('<u2').tobytes() + vector[columns].astype('<f4').tobytes())
+    return RECORD_HEADER.pack(len(parts[0]) // 6, len(parts[1]) // 6) + b''.join(parts)
+
+
+def _decode(buffer: bytes, limit: int) -> Tuple[List[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]], int]:
+    """解析最多 limit 条记录，返回各条的 (问题下标, 问题值, 回答下标, 回答值) 和完整记录的字节数；
+    末尾写了一半的记录被忽略
+    """
+    records, offset = [], 0
+    while len(records) < limit and offset + RECORD_HEADER.size <= len(buffer):
+        sizes = RECORD_HEADER.unpack_from(buffer, offset)
+        end = offset + RECORD_HEADER.size + 6 * sum(sizes)
+        if end > len(buffer):
+            break
+        record, position = [], offset + RECORD_HEADER.size
+        for size in sizes:
+            record.append(np.frombuffer(buffer, dtype='<u2', count=size, offset=position))
+            record.append(np.frombuffer(buffer, dtype='<f4', count=size, offset=position + 2 * size))
+            position += 6 * size
+        records.append(tuple(record))
+        offset = end
+    return records, offset
+
+
+class AnswerIndex:
+    """一个用户的面试问答向量索引
+
+    问答文本保存在 JsonFileStore 中，向量以稀疏形式按条目顺序追加到 .vec 文件（每条几百字节），
+    新进程只需要为新增的条目计算向量。查询时所有候选一次矩阵乘法完成余弦相似度计算。
+    """
+    def __init__(self, owner: str, directory: str = None):
+        self.directory = directory or os.path.join(get_state_dir(), 'answers')
+        name = hashlib.sha256(owner.encode('utf-8')).hexdigest()[:32]
+        self.store = JsonFileStore(name, self.directory)
+        self.vectors_path = os.path.join(self.directory, f"{name}.vec")
+        self.entries: List[Dict] = []
+        self.question_vectors = np.zeros((0, DIMENSIONS), dtype=np.float32)
+        self.answer_vectors = np.zeros((0, DIMENSIONS), dtype=np.float32)
+        self.load()
+
+    def load(self):
+        data = self.store.read()
+        self.entries = data.get('entries', [])
+        count = len(self.entries)
+        records, _ = _decode(self._read_vectors()[:data.get('vectorBytes', 0)], count)
+        questions = np.zeros((count, DIMENSIONS), dtype=np.float32)
+        answers = np.zeros((count, DIMENSIONS), dtype=np.float32)
+        for row, (question_columns, question_values, answer_columns, answer_values) in enumerate(records):
+            questions[row, question_columns] = question_values
+            answers[row, answer_columns] = answer_values
+        if len(records) < count:
+            # 向量文件缺失或损坏：本次在内存中补算，下次 add 时写入
+            missing = self.entries[len(records):]
+            questions[len(records):], answers[len(records):] = self._vectorize(missing)
+        self.question_vectors, self.answer_vectors = questions, answers
+
+    def _read_vectors(self) -> bytes:
+        try:
+            with open(self.vectors_path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return b''
+
+    @staticmethod
+    def _vectorize(entries: List[Dict]) -> Tuple[np.ndarray, np.ndarray]:
+        return (vectorize([entry['question'] for entry in entries]),
+                vectorize([f"{entry['question']} {entry['answer']}" for entry in entries]))
+
+    def _append_vectors(self, data: Dict):
+        """在存储的排他锁内为还没有向量的条目追加记录
+
+        向量文件的有效长度记在 JSON 的 vectorBytes 中，与条目一起保存；
+        之前写了一半或 JSON 没有保存成功的记录会被截掉重写。
+        """
+        entries = data['entries']
+        known, size = _decode(self._read_vectors()[:data.get('vectorBytes', 0)], len(entries))
+        questions, answers = self._vectorize(entries[len(known):])
+        payload = b''.join(_encode(question, answer) for question, answer in zip(questions, answers))
+        with open(self.vectors_path, 'ab') as f:
+            f.truncate(size)
+            f.write(payload)
+        data['vectorBytes'] = size + len(payload)
+
+    def add(self, session_id: str, section: str, question: str, answer: str):
+        """记录一条问答"""
+        entry = {'session': session_id, 'section': section, 'question': question or '', 'answer': answer or '',
+                 'at': time.time()}
+        with self.store.update() as data:
+            data.setdefault('entries', []).append(entry)
+            self._append_vectors(data)
+        self.load()
+
+    def _top(self, scores: np.ndarray, k: int, min_score: float) -> List[int]:
+        if not len(scores):
+            return []
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        return [int(i) for i in top[np.argsort(-scores[top])] if scores[i] >= min_score]
+
+    def similar_questions(self, questions: Sequence[str], threshold: float = QUESTION_DEDUP_THRESHOLD) -> List[Optional[Dict]]:
+        """批量查找与每个问题几乎相同的已问过的问题，没有则为 None"""
+        if not len(self.entries):
+            return [None] * len(questions)
+        scores = vectorize(questions) @ self.question_vectors.T
+        best = scores.argmax(axis=1)
+        return [dict(self.entries[j], similarity=round(float(scores[i, j]), 3)) if scores[i, j] >= threshold else None
+                for i, j in enumerate(best)]
+
+    def related_answers(self, query: str, k: int = 3, exclude_session: str = None,
+                        min_similarity: float = RELATED_MIN_SIMILARITY) -> List[Dict]:
+        """与 query 最相关的过去回答，可排除当前会话（当前会话的回答已经在提示词里）"""
+        if not len(self.entries):
+            return []
+        scores = (vectorize([query]) @ self.answer_vectors.T)[0]
+        if exclude_session:
+            mask = np.fromiter((entry['session'] == exclude_session for entry in self.entries), dtype=bool,
+                               count=len(self.entries))
+            scores = np.where(mask, -1.0, scores)
+        return [dict(self.entries[i], similarity=round(float(scores[i]), 3))
+                for i in self._top(scores, k, min_similarity)]
+
+
+def compact(entry: Dict, limit: int = 160) -> Dict[str, str]:
+    """提示词中使用的精简问答"""
+    answer = ' '.join(entry['answer'].split())
+    return {'question': entry['question'], 'answer': answer if len(answer) <= limit else answer[:limit] + '…'}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Query the interview answer index of a user')
+    parser.add_argument('--owner', required=True, help='User ID (or session ID when no user ID is sent)')
+    parser.add_argument('--question', help='Check a question for near-duplicates')
+    parser.add_argument('--related', help='Find prior answers related to this text')
+    args = parser.parse_args()
+
+    index = AnswerIndex(args.owner)
+    print(f"{len(index.entries)} entries")
+    if args.question:
+        print(index.similar_questions([args.question])[0])
+    if args.related:
+        for entry in index.related_answers(args.related):
+            print(entry['similarity'], compact(entry))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,195 @@
+import sys
+import random
+import argparse
+import tracemalloc
+from typing import Dict, Iterator, List, Optional, Union
+
+
+class Answer:
+    """一条面试回答；所属部分由 InterviewLog 的分组表示，不在每条记录里重复"""
+    __slots__ = ('question', 'answer')
+
+    def __init__(self, question: str, answer: str):
+        self.question = question
+        self.answer = answer
+
+
+class InterviewLog:
+    """按部分分组保存面试回答
+
+    部分名称经过 intern，所有会话共享同一个字符串对象；
+    to_list() 生成原来的 [{'section', 'question', 'answer'}] 形式，用于拼接提示词。
+    """
+    __slots__ = ('_sections', '_count')
+
+    def __init__(self):
+        self._sections: Dict[str, List[Answer]] = {}
+        self._count = 0
+
+    def append(self, entry: Dict):
+        section = sys.intern(entry.get('section') or '')
+        self._sections.setdefault(section, []).append(Answer(entry.get('question'), entry.get('answer')))
+        self._count += 1
+
+    def for_section(self, section: str) -> List[Answer]:
+        return self._sections.get(section, [])
+
+    def sections(self) -> List[str]:
+        return list(self._sections)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __iter__(self) -> Iterator[Dict]:
+        for section, answers in self._sections.items():
+            for item in answers:
+                yield {'section': section, 'question': item.question, 'answer': item.answer}
+
+    def to_list(self) -> List[Dict]:
+        return list(self)
+
+    def to_dict(self) -> Dict[str, List[List[str]]]:
+        """持久化格式：{部分: [[问题, 回答], ...]}"""
+        return {section: [[item.question, item.answer] for item in answers]
+                for section, answers in self._sections.items()}
+
+    @classmethod
+    def from_data(cls, data: Optional[Union[Dict, List]]) -> 'InterviewLog':
+        """从持久化格式恢复，兼容旧的字典列表格式"""
+        log = cls()
+        if isinstance(data, dict):
+            for section, answers in data.items():
+                for question, answer in answers:
+                    log.append({'section': section, 'question': question, 'answer': answer})
+        else:
+            for entry in data or []:
+                log.append(entry)
+        return log
+
+
+class Message:
+    __slots__ = ('role', 'content')
+
+    def __init__(self, role: str, content: str):
+        self.role = role
+        self.content = content
+
+
+class ConversationHistory:
+    """对话历史
+
+    只有角色名经过 intern；消息内容（用户输入、模型回复、注入的上下文）几乎不会重复，原样保存。
+    系统提示词不进入对话历史，由 static_prompt 在进程内共享一份。
+    """
+    __slots__ = ('_messages',)
+
+    def __init__(self):
+        self._messages: List[Message] = []
+
+    def append(self, message: Dict):
+        self._messages.append(Message(sys.intern(message['role']), message.get('content') or ''))
+
+    def clear(self):
+        self._messages = []
+
+    def drop_oldest(self, count: int):
+        """删去最早的 count 条消息"""
+        del self._messages[:count]
+
+    def drop_newest(self, count: int):
+        """删去最近的 count 条消息"""
+        del self._messages[len(self._messages) - count:]
+
+    def discard(self, role: str, prefix: str):
+        """删去角色为 role、内容以 prefix 开头的消息"""
+        self._messages = [message for message in self._messages
+                          if not (message.role == role and message.content.startswith(prefix))]
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    def __bool__(self) -> bool:
+        return bool(self._messages)
+
+    def to_messages(self) -> List[Dict]:
+        """生成 API 需要的消息列表"""
+        return [{'role': message.role, 'content': message.content} for message in self._messages]
+
+    @classmethod
+    def from_data(cls, data: Optional[List[Dict]]) -> 'ConversationHistory':
+        history = cls()
+        for message in data or []:
+            history.append(message)
+        return history
+
+
+_ALPHABET = '的是了在人有我他这个们中来上大为和国地到以说时要就出会可也你对生能而子那得于着下自之年过发后作里用道行所然家种事成方多经么去法学如都同现当没动面起看定天分'
+
+
+def _text(rng: random.Random, length: int) -> str:
+    return ''.join(rng.choices(_ALPHABET, k=length))
+
+
+def _context(responses: List[Dict]) -> str:
+    # 每个回答之后注入的上下文消息包含到目前为止的全部回答
+    return 'Previous responses: ' + ''.join(entry['question'] + entry['answer'] for entry in responses)
+
+
+def _legacy_session(rng, answers, sections):
+    responses = []
+    history = []
+    for i in range(answers):
+        section = sections[i % len(sections)]
+        # 从 JSON 加载后，每个会话里的部分名和角色名都是独立的副本
+        responses.append({'section': ''.join(section), 'question': _text(rng, 40), 'answer': _text(rng, 200)})
+        history.append({'role': ''.join('system'), 'content': _context(responses)})
+        history.append({'role': ''.join('user'), 'content': _text(rng, 200)})
+        history.append({'role': ''.join('assistant'), 'content': _text(rng, 40)})
+    return responses, history
+
+
+def _compact_session(rng, answers, sections):
+    responses = InterviewLog()
+    history = ConversationHistory()
+    for i in range(answers):
+        section = sections[i % len(sections)]
+        responses.append({'section': ''.join(section), 'question': _text(rng, 40), 'answer': _text(rng, 200)})
+        # 上下文消息替换上一份而不是追加
+        history.discard('system', 'Previous responses: ')
+        history.append({'role': ''.join('system'), 'content': _context(responses.to_list())})
+        history.append({'role': ''.join('user'), 'content': _text(rng, 200)})
+        history.append({'role': ''.join('assistant'), 'content': _text(rng, 40)})
+    return responses, history
+
+
+def _measure(build, sessions: int, answers: int) -> float:
+    rng = random.Random(0)
+    sections = ['引言', '背景介绍', '核心观点', '案例分析', '结论']
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    states = [build(rng, answers, sections) for _ in range(sessions)]
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del states
+    return (after - before) / sessions
+
+
+def benchmark(answer_counts: List[int], sessions: int):
+    """比较旧的字典列表表示与紧凑表示的每会话内存占用"""
+    print(f"{'answers':>8} {'legacy B/session':>18} {'compact B/session':>18} {'saving':>8}")
+    for answers in answer_counts:
+        legacy = _measure(_legacy_session, sessions, answers)
+        compact = _measure(_compact_session, sessions, answers)
+        print(f"{answers:>8} {legacy:>18,.0f} {compact:>18,.0f} {1 - compact / legacy:>8.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Memory benchmark for collaborator state')
+    parser.add_argument('--answers', type=int, nargs='+', default=[10, 50, 200])
+    parser.add_argument('--sessions', type=int, default=10)
+    args = parser.parse_args()
+    benchmark(args.answers, args.sessions)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,5 +1,5 @@
 import os
-from typing import Dict, List, Optional, Tuple
+from typing import Callable, Dict, List, Optional, Tuple
 from enum import Enum
 import json
 import requests
@@ -13,11 +13,31 @@ import argparse
 from dotenv import load_dotenv
 import logging
 
+from llm_cassette import wrap_client
+from credential_pool import CredentialPool
+from llm_guard import (ContextWindowExceeded, StreamInterrupted, estimate_output_tokens, estimate_request_tokens,
+                       estimate_text_tokens, fit_request)
+from metrics import metrics, CONTINUATION_BUCKETS, RATE_BUCKETS
+from tracing import TraceIdFilter, set_attributes, traced, tracer
+from singleflight import SingleFlight, request_key
+from turn_store import TurnStore
+from session_store import DraftCheckpoint, SessionStore
+from usage import UsageLedger
+from collab_state import ConversationHistory, InterviewLog
+from draft_document import DraftDocument, content_hash
+from draft_analytics import DraftAnalytics, StreamingStats, count_words
+from search_index import SearchIndex
+from answer_index import AnswerIndex, compact
+from prompt_templates import Fragment, FragmentCache, PromptTemplate, json_object, json_value, static_prompt
+from profiling import profiled, requested_modes
+
 # 配置日志
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
+    format='%(asctime)s - %(levelname)s - [%(trace_id)s] %(message)s'
 )
+for _handler in logging.getLogger().handlers:
+    _handler.addFilter(TraceIdFilter())
 logger = logging.getLogger(__name__)
 
 # 减少第三方库的日志输出
@@ -39,6 +59,7 @@ class CollabState(Enum):
 @dataclass
 class LLMConfig:
     """Configuration for OpenAI API endpoint"""
+    # 多个 key 通过 OPENAI_API_KEYS 或 LLM_CREDENTIALS 配置，见 credential_pool.py
     api_key: str = os.getenv('OPENAI_API_KEY')
     base_url: str = os.getenv('OPENAI_API_BASE', 'https://api.siliconflow.cn/v1')
     timeout: int = 30
@@ -47,81 +68,268 @@ class LLMConfig:
     model: str = "deepseek-ai/DeepSeek-R1"
     stream: bool = True
     max_tokens: int = 4096
+    requests_per_minute: int = int(os.getenv('LLM_REQUESTS_PER_MINUTE', '60'))
+    tokens_per_minute: int = int(os.getenv('LLM_TOKENS_PER_MINUTE', '200000'))
+    # 流式响应末尾附带 usage；不支持 stream_options 的服务可关闭，改为估算
+    stream_usage: bool = os.getenv('LLM_STREAM_USAGE', '1') != '0'
+    # 会话超出 token 预算后改用的便宜档位
+    economy_model: str = os.getenv('LLM_ECONOMY_MODEL', 'deepseek-ai/DeepSeek-V3')
+    economy_max_tokens: int = int(os.getenv('LLM_ECONOMY_MAX_TOKENS', '2048'))
+    # 单个会话的 token 预算，0 表示不限制
+    session_token_budget: int = int(os.getenv('SESSION_TOKEN_BUDGET', '0'))
+    # 模型上下文窗口和单次输出上限，请求前据此裁剪历史、确定 max_tokens
+    context_window: int = int(os.getenv('LLM_CONTEXT_WINDOW', '65536'))
+    max_output_tokens: int = int(os.getenv('LLM_MAX_OUTPUT_TOKENS', '16384'))
+    # 长文生成因 max_tokens 截断时最多续写的次数，以及续写请求携带的已生成内容末尾长度（字符）
+    max_continuations: int = int(os.getenv('LLM_MAX_CONTINUATIONS', '4'))
+    continuation_tail_chars: int = int(os.getenv('LLM_CONTINUATION_TAIL_CHARS', '2000'))
+
+def record_llm_call(model: str, messages: List[Dict], started: float,
+                    first_token_at: Optional[float], completion: str, usage=None) -> Dict:
+    """记录一次成功的 LLM 调用：总耗时、首 token 延迟、生成速度和 token 数，返回本次用量
+
+    接口没有返回 usage 时按字符数估算 token。
+    """
+    finished = time.perf_counter()
+    metrics.inc('pulitzer_llm_requests_total', model=model, status='success')
+    metrics.observe('pulitzer_llm_request_seconds', finished - started, model=model)
+
+    if usage is not None:
+        prompt_tokens = usage.prompt_tokens
+        completion_tokens = usage.completion_tokens
+    else:
+        prompt_tokens = estimate_request_tokens(messages)
+        completion_tokens = estimate_text_tokens(completion)
+    metrics.inc('pulitzer_llm_prompt_tokens_total', prompt_tokens, model=model)
+    metrics.inc('pulitzer_llm_completion_tokens_total', completion_tokens, model=model)
+
+    set_attributes({
+        'llm.model': model,
+        'llm.prompt_tokens': prompt_tokens,
+        'llm.completion_tokens': completion_tokens,
+        'llm.usage_reported': usage is not None
+    })
+
+    if first_token_at is not None:
+        set_attributes({'llm.ttft_ms': round((first_token_at - started) * 1000, 1)})
+        metrics.observe('pulitzer_llm_ttft_seconds', first_token_at - started, model=model)
+        generation_time = finished - first_token_at
+        if generation_time > 0 and completion_tokens:
+            metrics.observe('pulitzer_llm_tokens_per_second', completion_tokens / generation_time,
+                            buckets=RATE_BUCKETS, model=model)
+
+    return {
+        'model': model,
+        'prompt_tokens': prompt_tokens,
+        'completion_tokens': completion_tokens,
+        'reported': usage is not None
+    }
 
 class LLMClient:
     def __init__(self):
         self.api_key = os.getenv('OPENAI_API_KEY')
         self.api_base = os.getenv('OPENAI_API_BASE', 'https://api.siliconflow.cn/v1')
         
-        if not self.api_key:
-            raise ValueError("OPENAI_API_KEY environment variable is not set")
-            
         try:
-            self.client = OpenAI(
-                api_key=self.api_key,
-                base_url=self.api_base,
-                timeout=30.0,
+            # 重试由凭据池和各个 key 的 LLMGuard 统一负责，避免每个进程各自盲目重试
+            self.pool = CredentialPool.from_env(
+                self.api_key, self.api_base,
+                lambda api_key, base_url: wrap_client(OpenAI(
+                    api_key=api_key,
+                    base_url=base_url,
+                    timeout=30.0,
+                    max_retries=0
+                )),
                 max_retries=3
             )
+            self.singleflight = SingleFlight()
         except Exception as e:
             logger.error(f"Failed to initialize OpenAI client: {e}")
             raise
-        
-    def chat(self, messages, temperature=0.7):
+
+    @traced('llm.chat')
+    def chat(self, messages, temperature=0.7, on_delta=None):
         """调用 OpenAI chat completion API"""
-        try:
-            response = self.client.chat.completions.create(
-                model="deepseek-ai/DeepSeek-R1",
-                messages=messages,
-                temperature=temperature,
-                max_tokens=4096,
-                stream=True
-            )
-            
+        request_data = {
+            "model": "deepseek-ai/DeepSeek-R1",
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": 4096,
+            "stream": True
+        }
+        # 与 LocalLLMClient 相同：不支持 stream_options 的兼容接口可以用 LLM_STREAM_USAGE=0 关闭
+        if os.getenv('LLM_STREAM_USAGE', '1') != '0':
+            request_data["stream_options"] = {"include_usage": True}
+
+        def _request(client, emit):
+            started = time.perf_counter()
+            first_token_at = None
             # 收集完整响应
             full_response = ""
-            for chunk in response:
-                if chunk.choices[0].delta.content:
-                    full_response += chunk.choices[0].delta.content
-                    
+            usage = None
+            try:
+                response = client.chat.completions.create(**request_data)
+
+                for chunk in response:
+                    usage = getattr(chunk, 'usage', None) or usage
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        if first_token_at is None:
+                            first_token_at = time.perf_counter()
+                        full_response += chunk.choices[0].delta.content
+                        emit(chunk.choices[0].delta.content)
+            except Exception as e:
+                metrics.inc('pulitzer_llm_requests_total', model=request_data['model'], status=type(e).__name__)
+                if full_response:
+                    # 已经推送的增量无法撤回，不能交给凭据池从头重试
+                    raise StreamInterrupted(full_response, f"{type(e).__name__}: {e}") from e
+                raise
+
+            record_llm_call(request_data['model'], messages, started, first_token_at, full_response, usage)
             return full_response
+
+        try:
+            # 相同的并发请求（如重复点击生成大纲）只调用一次 API
+            return self.singleflight.run(
+                request_key(request_data),
+                lambda emit: self.pool.call(lambda client: _request(client, emit),
+                                            tokens=estimate_request_tokens(messages, 4096)),
+                on_delta
+            )
             
         except Exception as e:
             logger.error(f"OpenAI API error: {e}")
             raise
 
+class ContinuationSeam:
+    """拼接续写结果：模型续写时常会重复上一段结尾的文字，先缓存续写的开头，
+    去掉与已生成内容末尾重叠的部分后再转发增量
+    """
+    # 缓存的续写开头长度（字符）和认定为重复的最短重叠
+    WINDOW = 200
+    MIN_OVERLAP = 12
+
+    def __init__(self, previous: str, emit: Callable[[str], None]):
+        self.previous = previous[-self.WINDOW:]
+        self.emit = emit
+        self.parts: List[str] = []
+        self._buffer = ''
+        self._flushed = False
+
+    def feed(self, delta: str):
+        if self._flushed:
+            self.parts.append(delta)
+            self.emit(delta)
+            return
+        self._buffer += delta
+        if len(self._buffer) >= self.WINDOW:
+            self._flush()
+
+    def _flush(self):
+        self._flushed = True
+        text = self._buffer[self._overlap():]
+        if text:
+            self.parts.append(text)
+            self.emit(text)
+
+    def _overlap(self) -> int:
+        for size in range(min(len(self.previous), len(self._buffer)), self.MIN_OVERLAP - 1, -1):
+            if self.previous.endswith(self._buffer[:size]):
+                return size
+        return 0
+
+    def finish(self) -> str:
+        """续写结束，返回去重后的续写内容"""
+        if not self._flushed:
+            self._flush()
+        return ''.join(self.parts)
+
 class LocalLLMClient:
     """Client for interacting with OpenAI API"""
     def __init__(self, config: LLMConfig):
         self.config = config
         try:
-            self.client = OpenAI(
-                api_key=config.api_key,
-                base_url=config.base_url,
-                timeout=config.timeout,
+            # 重试由凭据池和各个 key 的 LLMGuard 统一负责，避免每个进程各自盲目重试
+            self.pool = CredentialPool.from_env(
+                config.api_key, config.base_url,
+                lambda api_key, base_url: wrap_client(OpenAI(
+                    api_key=api_key,
+                    base_url=base_url,
+                    timeout=config.timeout,
+                    max_retries=0
+                )),
+                requests_per_minute=config.requests_per_minute,
+                tokens_per_minute=config.tokens_per_minute,
                 max_retries=config.max_retries
             )
+            self.singleflight = SingleFlight()
             print("OpenAI client initialized successfully", file=sys.stderr)
         except Exception as e:
             print(f"Error initializing OpenAI client: {e}", file=sys.stderr)
             raise
-        self.conversation_history = []
-        
-    def generate(self, prompt: str, system_prompt: str = None) -> str:
+        self.conversation_history = ConversationHistory()
+        # standard 或 economy，会话超出预算后切换到 economy
+        self.profile = 'standard'
+        # 每次实际发起的调用结束后收到用量，用于按会话记账
+        self.on_usage: Optional[Callable[[Dict], None]] = None
+        self._last_usage = None
+        # 最近一次调用的 finish_reason；合并到其他进程请求上的调用取 leader 的结果
+        self.last_finish_reason: Optional[str] = None
+        # 最近一次长文生成的续写次数
+        self.last_continuations = 0
+
+    def _preflight(self, messages: List[Dict], max_tokens: int) -> Tuple[List[Dict], int]:
+        """发送前估算 token：放不进上下文窗口时删去最早的历史，并把 max_tokens 限制在剩余窗口内
+
+        删去的历史同时从对话历史中移除，之后的请求不再携带。
+        """
+        messages, fitted_max_tokens, dropped = fit_request(messages, max_tokens, self.config.context_window)
+        if dropped:
+            logger.warning(f"Dropped {dropped} oldest history messages to fit the context window")
+            self.conversation_history.drop_oldest(dropped)
+            metrics.inc('pulitzer_llm_preflight_total', action='trimmed')
+        if fitted_max_tokens < max_tokens:
+            metrics.inc('pulitzer_llm_preflight_total', action='clamped')
+        set_attributes({'llm.preflight.dropped': dropped, 'llm.max_tokens': fitted_max_tokens})
+        return messages, fitted_max_tokens
+
+    @traced('llm.generate')
+    def generate(self, prompt: str, system_prompt: str = None,
+                 on_delta: Callable[[str], None] = None, max_tokens: int = None,
+                 should_stop: Callable[[], bool] = None, record_history: bool = True) -> str:
+        """生成回复；on_delta 会按顺序收到流式增量
+
+        max_tokens 为期望的输出长度（例如按目标篇幅估算），默认使用配置值；
+        实际值不超过 max_output_tokens 和上下文窗口的剩余部分。
+        流式生成时每个增量之后调用 should_stop，返回 True 则提前结束，已生成的内容作为结果。
+        record_history 为 False 时不把这一轮写入对话历史。
+        """
         try:
             messages = []
             if system_prompt:
                 messages.append({"role": "system", "content": system_prompt})
-            messages.extend(self.conversation_history)
+            messages.extend(self.conversation_history.to_messages())
             messages.append({"role": "user", "content": prompt})
 
+            economy = self.profile == 'economy'
+            default_max_tokens = self.config.economy_max_tokens if economy else self.config.max_tokens
+            max_tokens = min(max_tokens or default_max_tokens, self.config.max_output_tokens)
+            if economy:
+                max_tokens = min(max_tokens, self.config.economy_max_tokens)
+            try:
+                messages, max_tokens = self._preflight(messages, max_tokens)
+            except ContextWindowExceeded:
+                metrics.inc('pulitzer_llm_preflight_total', action='rejected')
+                raise
+
             request_data = {
-                "model": self.config.model,
+                "model": self.config.economy_model if economy else self.config.model,
                 "messages": messages,
                 "temperature": self.config.temperature,
-                "max_tokens": self.config.max_tokens,
+                "max_tokens": max_tokens,
                 "stream": self.config.stream
             }
+            if self.config.stream and self.config.stream_usage:
+                request_data["stream_options"] = {"include_usage": True}
 
             # 调试信息写入stderr
             print("=== LLM Request Details ===", file=sys.stderr)
@@ -131,41 +339,37 @@ class LocalLLMClient:
             print(json.dumps(request_data, indent=2, ensure_ascii=False), file=sys.stderr)
 
             try:
-                response = self.client.chat.completions.create(**request_data)
-                full_response = []
-                
-                if self.config.stream:
-                    # 流式处理
-                    current_line = []
-                    for chunk in response:
-                        if hasattr(chunk.choices[0], 'delta') and hasattr(chunk.choices[0].delta, 'content'):
-                            content = chunk.choices[0].delta.content
-                            if content:
-                                current_line.append(content)
-                                # 如果遇到换行符，打印当前行
-                                if '\n' in content:
-                                    print(f"Response: {''.join(current_line)}", file=sys.stderr)
-                                    current_line = []
-                                full_response.append(content)
-                    
-                    # 打印最后一行（如果有）
-                    if current_line:
-                        print(f"Response: {''.join(current_line)}", file=sys.stderr)
-                    
-                    complete_response = ''.join(full_response)
-                else:
-                    complete_response = response.choices[0].message.content
-                    print(f"Response: {complete_response}", file=sys.stderr)
+                # 相同的并发请求合并为一次生成，增量同时推送给所有等待者
+                self._last_usage = None
+                self.last_finish_reason = None
+                meta = {}
+
+                def lead(emit):
+                    result = self.pool.call(
+                        lambda client: self._request_completion(client, request_data, emit, should_stop),
+                        tokens=estimate_request_tokens(messages, request_data["max_tokens"])
+                    )
+                    # 随结果一起保存，follower 据此判断是否需要续写
+                    meta['finish_reason'] = self.last_finish_reason
+                    return result
+
+                complete_response = self.singleflight.run(request_key(request_data), lead, on_delta, meta)
+                self.last_finish_reason = meta.get('finish_reason')
 
                 # 保存到对话历史
-                self.conversation_history.append({
-                    "role": "user",
-                    "content": prompt
-                })
-                self.conversation_history.append({
-                    "role": "assistant",
-                    "content": complete_response
-                })
+                if record_history:
+                    self.conversation_history.append({
+                        "role": "user",
+                        "content": prompt
+                    })
+                    self.conversation_history.append({
+                        "role": "assistant",
+                        "content": complete_response
+                    })
+
+                # 合并到其他进程请求上的调用没有产生用量
+                if self._last_usage and self.on_usage:
+                    self.on_usage(self._last_usage)
 
                 return complete_response
 
@@ -185,9 +389,136 @@ class LocalLLMClient:
             traceback.print_exc(file=sys.stderr)
             raise
 
+    @traced('llm.generate_long')
+    def generate_long(self, prompt: str, system_prompt: str = None,
+                      on_delta: Callable[[str], None] = None, max_tokens: int = None,
+                      should_stop: Callable[[], bool] = None) -> str:
+        """长文生成：回复因 max_tokens 截断（finish_reason == 'length'）或流在中途断开时自动续写
+
+        续写请求带上原始提示词和已生成内容的末尾，各段拼接为一个结果，
+        on_delta 收到的增量与一次生成完整篇幅时相同。max_tokens 为整篇的期望输出长度。
+        用完续写次数后仍然断开时抛出 StreamInterrupted，partial 为已生成的全部内容。
+        """
+        total_tokens = max_tokens or self.config.max_tokens
+        emit = on_delta or (lambda delta: None)
+        try:
+            text = self.generate(prompt, system_prompt, on_delta=emit, max_tokens=total_tokens,
+                                 should_stop=should_stop, record_history=False)
+        except StreamInterrupted as e:
+            logger.warning(f"{e}; continuing from the partial response")
+            text = e.partial
+            self.last_finish_reason = 'interrupted'
+        continuations = 0
+        while (self.last_finish_reason in ('length', 'interrupted')
+               and continuations < self.config.max_continuations
+               and total_tokens > estimate_text_tokens(text)):
+            continuations += 1
+            seam = ContinuationSeam(text, emit)
+            continuation_prompt = CONTINUATION_TEMPLATE.render(
+                prompt=prompt, tail=text[-self.config.continuation_tail_chars:])
+            try:
+                self.generate(continuation_prompt, system_prompt, on_delta=seam.feed,
+                              max_tokens=total_tokens - estimate_text_tokens(text),
+                              should_stop=should_stop, record_history=False)
+            except StreamInterrupted as e:
+                logger.warning(f"{e}; continuing from the partial response")
+                self.last_finish_reason = 'interrupted'
+            text += seam.finish()
+        metrics.observe('pulitzer_llm_continuations', continuations, buckets=CONTINUATION_BUCKETS)
+        set_attributes({'llm.continuations': continuations})
+        self.last_continuations = continuations
+        if self.last_finish_reason == 'interrupted' and total_tokens > estimate_text_tokens(text):
+            raise StreamInterrupted(text, f"still interrupted after {continuations} continuations")
+        if self.last_finish_reason == 'length':
+            logger.warning(f"Long-form generation still truncated after {continuations} continuations")
+
+        # 对话历史中只保留原始提示词和完整结果
+        self.conversation_history.append({"role": "user", "content": prompt})
+        self.conversation_history.append({"role": "assistant", "content": text})
+        return text
+
+    def _request_completion(self, client, request_data: Dict, emit: Callable[[str], None],
+                            should_stop: Callable[[], bool] = None) -> str:
+        """用凭据池选中的 client 发送一次补全请求并收集完整响应，每个增量都交给 emit"""
+        started = time.perf_counter()
+        first_token_at = None
+        usage = None
+        full_response = []
+        try:
+            response = client.chat.completions.create(**request_data)
+
+            if self.config.stream:
+                # 流式处理
+                current_line = []
+                for chunk in response:
+                    usage = getattr(chunk, 'usage', None) or usage
+                    if chunk.choices and getattr(chunk.choices[0], 'finish_reason', None):
+                        self.last_finish_reason = chunk.choices[0].finish_reason
+                    if chunk.choices and hasattr(chunk.choices[0], 'delta') and hasattr(chunk.choices[0].delta, 'content'):
+                        content = chunk.choices[0].delta.content
+                        if content:
+                            if first_token_at is None:
+                                first_token_at = time.perf_counter()
+                            current_line.append(content)
+                            # 如果遇到换行符，打印当前行
+                            if '\n' in content:
+                                print(f"Response: {''.join(current_line)}", file=sys.stderr)
+                                current_line = []
+                            full_response.append(content)
+                            emit(content)
+                            if should_stop is not None and should_stop():
+                                # 关闭连接让服务端停止生成，不再为多余的 token 付费
+                                getattr(response, 'close', lambda: None)()
+                                metrics.inc('pulitzer_llm_early_stop_total', model=request_data['model'])
+                                set_attributes({'llm.early_stop': True})
+                                break
+
+                # 打印最后一行（如果有）
+                if current_line:
+                    print(f"Response: {''.join(current_line)}", file=sys.stderr)
+
+                complete_response = ''.join(full_response)
+            else:
+                complete_response = response.choices[0].message.content
+                usage = getattr(response, 'usage', None)
+                self.last_finish_reason = getattr(response.choices[0], 'finish_reason', None)
+                print(f"Response: {complete_response}", file=sys.stderr)
+                emit(complete_response)
+        except Exception as e:
+            metrics.inc('pulitzer_llm_requests_total', model=request_data['model'], status=type(e).__name__)
+            if full_response:
+                # 已经推送的增量无法撤回，不能交给凭据池从头重试；由 generate_long 从已生成的内容续写
+                raise StreamInterrupted(''.join(full_response), f"{type(e).__name__}: {e}") from e
+            raise
+
+        self._last_usage = record_llm_call(request_data['model'], request_data['messages'], started,
+                                           first_token_at, complete_response, usage)
+        return complete_response
+
     def clear_history(self):
         """清除对话历史"""
-        self.conversation_history = []
+        self.conversation_history.clear()
+
+    def summarize_history(self):
+        """把对话历史压缩成一条摘要，减少后续每次请求携带的 token
+
+        摘要请求不带对话历史；请求失败时异常向上抛出，原有的历史保持不变。
+        """
+        if not self.conversation_history:
+            return
+        messages = self.conversation_history.to_messages()
+        transcript = "\n\n".join(f"{message['role']}: {message['content']}" for message in messages)
+        history, self.conversation_history = self.conversation_history, ConversationHistory()
+        try:
+            summary = self.generate(
+                f"请将以下对话压缩为简洁的要点摘要，保留主题、大纲、已确认的事实和用户的修改意见：\n\n{transcript}",
+                "你是一个对话摘要助手，只输出摘要本身。",
+                record_history=False
+            )
+        finally:
+            self.conversation_history = history
+        self.conversation_history.clear()
+        self.conversation_history.append({"role": "system", "content": f"此前对话的摘要：\n{summary}"})
 
     def add_context(self, context: str, role: str = "system"):
         """添加上下文信息"""
@@ -196,9 +527,15 @@ class LocalLLMClient:
             "content": context
         })
 
+    def replace_context(self, context: str, prefix: str, role: str = "system"):
+        """添加上下文信息，并删去之前以 prefix 开头的同类上下文，只保留最新的一份"""
+        self.conversation_history.discard(role, prefix)
+        self.add_context(context, role)
+
 class ContentPrompts:
     """Collection of prompts for the content collaboration system"""
     @staticmethod
+    @static_prompt
     def get_initial_system_prompt() -> str:
         return """You are an experienced journalist and high-level content creator working to help users create quality content through an interactive process. Your role combines professional journalism skills with content creation expertise.
 
@@ -238,12 +575,14 @@ class ContentPrompts:
 
     
     @staticmethod
+    @static_prompt
     def get_outline_system_prompt() -> str:
         return """You are an experienced journalist and content creator. 
         Create a well-structured outline for the content per the user's request and word count requirement.
         The outline should have clear sections and subsections."""
     
     @staticmethod
+    @static_prompt
     def get_interview_system_prompt() -> str:
         return """You are an experienced interviewer. Generate thoughtful, casual toned,probing questions that will help extract detailed information from the interviewee to help you build the article according to the given content type, outline and word count.
         1. Your question should focus on a specific aspect of the section that requires more detail or clarity.
@@ -251,36 +590,350 @@ class ContentPrompts:
         3. Use simple language and clear structure."""
     
     @staticmethod
+    @static_prompt
     def get_analysis_system_prompt() -> str:
         return """You are an expert editor analyzing interview responses.
         Determine if the content meets the specified criteria based on completeness, depth, and quality."""
     
     @staticmethod
+    @static_prompt
     def get_draft_system_prompt() -> str:
         return """You are an expert content creator synthesizing interview responses into a cohesive article.
         Maintain the interviewee's voice and style while ensuring professional quality and engaging flow."""
 
+    @staticmethod
+    @static_prompt
+    def get_revision_system_prompt() -> str:
+        return """You are an experienced editor revising a draft according to the author's feedback.
+        Change only what the feedback asks for and keep the author's voice, structure and Markdown formatting."""
+
+# 预编译的提示词模板，静态部分的 token 数在导入时计算一次
+OUTLINE_SYSTEM_TEMPLATE = PromptTemplate("""You are an expert content creator specializing in creating outlines for various document types.
+        Your task is to create a clear, structured outline appropriate for a {target_length}-word {content_type}.
+        The outline should follow standard conventions for the specific content type while ensuring appropriate depth and coverage.
+        
+        Additional requirements:
+        {settings}
+        
+        IMPORTANT: Return ONLY valid JSON in this exact format:
+        {{
+            "section_name": ["subsection1", "subsection2",...],
+            "another_section": ["subsection1", "subsection2",...]
+        }}""")
+
+OUTLINE_USER_TEMPLATE = PromptTemplate("""Create a detailed outline for a {target_length}-word {content_type} about: {topic}
+
+        Requirements:
+        1. Follow standard {content_type} format and structure
+        2. Design sections to fit within {target_length} words
+        3. Include all essential elements for this type of {content_type}
+        4. Ensure logical progression
+        5. Balance section lengths appropriately
+        6. Consider these specific settings:
+        {settings}
+        
+        Return ONLY a JSON object with appropriate sections and subsections.""")
+
+# 面试上下文消息的开头，新的上下文替换对话历史中的上一份
+INTERVIEW_CONTEXT_PREFIX = "Previous responses for section"
+
+INTERVIEW_CONTEXT_TEMPLATE = PromptTemplate(INTERVIEW_CONTEXT_PREFIX + """ '{current_section}':
+        {responses}
+        
+        Current outline:
+        {outline}
+        """)
+
+QUESTION_DEDUP_TEMPLATE = PromptTemplate("""{prompt}
+        
+        This question has already been asked: "{duplicate}"
+        Ask about a different aspect of this section instead.""")
+
+# 跳过当前部分的输入；回答超过 PROBE_MIN_WORDS 个词时才考虑追问
+INTERVIEW_SKIP_WORDS = {'skip', 'next', 'move on', 'continue', '跳过', '下一个', '继续'}
+PROBE_MIN_WORDS = 20
+
+PROBE_DEEPER_TEMPLATE = PromptTemplate("""Previous response: {response}
+        
+        Should this response be followed up with more probing questions?
+        Consider:
+        1. Are there unexplored aspects?
+        2. Could more details enhance the content?
+        3. Are there missing examples or evidence?
+        4. Would emotional/experiential content add value?
+        5. Does the word count limit allow for more depth?
+        
+        Respond with only 'yes' or 'no'.""")
+
+INTERVIEW_QUESTION_TEMPLATE = PromptTemplate("""Generate a question for the '{current_section}' section.
+        
+        Context:
+        {context}
+        
+        Requirements:
+        1. Focus on specific details needed for this section
+        2. Consider previous responses
+        3. Align with content type and settings
+        4. Use clear, conversational language
+        5. Ask one focused question at a time""")
+
+DRAFT_TEMPLATE = PromptTemplate("""Generate a complete draft based on the interview responses.
+        
+        Context:
+        {context}
+        
+        Requirements:
+        1. Follow the outline structure
+        2. Incorporate interview responses naturally
+        3. Maintain consistent style and tone
+        4. Target approximately {target_length} words
+        5. Format in Markdown
+        6. Consider all settings and requirements
+        
+        Return the complete draft in Markdown format.""")
+
+CONTINUATION_TEMPLATE = PromptTemplate("""{prompt}
+        
+        Your previous reply was cut off by the length limit. It ended with:
+        
+        {tail}
+        
+        Continue exactly where it stops, even in the middle of a sentence. Do not repeat any of the text above and do not add any preamble.""")
+
+# 从检查点续写时至少留给剩余部分的输出 token
+DRAFT_RESUME_MIN_TOKENS = 512
+
+DRAFT_CONTINUE_TEMPLATE = PromptTemplate("""{prompt}
+        
+        The beginning of the draft has already been written:
+        
+        {partial}
+        
+        Continue the draft from the next paragraph. Do not repeat anything already written.""")
+
+OUTLINE_REVISION_TEMPLATE = PromptTemplate("""You are an expert content organizer.
+            Current outline:
+            {outline}
+            
+            User feedback:
+            {user_input}
+            
+            Modify the outline according to the feedback while:
+            1. Maintaining logical structure
+            2. Ensuring appropriate depth
+            3. Following {content_type} conventions
+            4. Considering the target length of {target_length} words
+            
+            Return ONLY the modified outline as a JSON object.""")
+
+FEEDBACK_ANALYSIS_TEMPLATE = PromptTemplate("""Analyze this feedback for the draft:
+        {user_input}
+        
+        Categorize the feedback into these aspects:
+        1. Content
+        2. Structure
+        3. Style
+        4. Length
+        5. Other
+        
+        Return the analysis in JSON format.""")
+
+DRAFT_REVISION_TEMPLATE = PromptTemplate("""Original draft:
+            {draft}
+            
+            User feedback:
+            {user_input}
+            
+            Feedback analysis:
+            {analysis}
+            
+            Requirements:
+            1. Address all feedback points
+            2. Maintain consistent style
+            3. Keep the structure clear
+            4. Target {target_length} words
+            5. Consider these settings:
+            {settings}
+            
+            Return the complete revised draft in Markdown format.""")
+
+SECTION_REVISION_TEMPLATE = PromptTemplate("""Section to revise:
+        {section}
+
+        Other sections of the draft: {other_sections}
+
+        User feedback:
+        {user_input}
+
+        Feedback analysis:
+        {analysis}
+
+        Requirements:
+        1. Address the feedback points that concern this section
+        2. Keep the section heading unchanged
+        3. Maintain consistent style with the rest of the draft
+        4. Consider these settings:
+        {settings}
+
+        Return only the revised section in Markdown format.""")
+
+
 class ContentCollaborator:
     def __init__(self, llm_config: LLMConfig = None):
+        # 大纲和设置的版本号，提示词片段按版本缓存
+        self._versions = {'outline': 0, 'settings': 0}
+        self.fragments = FragmentCache()
         self.state = CollabState.TOPIC_SELECTION
         self.topic = ""
         self.content_type = ""
         self.target_length = 0
         self.outline = {}
-        self.interview_responses = []
+        self.interview_responses = InterviewLog()
         self.current_section = None
-        self.draft = ""
+        self.draft = DraftDocument()
+        self.analytics = DraftAnalytics()
         self.settings = {}  # 添加设置字段
         self.config = llm_config or LLMConfig()  # 保存配置
         self.llm = LocalLLMClient(self.config)   # 使用配置创建LLM客户端
+        self.llm.on_usage = self._record_usage
+        self.usage = UsageLedger(self.config.session_token_budget)
         self._last_question = ""
+        # 上一次响应中各上下文字段的哈希，用于只返回变化的字段
+        self._sent_context: Dict[str, str] = {}
+        # 每次返回上下文加一；调用方带回它持有的版本，不一致时说明有响应丢失，需要返回全部字段
+        self.context_version = 0
+        # 会话 id 由 SessionManager 设置；owner 为调用方提供的用户 id，问答索引按用户跨会话共享
+        self.session_id = ''
+        self.owner = ''
+        self._answer_index: Optional[AnswerIndex] = None
+        # 草稿检查点保存在会话存储中，由 SessionManager 设置；草稿随会话状态保存后删除检查点
+        self.checkpoint_store: Optional[SessionStore] = None
+        self.draft_checkpoint_done = False
+        # 超出预算后需要压缩对话历史，在轮次结束时进行
+        self.summary_pending = False
+
+    @property
+    def outline(self) -> Dict:
+        return self._outline
+
+    @outline.setter
+    def outline(self, value: Dict):
+        self._outline = value
+        self._versions['outline'] += 1
+
+    @property
+    def settings(self) -> Dict:
+        return self._settings
+
+    @settings.setter
+    def settings(self, value: Dict):
+        self._settings = value
+        self._versions['settings'] += 1
+
+    def _fragment(self, name: str, depth: int = 0) -> Fragment:
+        """大纲、设置或回答列表序列化后的提示词片段；回答只会追加，以回答数作为版本"""
+        if name == 'responses':
+            return self.fragments.json(name, len(self.interview_responses), self.interview_responses.to_list, depth)
+        return self.fragments.json(name, self._versions[name], getattr(self, name), depth)
+
+    def needs_resync(self, known_version) -> bool:
+        """调用方持有的上下文版本（缺失、响应丢失或服务重启）与上一次响应不一致"""
+        return known_version != self.context_version
+
+    def context_delta(self, context: Dict, known_version=None) -> Dict:
+        """只保留自上一次响应以来值发生变化的上下文字段
+
+        known_version 为调用方持有的上下文版本，与上一次响应的版本不一致时返回全部字段。
+        返回后 context_version 加一，随响应一起交给调用方。
+        """
+        hashes = {key: content_hash(json.dumps(value, sort_keys=True, ensure_ascii=False))
+                  for key, value in context.items()}
+        if not self.needs_resync(known_version):
+            context = {key: value for key, value in context.items() if self._sent_context.get(key) != hashes[key]}
+        self._sent_context.update(hashes)
+        self.context_version += 1
+        return context
+
+    def _record_usage(self, usage: Dict):
+        """按当前状态和调用档位记账，超出预算时切换到便宜档位，并在本轮结束时压缩对话历史
+
+        这里是一次已经成功的调用的回调，不能再发起可能失败的 LLM 调用。
+        """
+        self.usage.record(
+            state=self.state.value,
+            profile=self.llm.profile,
+            model=usage['model'],
+            prompt_tokens=usage['prompt_tokens'],
+            completion_tokens=usage['completion_tokens'],
+            reported=usage['reported']
+        )
+        if self.usage.over_budget and self.llm.profile != 'economy':
+            logger.warning(f"Session token budget {self.usage.budget} exceeded, switching to economy profile")
+            self.llm.profile = 'economy'
+            self.summary_pending = True
+
+    def _summarize_if_pending(self):
+        """轮次结束时压缩对话历史；失败时保留原历史，下一轮再试"""
+        if not self.summary_pending:
+            return
+        try:
+            self.llm.summarize_history()
+            self.summary_pending = False
+        except Exception as e:
+            logger.warning(f"Failed to summarize conversation history, will retry next turn: {e}")
+
+    def to_dict(self) -> Dict:
+        """导出可持久化的会话状态"""
+        return {
+            'state': self.state.value,
+            'topic': self.topic,
+            'content_type': self.content_type,
+            'target_length': self.target_length,
+            'outline': self.outline,
+            'interview_responses': self.interview_responses.to_dict(),
+            'current_section': self.current_section,
+            'draft': self.draft.to_dict(),
+            'settings': self.settings,
+            'last_question': self._last_question,
+            'owner': self.owner,
+            'sent_context': self._sent_context,
+            'context_version': self.context_version,
+            'conversation_history': self.llm.conversation_history.to_messages(),
+            'llm_profile': self.llm.profile,
+            'summary_pending': self.summary_pending,
+            'usage': self.usage.to_dict()
+        }
+
+    def load_state(self, data: Dict):
+        """从持久化的会话状态恢复"""
+        self.state = CollabState(data.get('state', CollabState.TOPIC_SELECTION.value))
+        self.topic = data.get('topic', '')
+        self.content_type = data.get('content_type', '')
+        self.target_length = data.get('target_length', 0)
+        self.outline = data.get('outline', {})
+        self.interview_responses = InterviewLog.from_data(data.get('interview_responses'))
+        self.fragments = FragmentCache()
+        self.current_section = data.get('current_section')
+        self.draft = DraftDocument.from_data(data.get('draft'))
+        self.settings = data.get('settings', {})
+        self._last_question = data.get('last_question', '')
+        self.owner = data.get('owner', '')
+        self._sent_context = data.get('sent_context', {})
+        self.context_version = data.get('context_version', 0)
+        self.llm.conversation_history = ConversationHistory.from_data(data.get('conversation_history'))
+        self.llm.profile = data.get('llm_profile', 'standard')
+        self.summary_pending = data.get('summary_pending', False)
+        self.usage = UsageLedger.from_dict(data.get('usage'), self.config.session_token_budget)
         
+    @traced('collaborator.initialize')
     def initialize(self, topic: str, content_type: str, target_length: int, settings: dict = None):
         """初始化协作器的设置"""
         self.topic = topic
         self.content_type = content_type
         self.target_length = target_length
         self.settings = settings or {}
+        if self.settings.get('tokenBudget'):
+            self.usage.budget = int(self.settings['tokenBudget'])
         
         # 生成初始大纲
         self.outline = self._generate_initial_outline()
@@ -288,6 +941,7 @@ class ContentCollaborator:
         
         return self.outline
 
+    @traced('collaborator.generate_outline')
     def _generate_initial_outline(self) -> Dict:
         """生成初始大纲，考虑设置和要求"""
         try:
@@ -319,69 +973,75 @@ class ContentCollaborator:
                     json_str = outline_str[start_idx:end_idx]
                     outline = json.loads(json_str)
                     if outline:
+                        metrics.inc('pulitzer_outline_parse_total', result='ok')
                         return outline
             except json.JSONDecodeError:
                 print("Error parsing outline JSON", file=sys.stderr)
 
             # 如果解析失败，返回默认大纲
+            metrics.inc('pulitzer_outline_parse_total', result='fallback')
             return self._get_default_outline()
         except Exception as e:
             print(f"Error generating outline: {e}", file=sys.stderr)
             traceback.print_exc(file=sys.stderr)  # 打印完整的错误堆栈
+            metrics.inc('pulitzer_outline_parse_total', result='llm_error')
             return self._get_default_outline()
 
     def _get_outline_system_prompt(self) -> str:
         """获取大纲生成的系统提示"""
-        return f"""You are an expert content creator specializing in creating outlines for various document types.
-        Your task is to create a clear, structured outline appropriate for a {self.target_length}-word {self.content_type}.
-        The outline should follow standard conventions for the specific content type while ensuring appropriate depth and coverage.
-        
-        Additional requirements:
-        {json.dumps(self.settings, indent=2, ensure_ascii=False)}
-        
-        IMPORTANT: Return ONLY valid JSON in this exact format:
-        {{
-            "section_name": ["subsection1", "subsection2",...],
-            "another_section": ["subsection1", "subsection2",...]
-        }}"""
+        return OUTLINE_SYSTEM_TEMPLATE.render(
+            target_length=self.target_length,
+            content_type=self.content_type,
+            settings=self._fragment('settings')
+        )
 
     def _get_outline_user_prompt(self) -> str:
         """获取大纲生成的用户提示"""
-        return f"""Create a detailed outline for a {self.target_length}-word {self.content_type} about: {self.topic}
-
-        Requirements:
-        1. Follow standard {self.content_type} format and structure
-        2. Design sections to fit within {self.target_length} words
-        3. Include all essential elements for this type of {self.content_type}
-        4. Ensure logical progression
-        5. Balance section lengths appropriately
-        6. Consider these specific settings:
-        {json.dumps(self.settings, indent=2, ensure_ascii=False)}
-        
-        Return ONLY a JSON object with appropriate sections and subsections."""
+        return OUTLINE_USER_TEMPLATE.render(
+            target_length=self.target_length,
+            content_type=self.content_type,
+            topic=self.topic,
+            settings=self._fragment('settings')
+        )
 
+    @traced('collaborator.interview')
     def _handle_interview(self, user_input: str) -> str:
         """处理面试阶段的输入"""
+        if user_input.strip().lower() in INTERVIEW_SKIP_WORDS:
+            return self._move_to_next_section_or_draft()
+
         # 记录用户回答
         self.interview_responses.append({
             'section': self.current_section,
             'question': self._last_question,
             'answer': user_input
         })
+        self._remember_answer(self._last_question, user_input)
 
-        # 添加上下文信息
-        context = f"""Previous responses for section '{self.current_section}':
-        {json.dumps(self.interview_responses, indent=2, ensure_ascii=False)}
-        
-        Current outline:
-        {json.dumps(self.outline, indent=2, ensure_ascii=False)}
-        """
+        # 添加上下文信息：它已经包含全部回答，替换上一份而不是追加，对话历史不随回答数平方增长
+        context = INTERVIEW_CONTEXT_TEMPLATE.render(
+            current_section=self.current_section,
+            responses=self._fragment('responses'),
+            outline=self._fragment('outline')
+        )
         
-        self.llm.add_context(context)
+        self.llm.replace_context(context, INTERVIEW_CONTEXT_PREFIX)
 
         # 分析回答并生成后续问题
         return self._generate_follow_up_question(user_input)
 
+    def _generate_follow_up_question(self, user_input: str) -> str:
+        """回答较长且值得深挖时继续追问当前部分，否则进入下一部分"""
+        if count_words(user_input) > PROBE_MIN_WORDS and self._should_probe_deeper(user_input):
+            return self._generate_interview_question()
+        return self._move_to_next_section_or_draft()
+
+    def _should_probe_deeper(self, response: str) -> bool:
+        """让模型判断这个回答是否需要追问；判断过程不写入对话历史"""
+        result = self.llm.generate(PROBE_DEEPER_TEMPLATE.render(response=response),
+                                   ContentPrompts.get_analysis_system_prompt(), record_history=False)
+        return bool(result) and result.lower().strip().startswith('yes')
+
     def _move_to_next_section_or_draft(self) -> str:
         """移动到下一个部分或开始生成草稿"""
         sections = list(self.outline.keys())
@@ -391,68 +1051,154 @@ class ContentCollaborator:
             self.current_section = sections[current_index + 1]
             return self._generate_interview_question()
         else:
-            self.draft = self._generate_draft()
-            self.state = CollabState.DRAFT_REVIEW
-            return f"基于我们的讨论，我生成了以下草稿：\n\n{self.draft}\n\n您觉得这个草稿怎么样？需要修改吗？"
+            draft = self.generate_draft()
+            return f"基于我们的讨论，我生成了以下草稿：\n\n{draft}\n\n您觉得这个草稿怎么样？需要修改吗？"
+
+    def generate_draft(self) -> str:
+        """结束面试，根据已有的回答生成草稿并进入草稿审查，返回草稿的 Markdown"""
+        self.draft.replace_from_markdown(self._generate_draft())
+        self.state = CollabState.DRAFT_REVIEW
+        self._summarize_if_pending()
+        return self.draft.render()
 
+    @traced('collaborator.interview_question')
     def _generate_interview_question(self) -> str:
         """生成针对当前部分的面试问题"""
-        context = {
-            'topic': self.topic,
-            'content_type': self.content_type,
-            'current_section': self.current_section,
-            'outline': self.outline,
-            'previous_responses': self.interview_responses,
-            'settings': self.settings
+        fields = {
+            'topic': json_value(self.topic),
+            'content_type': json_value(self.content_type),
+            'current_section': json_value(self.current_section),
+            'outline': self._fragment('outline', depth=1),
+            'previous_responses': self._fragment('responses', depth=1),
+            'settings': self._fragment('settings', depth=1)
         }
+        related = self._related_answers()
+        if related:
+            fields['related_answers_from_past_sessions'] = self.fragments.json(
+                'related_answers', tuple(entry['at'] for entry in related),
+                lambda: [compact(entry) for entry in related], depth=1)
+        context = json_object(fields)
         
-        prompt = f"""Generate a question for the '{self.current_section}' section.
-        
-        Context:
-        {json.dumps(context, indent=2, ensure_ascii=False)}
-        
-        Requirements:
-        1. Focus on specific details needed for this section
-        2. Consider previous responses
-        3. Align with content type and settings
-        4. Use clear, conversational language
-        5. Ask one focused question at a time"""
+        prompt = INTERVIEW_QUESTION_TEMPLATE.render(current_section=self.current_section, context=context)
         
         question = self.llm.generate(prompt, ContentPrompts.get_interview_system_prompt())
+        duplicate = self._find_duplicate_question(question)
+        if duplicate:
+            # 与问过的问题几乎相同：去掉这一轮，换一个角度重新生成一次
+            self.llm.conversation_history.drop_newest(2)
+            retry = QUESTION_DEDUP_TEMPLATE.render(prompt=prompt, duplicate=duplicate['question'])
+            question = self.llm.generate(retry, ContentPrompts.get_interview_system_prompt())
+            still_duplicate = self._find_duplicate_question(question)
+            metrics.inc('pulitzer_question_dedup_total', result='kept' if still_duplicate else 'regenerated')
+            set_attributes({'interview.duplicate_similarity': duplicate['similarity']})
         self._last_question = question
         return question
 
+    @property
+    def answer_index(self) -> AnswerIndex:
+        if self._answer_index is None:
+            self._answer_index = AnswerIndex(self.owner or self.session_id)
+        return self._answer_index
+
+    def _remember_answer(self, question: str, answer: str):
+        """把问答加入向量索引；索引失败不影响面试"""
+        try:
+            self.answer_index.add(self.session_id, self.current_section, question, answer)
+        except Exception as e:
+            logger.warning(f"Answer index update failed: {e}")
+
+    def _find_duplicate_question(self, question: str) -> Optional[Dict]:
+        """返回与 question 几乎相同的已问过的问题"""
+        try:
+            return self.answer_index.similar_questions([question])[0]
+        except Exception as e:
+            logger.warning(f"Answer index lookup failed: {e}")
+            return None
+
+    def _related_answers(self) -> List[Dict]:
+        """该用户在其他会话中与当前部分相关的回答"""
+        section_items = self.outline.get(self.current_section) if isinstance(self.outline, dict) else None
+        query = f"{self.topic} {self.current_section} {json.dumps(section_items, ensure_ascii=False)}"
+        try:
+            return self.answer_index.related_answers(query, exclude_session=self.session_id)
+        except Exception as e:
+            logger.warning(f"Answer index lookup failed: {e}")
+            return []
+
+    @traced('collaborator.generate_draft')
     def _generate_draft(self) -> str:
         """根据面试响应生成内容草稿"""
-        context = {
-            'topic': self.topic,
-            'content_type': self.content_type,
-            'outline': self.outline,
-            'responses': self.interview_responses,
-            'settings': self.settings,
-            'target_length': self.target_length
-        }
-        
-        prompt = f"""Generate a complete draft based on the interview responses.
-        
-        Context:
-        {json.dumps(context, indent=2, ensure_ascii=False)}
-        
-        Requirements:
-        1. Follow the outline structure
-        2. Incorporate interview responses naturally
-        3. Maintain consistent style and tone
-        4. Target approximately {self.target_length} words
-        5. Format in Markdown
-        6. Consider all settings and requirements
-        
-        Return the complete draft in Markdown format."""
+        context = json_object({
+            'topic': json_value(self.topic),
+            'content_type': json_value(self.content_type),
+            'outline': self._fragment('outline', depth=1),
+            'responses': self._fragment('responses', depth=1),
+            'settings': self._fragment('settings', depth=1),
+            'target_length': json_value(self.target_length)
+        })
         
-        draft = self.llm.generate(prompt, ContentPrompts.get_draft_system_prompt())
+        prompt = DRAFT_TEMPLATE.render(context=context, target_length=self.target_length)
+
+        # 同一篇草稿（主题、类型、大纲、面试回答、篇幅和设置不变）上次生成中断时，从检查点继续；
+        # 之后又回答了问题时不能沿用按旧回答写的草稿
+        key = content_hash(json.dumps([self.topic, self.content_type, self.outline, self.interview_responses.to_list(),
+                                       self.target_length, self.settings], sort_keys=True, ensure_ascii=False))
+        checkpoint = DraftCheckpoint(self.checkpoint_store, self.session_id, key)
+        if checkpoint.complete:
+            metrics.inc('pulitzer_draft_resumed_total', result='complete')
+            set_attributes({'draft.resumed_chars': len(checkpoint.text)})
+            self.draft_checkpoint_done = True
+            return checkpoint.text
+        prefix = ''
+        if checkpoint.text:
+            metrics.inc('pulitzer_draft_resumed_total', result='partial')
+            set_attributes({'draft.resumed_chars': len(checkpoint.text)})
+            prompt = DRAFT_CONTINUE_TEMPLATE.render(prompt=prompt, partial=checkpoint.text)
+            prefix = checkpoint.text + '\n\n'
+
+        # 边生成边统计字数，明显超出目标篇幅时在段落结束处停止；每写完一个段落更新检查点
+        progress = StreamingStats()
+        progress.feed(prefix)
+        parts = [prefix]
+
+        def on_delta(delta: str):
+            progress.feed(delta)
+            parts.append(delta)
+            if progress.at_paragraph_break:
+                checkpoint.update(''.join(parts)[:progress.completed_length].rstrip())
+
+        try:
+            # 长篇草稿可能超出单次 max_tokens，被截断时自动续写
+            draft = prefix + self.llm.generate_long(prompt, ContentPrompts.get_draft_system_prompt(),
+                                                    on_delta=on_delta,
+                                                    max_tokens=self._draft_max_tokens(prefix),
+                                                    should_stop=lambda: progress.should_stop(self.target_length))
+        except Exception:
+            # 保存到最后一个写完的段落，下次从这里继续
+            checkpoint.update(''.join(parts)[:progress.completed_length].rstrip(), force=True)
+            raise
+        draft = progress.trim(draft)
+        checkpoint.finish(draft)
+        self.draft_checkpoint_done = True
+        set_attributes({'draft.words': progress.word_count, 'draft.target_length': self.target_length,
+                        'draft.continuations': self.llm.last_continuations})
+        logger.info(f"Draft generated: {progress.word_count} words, {self.llm.last_continuations} continuations")
         return draft
 
+    def _draft_max_tokens(self, written: str = '') -> int:
+        """按目标篇幅估算完整草稿需要的输出 token 数，不低于默认的 max_tokens；
+        从检查点续写时扣除已写部分（written）的 token
+        """
+        total = max(estimate_output_tokens(self.target_length, f"{self.topic} {self.content_type}"),
+                    self.config.max_tokens)
+        if not written:
+            return total
+        return max(total - estimate_text_tokens(written), DRAFT_RESUME_MIN_TOKENS)
+
+    @traced('collaborator.process_user_input')
     def process_user_input(self, user_input: str) -> str:
         """处理用户输入并返回适当的响应"""
+        set_attributes({'collab.state': self.state.value, 'collab.section': self.current_section})
         try:
             if self.state == CollabState.OUTLINE_REVIEW:
                 return self._handle_outline_review(user_input)
@@ -465,7 +1211,10 @@ class ContentCollaborator:
         except Exception as e:
             print(f"Error processing user input: {e}")
             return f"处理输入时出错: {str(e)}"
+        finally:
+            self._summarize_if_pending()
 
+    @traced('collaborator.outline_review')
     def _handle_outline_review(self, user_input: str) -> str:
         """处理大纲审查阶段的输入"""
         if user_input.lower() in ['y', 'yes', 'ok', '好的', '可以']:
@@ -482,20 +1231,12 @@ class ContentCollaborator:
                 return "大纲已更新。您觉得现在的大纲怎么样？如果满意，请输入'yes'继续。"
             
             # 处理自然语言的修改建议
-            system_prompt = f"""You are an expert content organizer.
-            Current outline:
-            {json.dumps(self.outline, indent=2, ensure_ascii=False)}
-            
-            User feedback:
-            {user_input}
-            
-            Modify the outline according to the feedback while:
-            1. Maintaining logical structure
-            2. Ensuring appropriate depth
-            3. Following {self.content_type} conventions
-            4. Considering the target length of {self.target_length} words
-            
-            Return ONLY the modified outline as a JSON object."""
+            system_prompt = OUTLINE_REVISION_TEMPLATE.render(
+                outline=self._fragment('outline'),
+                user_input=user_input,
+                content_type=self.content_type,
+                target_length=self.target_length
+            )
             
             modified_outline = self.llm.generate(prompt=user_input, system_prompt=system_prompt)
             
@@ -514,6 +1255,7 @@ class ContentCollaborator:
             print(f"Error handling outline review: {e}")
             return "处理大纲修改时出错，请重试或提供更清晰的修改建议。"
 
+    @traced('collaborator.draft_review')
     def _handle_draft_review(self, user_input: str) -> str:
         """处理草稿审查阶段的输入"""
         if user_input.lower() in ['y', 'yes', 'ok', '好的', '可以']:
@@ -521,49 +1263,51 @@ class ContentCollaborator:
             return "太好了！内容创作已完成。您可以使用这个最终版本了。"
         
         # 分析修改建议
-        analysis_prompt = f"""Analyze this feedback for the draft:
-        {user_input}
-        
-        Categorize the feedback into these aspects:
-        1. Content
-        2. Structure
-        3. Style
-        4. Length
-        5. Other
-        
-        Return the analysis in JSON format."""
+        analysis_prompt = FEEDBACK_ANALYSIS_TEMPLATE.render(user_input=user_input)
         
         try:
             analysis = self.llm.generate(analysis_prompt, ContentPrompts.get_analysis_system_prompt())
             
+            # 修改意见只涉及部分章节时，只发送并替换这些章节
+            targets = self.draft.find_sections(user_input)
+            if targets and len(targets) < len(self.draft):
+                changed = []
+                for chunk in targets:
+                    changed += self.draft.replace_section(chunk.id, self._revise_section(chunk, user_input, analysis))
+                revised = self.draft.render_chunks(changed)
+                return f"我已根据您的建议修改了以下部分：\n\n{revised}\n\n您觉得这个版本怎么样？如果满意，请输入'yes'完成；如果还需要修改，请告诉我具体的建议。"
+
             # 生成修改后的草稿
-            revision_prompt = f"""Original draft:
-            {self.draft}
-            
-            User feedback:
-            {user_input}
-            
-            Feedback analysis:
-            {analysis}
-            
-            Requirements:
-            1. Address all feedback points
-            2. Maintain consistent style
-            3. Keep the structure clear
-            4. Target {self.target_length} words
-            5. Consider these settings:
-            {json.dumps(self.settings, indent=2, ensure_ascii=False)}
-            
-            Return the complete revised draft in Markdown format."""
+            revision_prompt = DRAFT_REVISION_TEMPLATE.render(
+                draft=self.draft.render(),
+                user_input=user_input,
+                analysis=analysis,
+                target_length=self.target_length,
+                settings=self._fragment('settings')
+            )
             
-            revised_draft = self.llm.generate(revision_prompt, ContentPrompts.get_revision_system_prompt())
-            self.draft = revised_draft
+            revised_draft = self.llm.generate(revision_prompt, ContentPrompts.get_revision_system_prompt(),
+                                              max_tokens=self._draft_max_tokens())
+            self.draft.replace_from_markdown(revised_draft)
             
             return f"我已根据您的建议修改了草稿：\n\n{self.draft}\n\n您觉得这个版本怎么样？如果满意，请输入'yes'完成；如果还需要修改，请告诉我具体的建议。"
         except Exception as e:
             print(f"Error in draft revision: {e}")
             return "抱歉，修改草稿时出错。请提供更具体的修改建议，或者输入'yes'接受当前版本。"
 
+    @traced('collaborator.revise_section')
+    def _revise_section(self, chunk, user_input: str, analysis: str) -> str:
+        """只修订草稿中的一个章节，其余章节仅提供标题作为上下文"""
+        set_attributes({'draft.section': chunk.title})
+        prompt = SECTION_REVISION_TEMPLATE.render(
+            section=chunk.content,
+            other_sections=', '.join(c.title for c in self.draft if c.id != chunk.id and c.title),
+            user_input=user_input,
+            analysis=analysis,
+            settings=self._fragment('settings')
+        )
+        return self.llm.generate(prompt, ContentPrompts.get_revision_system_prompt())
+
     def _get_default_outline(self) -> Dict:
         """根据内容类型返回默认大纲"""
         content_type = self.content_type.lower()
@@ -660,27 +1404,92 @@ class ContentCollaborator:
 
 # 添加会话管理
 class SessionManager:
-    def __init__(self):
+    def __init__(self, store: SessionStore = None):
         self.sessions: Dict[str, ContentCollaborator] = {}
         # 使用默认配置创建 LLMConfig
         self.config = LLMConfig()
+        # 会话状态以持久化存储为准，内存中只是缓存
+        self.store = store or SessionStore()
+        # 内存中的会话对应的存储文件标识，用来发现其他进程或 worker 保存过的会话
+        self._stamps: Dict[str, Optional[Tuple[int, int]]] = {}
+        self._search_index: Optional[SearchIndex] = None
+
+    def _is_stale(self, session_id: str) -> bool:
+        return self.store.stamp(session_id) != self._stamps.get(session_id)
 
     def get_or_create_session(self, session_id: str) -> ContentCollaborator:
-        """获取或创建会话，确保会话存在"""
+        """获取或创建会话，确保会话存在
+
+        内存中的会话在此期间被其他 worker 保存过时（例如本 worker 被摘除又重新加入），
+        丢弃内存中的副本，从存储重新加载。
+        """
+        if session_id in self.sessions and self._is_stale(session_id):
+            logger.info(f"Session {session_id} was saved elsewhere, reloading it from the store")
+            del self.sessions[session_id]
         if session_id not in self.sessions:
-            self.sessions[session_id] = ContentCollaborator(self.config)
+            collaborator = ContentCollaborator(self.config)
+            collaborator.session_id = session_id
+            collaborator.checkpoint_store = self.store
+            # 先取标识再读取：读取期间被替换时下一次会重新加载，而不会漏掉
+            self._stamps[session_id] = self.store.stamp(session_id)
+            state = self.store.load(session_id)
+            if state:
+                collaborator.load_state(state)
+            self.sessions[session_id] = collaborator
         return self.sessions[session_id]
 
+    def save_session(self, session_id: str):
+        """把会话状态写入持久化存储，并增量更新搜索索引"""
+        if session_id in self.sessions:
+            collaborator = self.sessions[session_id]
+            self.store.save(session_id, collaborator.to_dict())
+            self._stamps[session_id] = self.store.stamp(session_id)
+            if collaborator.draft_checkpoint_done:
+                # 草稿已经随会话状态保存，检查点不再需要
+                self.store.clear_checkpoint(session_id)
+                collaborator.draft_checkpoint_done = False
+            self._index(lambda index: index.index_collaborator(session_id, self.sessions[session_id]))
+
+    def _index(self, update):
+        """更新搜索索引；索引失败不影响本轮对话"""
+        try:
+            with tracer.span('search_index.update'):
+                if self._search_index is None:
+                    self._search_index = SearchIndex()
+                update(self._search_index)
+        except Exception as e:
+            logger.warning(f"Search index update failed: {e}")
+
+    def evict_session(self, session_id: str) -> bool:
+        """保存并从内存中移除会话，交给其他 worker 接管
+
+        存储中的版本比内存中的新时直接丢弃内存中的副本，不覆盖其他 worker 的修改。
+        """
+        if session_id not in self.sessions:
+            return False
+        if self._is_stale(session_id):
+            logger.info(f"Session {session_id} was saved elsewhere, dropping the stale copy")
+        else:
+            self.save_session(session_id)
+        del self.sessions[session_id]
+        self._stamps.pop(session_id, None)
+        return True
+
     def end_session(self, session_id: str) -> bool:
         """结束并清理会话"""
+        removed = self.store.delete(session_id)
+        self._index(lambda index: index.delete_session(session_id))
+        self._stamps.pop(session_id, None)
         if session_id in self.sessions:
             del self.sessions[session_id]
             return True
-        return False
+        return removed
 
 # 创建全局会话管理器
 session_manager = SessionManager()
+turn_store = TurnStore()
 
+@traced('handle_command')
 def handle_command(session_id, input_data, context):
     """处理各种命令"""
     try:
@@ -700,6 +1509,24 @@ def handle_command(session_id, input_data, context):
             result = handle_initialize_session(session_id, command_data, context)
             logger.info(f"Initialized session: success={result['status']}")
             return result
+
+        # 处理生成草稿命令
+        elif command_type == 'GENERATE_DRAFT':
+            result = handle_generate_draft(session_id, command_data, context)
+            logger.info(f"Generated draft: success={result['status']}")
+            return result
+
+        # 处理修改草稿命令
+        elif command_type == 'REVISE_DRAFT':
+            result = handle_revise_draft(session_id, command_data, context)
+            logger.info(f"Revised draft: success={result['status']}")
+            return result
+
+        # 处理结束会话命令
+        elif command_type == 'END_SESSION':
+            ended = session_manager.end_session(session_id)
+            logger.info(f"Ended session {session_id}: existed={ended}")
+            return {"status": "success", "data": {"ended": ended}}
         
         # 未知命令
         else:
@@ -769,8 +1596,10 @@ def handle_generate_outline(session_id, data, context):
                 outline = json.loads(json_str)
             else:
                 raise ValueError("No JSON found in response")
+            metrics.inc('pulitzer_outline_parse_total', result='ok')
         except:
             logger.warning("Failed to parse LLM response as JSON, using default outline")
+            metrics.inc('pulitzer_outline_parse_total', result='fallback')
             outline = {
                 "引言": ["背景介绍", "主要观点"],
                 "正文": ["第一部分", "第二部分", "第三部分"],
@@ -827,12 +1656,100 @@ def handle_initialize_session(session_id, data, context):
             "message": f"初始化会话失败: {str(e)}"
         }
 
+def turn_context(session_id, collaborator, user_input, context, draft_version):
+    """一轮结束后返回给 Node 的上下文；草稿有变化时附带变化的章节和统计
+
+    需要重新同步时返回全部字段，草稿也返回全部章节。
+    """
+    known_version = context.get('contextVersion') if context else None
+    if collaborator.needs_resync(known_version):
+        draft_version = 0
+    turn = {
+        "sessionId": session_id,
+        "currentState": collaborator.state.value.upper(),
+        "lastInput": user_input,
+        "outline": collaborator.outline,
+        "settings": collaborator.settings,
+        "initialization": context.get('initialization') if context else None,
+        "selectedType": collaborator.content_type,
+        "topic": collaborator.topic,
+        "wordCount": collaborator.target_length,
+        "currentSection": collaborator.current_section,
+        "usage": collaborator.usage.to_dict()
+    }
+    if collaborator.draft.version != draft_version:
+        turn["draftChanges"] = collaborator.draft.changed_since(draft_version)
+        analytics = collaborator.analytics.analyze(collaborator.draft, collaborator.outline, collaborator.target_length)
+        turn["analytics"] = analytics
+        set_attributes({'draft.words': analytics['wordCount'], 'draft.progress': analytics['progress']})
+    return collaborator.context_delta(turn, known_version)
+
+def handle_generate_draft(session_id, data, context):
+    """跳过剩余的面试问题，根据已有的回答生成草稿"""
+    try:
+        collaborator = session_manager.get_or_create_session(session_id)
+        if not collaborator.outline:
+            raise ValueError("会话还没有大纲")
+        draft_version = collaborator.draft.version
+        draft = collaborator.generate_draft()
+        result = {
+            "status": "success",
+            "data": {
+                "draft": draft,
+                "response": f"基于我们的讨论，我生成了以下草稿：\n\n{draft}\n\n您觉得这个草稿怎么样？需要修改吗？",
+                "state": collaborator.state.value.upper(),
+                "context": turn_context(session_id, collaborator, 'GENERATE_DRAFT', context, draft_version),
+                "contextVersion": collaborator.context_version
+            }
+        }
+        session_manager.save_session(session_id)
+        return result
+
+    except Exception as e:
+        logger.error(f"Error generating draft: {e}")
+        return {
+            "status": "error",
+            "message": f"生成草稿失败: {str(e)}"
+        }
+
+def handle_revise_draft(session_id, data, context):
+    """按修改意见修订草稿"""
+    try:
+        collaborator = session_manager.get_or_create_session(session_id)
+        if collaborator.state != CollabState.DRAFT_REVIEW:
+            raise ValueError("会话当前没有待审阅的草稿")
+        feedback = data.get('feedback', '')
+        draft_version = collaborator.draft.version
+        response = collaborator.process_user_input(feedback)
+        result = {
+            "status": "success",
+            "data": {
+                "draft": collaborator.draft.render(),
+                "response": response,
+                "state": collaborator.state.value.upper(),
+                "context": turn_context(session_id, collaborator, feedback, context, draft_version),
+                "contextVersion": collaborator.context_version
+            }
+        }
+        session_manager.save_session(session_id)
+        return result
+
+    except Exception as e:
+        logger.error(f"Error revising draft: {e}")
+        return {
+            "status": "error",
+            "message": f"修改草稿失败: {str(e)}"
+        }
+
+@traced('process_input')
 def process_input(session_id, user_input, context=None):
     """处理用户输入，返回适当的响应"""
     try:
         # 获取或创建会话
         collaborator = session_manager.get_or_create_session(session_id)
-        
+        # 问答索引按用户跨会话共享；未提供用户 id 时退化为按会话
+        if context and context.get('userId') and not collaborator.owner:
+            collaborator.owner = str(context['userId'])
         # 尝试解析 JSON 输入
         input_data = None
         if isinstance(user_input, str) and user_input.startswith('{'):
@@ -880,39 +1797,37 @@ def process_input(session_id, user_input, context=None):
                         },
                         "selectedType": init_data.get('articleType', ''),
                         "topic": init_data.get('topic', ''),
-                        "wordCount": init_data.get('wordCount', 1000)
+                        "wordCount": init_data.get('wordCount', 1000),
+                        "usage": collaborator.usage.to_dict()
                     }
                 }
             }
+            response_data["data"]["context"] = collaborator.context_delta(
+                response_data["data"]["context"], context.get('contextVersion') if context else None)
+            response_data["data"]["contextVersion"] = collaborator.context_version
             
-            print(json.dumps(response_data, ensure_ascii=False))
-            return
+            session_manager.save_session(session_id)
+            return response_data
         
         # 处理其他输入
+        draft_version = collaborator.draft.version
         response = collaborator.process_user_input(
             input_data['data'] if input_data else user_input
         )
         
+        # 调用方持有的上下文版本与上一次响应一致时只返回变化的字段，否则返回全部字段
         response_data = {
             "status": "success",
             "data": {
                 "response": response,
                 "state": collaborator.state.value.upper(),
-                "context": {
-                    "sessionId": session_id,
-                    "currentState": collaborator.state.value.upper(),
-                    "lastInput": user_input,
-                    "outline": collaborator.outline,
-                    "settings": collaborator.settings,
-                    "initialization": context.get('initialization') if context else None,
-                    "selectedType": collaborator.content_type,
-                    "topic": collaborator.topic,
-                    "wordCount": collaborator.target_length
-                }
+                "context": turn_context(session_id, collaborator, user_input, context, draft_version),
+                "contextVersion": collaborator.context_version
             }
         }
         
-        print(json.dumps(response_data, ensure_ascii=False))
+        session_manager.save_session(session_id)
+        return response_data
         
     except Exception as e:
         print(f"Error processing input: {e}", file=sys.stderr)
@@ -924,7 +1839,7 @@ def process_input(session_id, user_input, context=None):
                 "type": type(e).__name__
             }
         }
-        print(json.dumps(error_response, ensure_ascii=False))
+        return error_response
 
 def test_llm_api():
     """测试 LLM API 连接和调用"""
@@ -957,6 +1872,49 @@ def test_llm_api():
             "message": f"API test failed: {str(e)}"
         }
 
+def handle_request(session_id, input_data, context):
+    """处理一次请求：命令或普通输入，返回响应字典"""
+    is_command = isinstance(input_data, dict) and input_data.get('type')
+
+    def run_turn():
+        if is_command:
+            return handle_command(session_id, input_data, context)
+        return process_input(session_id, input_data, context)
+
+    # 命令以命令类型作为 state 标签，普通输入以轮次开始时的会话状态为准
+    if is_command:
+        state = input_data['type']
+    elif session_id:
+        state = session_manager.get_or_create_session(session_id).state.value
+    else:
+        state = 'unknown'
+
+    turn_id = context.get('turnId')
+    started = time.perf_counter()
+    status = 'error'
+    try:
+        # 本地进程模式下父 span 来自 Node 设置的 TRACEPARENT 环境变量，分片模式下来自 worker.turn
+        with tracer.span('handle_request', {'session.id': session_id, 'turn.id': turn_id, 'collab.state': state}) as span:
+            # 按需剖析：PULITZER_PROFILE 环境变量或请求 context.profile 开启
+            profile_modes = requested_modes(context.get('profile'))
+            request_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{turn_id or span.span_id}"
+            if profile_modes:
+                span.set_attribute('profile.id', request_id)
+            with profiled(request_id, profile_modes):
+                # 带 turnId 的请求是幂等的：重试时重放已完成的结果，或等待正在执行的同一轮次
+                if session_id and turn_id:
+                    result = turn_store.run(session_id, turn_id, run_turn)
+                else:
+                    result = run_turn()
+            status = result.get('status', 'error')
+            span.set_attribute('turn.status', status)
+            return result
+    finally:
+        metrics.inc('pulitzer_turns_total', state=state, status=status)
+        metrics.observe('pulitzer_turn_seconds', time.perf_counter() - started, state=state)
+        metrics.flush()
+        tracer.flush()
+
 # 在主函数中添加测试选项
 def main():
     """主入口函数"""
@@ -965,6 +1923,10 @@ def main():
     parser.add_argument('--input', help='User input')
     parser.add_argument('--context', help='Context data')
     parser.add_argument('--test', action='store_true', help='Run API test')
+    parser.add_argument('--generate-draft', action='store_true', help='Generate the draft from the answers so far')
+    parser.add_argument('--revise-draft', action='store_true', help='Revise the draft according to --feedback')
+    parser.add_argument('--feedback', help='Revision feedback for --revise-draft')
+    parser.add_argument('--end-session', action='store_true', help='End the session and delete its state')
     args = parser.parse_args()
 
     try:
@@ -976,13 +1938,17 @@ def main():
         session_id = args.session
         input_data = json.loads(args.input) if args.input else None
         context = json.loads(args.context) if args.context else {}
+        # 草稿和会话管理的命令行参数转换为对应的命令
+        if args.generate_draft:
+            input_data = {'type': 'GENERATE_DRAFT'}
+        elif args.revise_draft:
+            input_data = {'type': 'REVISE_DRAFT', 'data': {'feedback': args.feedback or ''}}
+        elif args.end_session:
+            input_data = {'type': 'END_SESSION'}
 
         logger.info(f"Received request for session {session_id}")
 
-        if isinstance(input_data, dict) and input_data.get('type'):
-            result = handle_command(session_id, input_data, context)
-        else:
-            result = process_input(session_id, input_data, context)
+        result = handle_request(session_id, input_data, context)
 
         logger.info(f"Sending response: success={result['status']}")
         print(json.dumps(result, ensure_ascii=False))
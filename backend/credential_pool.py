@@ -0,0 +1,187 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import logging
+import argparse
+from typing import Any, Callable, Collection, Dict, List, Optional, TypeVar
+
+from llm_cassette import replaying
+from llm_guard import LLMGuard, is_retryable
+from metrics import metrics
+from tracing import set_attributes
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+# 最近一分钟内每次 429 在选择 key 时增加的负载
+THROTTLE_PENALTY = 0.2
+
+
+class Credential:
+    """一个 API key（及其 API 地址），配额和熔断状态由独立的 LLMGuard 跨进程跟踪"""
+    def __init__(self, api_key: str, base_url: str, client_factory: Callable[[str, str], Any],
+                 requests_per_minute: int = None, tokens_per_minute: int = None):
+        # 指标和日志中只出现 key 的哈希
+        self.id = hashlib.sha256(f"{base_url}|{api_key}".encode('utf-8')).hexdigest()[:8]
+        self.base_url = base_url
+        self.requests_per_minute = requests_per_minute or int(os.getenv('LLM_REQUESTS_PER_MINUTE', '60'))
+        self.tokens_per_minute = tokens_per_minute or int(os.getenv('LLM_TOKENS_PER_MINUTE', '200000'))
+        # 重试由 CredentialPool 负责，以便失败后换一个 key
+        self.guard = LLMGuard(base_url=f"{base_url}#{self.id}",
+                              requests_per_minute=self.requests_per_minute,
+                              tokens_per_minute=self.tokens_per_minute,
+                              max_retries=0)
+        self.client = client_factory(api_key, base_url)
+
+
+def parse_credentials(api_key: Optional[str], base_url: str) -> List[Dict]:
+    """读取凭据配置
+
+    LLM_CREDENTIALS 为 JSON 数组，每项包含 apiKey，可选 baseUrl、requestsPerMinute、tokensPerMinute；
+    否则使用 OPENAI_API_KEYS（逗号分隔，共用 base_url）或单个 api_key。
+    """
+    raw = os.getenv('LLM_CREDENTIALS')
+    if raw:
+        return [{
+            'api_key': item['apiKey'],
+            'base_url': item.get('baseUrl') or base_url,
+            'requests_per_minute': item.get('requestsPerMinute'),
+            'tokens_per_minute': item.get('tokensPerMinute')
+        } for item in json.loads(raw)]
+    keys = [key.strip() for key in os.getenv('OPENAI_API_KEYS', '').split(',') if key.strip()]
+    if not keys and api_key:
+        keys = [api_key]
+    return [{'api_key': key, 'base_url': base_url} for key in keys]
+
+
+class CredentialPool:
+    """多个 API key 组成的凭据池
+
+    每次调用选择当前最空闲的健康 key：不需要等待的 key 优先，其次按请求数/token 配额的使用比例，
+    最近一分钟内收到过 429 的 key 额外加负载。可重试的错误（429、5xx、连接错误）之后换一个 key 重试，
+    没有空闲的 key 时才按退避时间等待。
+
+    从磁带回放时（replay=True）不经过各个 key 的配额和熔断，重试也不等待，
+    回放既不受限流影响，也不会改动共享的熔断状态。
+    """
+    def __init__(self, credentials: List[Credential], max_retries: int = 3, replay: bool = False):
+        if not credentials:
+            raise ValueError("OPENAI_API_KEY environment variable is not set")
+        self.credentials = credentials
+        self.max_retries = max_retries
+        self.replay = replay
+
+    @classmethod
+    def from_env(cls, api_key: Optional[str], base_url: str, client_factory: Callable[[str, str], Any],
+                 requests_per_minute: int = None, tokens_per_minute: int = None,
+                 max_retries: int = 3) -> 'CredentialPool':
+        """按环境变量创建凭据池，未单独配置的 key 使用 requests_per_minute / tokens_per_minute
+
+        回放磁带时不需要真实的 API key，没有配置时使用占位 key
+        """
+        replay = replaying()
+        items = parse_credentials(api_key, base_url)
+        if replay and not items:
+            items = [{'api_key': 'cassette-replay', 'base_url': base_url}]
+        credentials = []
+        for item in items:
+            credentials.append(Credential(
+                item['api_key'], item['base_url'], client_factory,
+                item.get('requests_per_minute') or requests_per_minute,
+                item.get('tokens_per_minute') or tokens_per_minute
+            ))
+        return cls(credentials, max_retries, replay)
+
+    def statuses(self, tokens: int = 0) -> List[Dict]:
+        """各个 key 的当前状态，同时更新配额相关的仪表盘指标"""
+        statuses = [dict(credential.guard.status(tokens), credential=credential) for credential in self.credentials]
+        capacity = {'requests_per_minute': 0, 'tokens_per_minute': 0}
+        health = {'healthy': 0, 'throttled': 0, 'open': 0}
+        for status in statuses:
+            credential = status['credential']
+            metrics.set('pulitzer_llm_key_load', round(status['load'], 3), key=credential.id)
+            if status['breaker'] != 'closed':
+                health['open'] += 1
+            elif status['throttled']:
+                health['throttled'] += 1
+            else:
+                health['healthy'] += 1
+                capacity['requests_per_minute'] += credential.requests_per_minute
+                capacity['tokens_per_minute'] += credential.tokens_per_minute
+        for resource, value in capacity.items():
+            metrics.set('pulitzer_llm_pool_capacity', value, resource=resource)
+        for state, count in health.items():
+            metrics.set('pulitzer_llm_pool_keys', count, state=state)
+        return statuses
+
+    def choose(self, tokens: int = 0, exclude: Collection[Credential] = ()) -> Credential:
+        """选择最空闲的 key；exclude 为本次调用中已经失败的 key，还有其他 key 时避开"""
+        if self.replay:
+            # 所有 key 的客户端共用同一个磁带，用哪个都一样
+            return self.credentials[0]
+        statuses = self.statuses(tokens)
+        candidates = [status for status in statuses if status['credential'] not in exclude] or statuses
+        best = min(candidates, key=lambda status: (
+            status['wait'] > 0, status['wait'], status['load'] + THROTTLE_PENALTY * status['throttled']))
+        return best['credential']
+
+    def call(self, fn: Callable[[Any], T], tokens: int = 0) -> T:
+        """用选中 key 的客户端执行 fn(client)，可重试的错误换 key 重试
+
+        只有换不到本次调用中还没失败过的 key 时（单个 key，或所有 key 都刚失败过）才按退避时间等待
+        """
+        attempt = 0
+        failed = set()
+        credential = self.choose(tokens)
+        while True:
+            if len(self.credentials) > 1:
+                set_attributes({'llm.key': credential.id})
+            try:
+                if self.replay:
+                    result = fn(credential.client)
+                else:
+                    result = credential.guard.call(lambda: fn(credential.client), tokens)
+            except Exception as e:
+                metrics.inc('pulitzer_llm_key_requests_total', key=credential.id, status=type(e).__name__)
+                if getattr(e, 'status_code', None) == 429:
+                    metrics.inc('pulitzer_llm_key_throttled_total', key=credential.id)
+                if not is_retryable(e) or attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                failed.add(credential)
+                metrics.inc('pulitzer_llm_retries_total', reason=type(e).__name__)
+                set_attributes({'llm.retries': attempt})
+                retry = self.choose(tokens, exclude=failed)
+                if retry in failed:
+                    # 所有 key 都已失败：按重试所用 key 的退避时间等待
+                    delay = 0.0 if self.replay else retry.guard.backoff(attempt - 1, e)
+                    logger.warning(f"LLM call with key {credential.id} failed ({type(e).__name__}), "
+                                   f"retry {attempt}/{self.max_retries} with key {retry.id} in {delay:.2f}s")
+                    time.sleep(delay)
+                else:
+                    logger.warning(f"LLM call with key {credential.id} failed ({type(e).__name__}), "
+                                   f"retry {attempt}/{self.max_retries} with another key")
+                credential = retry
+                continue
+            metrics.inc('pulitzer_llm_key_requests_total', key=credential.id, status='success')
+            return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Show quota usage and health of the pooled API keys')
+    parser.parse_args()
+
+    pool = CredentialPool.from_env(os.getenv('OPENAI_API_KEY'), os.getenv('OPENAI_API_BASE', 'https://api.siliconflow.cn/v1'),
+                                   lambda api_key, base_url: None)
+    for status in pool.statuses():
+        credential = status['credential']
+        print(f"{credential.id}  {credential.base_url}  rpm={credential.requests_per_minute}  "
+              f"tpm={credential.tokens_per_minute}  load={status['load']:.2f}  wait={status['wait']:.1f}s  "
+              f"429s/min={status['throttled']}  breaker={status['breaker']}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,247 @@
+import os
+import re
+import sys
+import json
+import argparse
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Optional
+
+# 与 llm_guard.estimate_text_tokens 相同的中日韩字符范围
+CJK_PATTERN = re.compile(r'[⺀-鿿가-힯]')
+WORD_PATTERN = re.compile(r"[A-Za-z0-9]+(?:['’-][A-Za-z0-9]+)*")
+SPACE_PATTERN = re.compile(r'\s')
+SENTENCE_PATTERN = re.compile(r'[^。！？!?；;\n]+(?:[。！？!?；;]+|\.(?=\s|$)|$)', re.M)
+HEADING_PATTERN = re.compile(r'^\s{0,3}#{1,6}\s')
+PARAGRAPH_BREAK = re.compile(r'\n\s*\n')
+# 重叠的汉字二元组作为中文关键词候选
+CJK_BIGRAM_PATTERN = re.compile(r'(?=([一-鿿]{2}))')
+
+TRANSITIONS = ('因此', '所以', '但是', '然而', '此外', '同时', '另外', '首先', '其次', '最后', '总之', '例如', '不过',
+               'however', 'therefore', 'moreover', 'meanwhile', 'finally', 'first', 'for example', 'in addition')
+STOPWORDS = {'that', 'this', 'with', 'from', 'have', 'they', 'their', 'which', 'about', 'there', 'would', 'will',
+             'were', 'been', 'into', 'more', 'than', 'when', 'what', 'your', 'also'}
+SENTENCE_BUCKETS = (10, 20, 30, 50)
+
+# 达到目标篇幅的倍数后在段落边界提前结束草稿生成，0 表示不提前结束
+DRAFT_MAX_OVERRUN = float(os.getenv('DRAFT_MAX_OVERRUN', '1.5'))
+
+
+def count_words(text: str) -> int:
+    """中日韩文字按字计，其余按单词计"""
+    return len(CJK_PATTERN.findall(text)) + len(WORD_PATTERN.findall(text))
+
+
+def _body(text: str) -> str:
+    """去掉标题行，只统计正文"""
+    return '\n'.join(line for line in text.split('\n') if not HEADING_PATTERN.match(line))
+
+
+def text_stats(text: str) -> Dict:
+    """一段 Markdown 正文的计数，全部由正则在 C 层完成"""
+    body = _body(text)
+    sentences = [count_words(s) for s in SENTENCE_PATTERN.findall(body) if s.strip()]
+    paragraphs = [p for p in PARAGRAPH_BREAK.split(body) if p.strip()]
+    lowered = body.lower()
+    return {
+        'words': count_words(body),
+        'cjk': len(CJK_PATTERN.findall(body)),
+        'chars': len(body) - len(SPACE_PATTERN.findall(body)),
+        'sentences': [n for n in sentences if n],
+        'paragraphs': [count_words(p) for p in paragraphs],
+        'questions': len(re.findall(r'[？?！!]', body)),
+        'transitions': sum(1 for p in paragraphs[1:] if any(t in p[:40].lower() for t in TRANSITIONS)),
+        'terms': Counter(CJK_BIGRAM_PATTERN.findall(body)) + Counter(
+            w for w in WORD_PATTERN.findall(lowered) if len(w) > 3 and w not in STOPWORDS)
+    }
+
+
+def _merge(stats: Iterable[Dict]) -> Dict:
+    total = {'words': 0, 'cjk': 0, 'chars': 0, 'sentences': [], 'paragraphs': [], 'questions': 0, 'transitions': 0,
+             'terms': Counter()}
+    for item in stats:
+        for key in ('words', 'cjk', 'chars', 'questions', 'transitions'):
+            total[key] += item[key]
+        total['sentences'] += item['sentences']
+        total['paragraphs'] += item['paragraphs']
+        total['terms'].update(item['terms'])
+    return total
+
+
+def _clamp(value: float) -> int:
+    return int(max(0, min(100, round(value))))
+
+
+def readability(stats: Dict) -> Dict[str, int]:
+    """启发式可读性评分（0-100），字段与前端 ArticleAnalytics 组件一致
+
+    clarity 看平均句长，conciseness 看长句比例，coherence 看段首过渡词，
+    engagement 看问句/感叹句和过长段落的比例。中文句长按字计，理想值高于英文。
+    """
+    sentences = stats['sentences']
+    paragraphs = stats['paragraphs']
+    if not sentences:
+        return {'clarity': 0, 'conciseness': 0, 'coherence': 0, 'engagement': 0}
+    ideal = 25 if stats['cjk'] * 2 >= stats['words'] else 17
+    average = sum(sentences) / len(sentences)
+    long_share = sum(1 for n in sentences if n > ideal * 2) / len(sentences)
+    long_paragraphs = sum(1 for n in paragraphs if n > ideal * 8) / max(len(paragraphs), 1)
+    return {
+        'clarity': _clamp(100 - max(0, average - ideal) * 3),
+        'conciseness': _clamp(100 - long_share * 200),
+        'coherence': _clamp(50 + 100 * stats['transitions'] / max(len(paragraphs) - 1, 1)),
+        'engagement': _clamp(60 + 400 * stats['questions'] / len(sentences) - 80 * long_paragraphs)
+    }
+
+
+def sentence_histogram(sentences: List[int]) -> Dict[str, int]:
+    histogram = OrderedDict()
+    lower = 1
+    for upper in SENTENCE_BUCKETS:
+        histogram[f"{lower}-{upper}"] = sum(1 for n in sentences if lower <= n <= upper)
+        lower = upper + 1
+    histogram[f"{lower}+"] = sum(1 for n in sentences if n >= lower)
+    return histogram
+
+
+def section_budgets(outline: Dict, target_length: int) -> Dict[str, int]:
+    """按大纲中各部分的子项数分配目标字数"""
+    weights = {section: max(len(items), 1) if isinstance(items, list) else 1 for section, items in (outline or {}).items()}
+    total = sum(weights.values())
+    if not total or not target_length:
+        return {}
+    return {section: round(target_length * weight / total) for section, weight in weights.items()}
+
+
+def _match_budget(title: str, budgets: Dict[str, int]) -> Optional[int]:
+    if not title:
+        return None
+    if title in budgets:
+        return budgets[title]
+    for section, budget in budgets.items():
+        if section in title or title in section:
+            return budget
+    return None
+
+
+def summarize(stats: Dict, target_length: int) -> Dict:
+    """把合并后的计数整理成响应中的分析结果"""
+    sentences = stats['sentences']
+    return {
+        'wordCount': stats['words'],
+        'charCount': stats['chars'],
+        'targetLength': target_length,
+        'progress': round(stats['words'] / target_length, 3) if target_length else None,
+        'sentences': {
+            'count': len(sentences),
+            'average': round(sum(sentences) / len(sentences), 1) if sentences else 0,
+            'histogram': sentence_histogram(sentences)
+        },
+        'paragraphLengths': stats['paragraphs'],
+        'readability': readability(stats),
+        'keywords': [{'word': word, 'count': count} for word, count in stats['terms'].most_common(8) if count > 1]
+    }
+
+
+class DraftAnalytics:
+    """按章节增量计算草稿分析
+
+    每个章节的计数按内容哈希缓存，修订后只重新统计变化的章节。
+    """
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._cache: 'OrderedDict[str, Dict]' = OrderedDict()
+
+    def _section_stats(self, chunk) -> Dict:
+        stats = self._cache.get(chunk.hash)
+        if stats is None:
+            stats = self._cache[chunk.hash] = text_stats(chunk.content)
+            if len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(chunk.hash)
+        return stats
+
+    def analyze(self, document, outline: Dict, target_length: int) -> Dict:
+        budgets = section_budgets(outline, target_length)
+        per_section = [(chunk, self._section_stats(chunk)) for chunk in document]
+        stats = _merge(item for _, item in per_section)
+        result = summarize(stats, target_length)
+        result['sections'] = []
+        for chunk, item in per_section:
+            budget = _match_budget(chunk.title, budgets)
+            result['sections'].append({
+                'id': chunk.id,
+                'title': chunk.title,
+                'wordCount': item['words'],
+                'budget': budget,
+                'ratio': round(item['words'] / budget, 2) if budget else None
+            })
+        return result
+
+
+class StreamingStats:
+    """在流式生成过程中增量统计字数
+
+    已完成的段落只统计一次，未完成的段落在查询时重新统计。
+    """
+    def __init__(self):
+        self.completed_words = 0
+        # 已完成段落（含段落间空行）的总长度，提前结束时据此截掉未写完的段落
+        self.completed_length = 0
+        self.stopped = False
+        self._fed = 0
+        self._buffer = ''
+        self._paragraph_done = False
+
+    def feed(self, delta: str):
+        self._fed += len(delta)
+        self._buffer += delta
+        parts = PARAGRAPH_BREAK.split(self._buffer)
+        self._paragraph_done = len(parts) > 1
+        if self._paragraph_done:
+            self.completed_words += sum(count_words(_body(p)) for p in parts[:-1])
+            self._buffer = parts[-1]
+            self.completed_length = self._fed - len(self._buffer)
+
+    @property
+    def word_count(self) -> int:
+        return self.completed_words + count_words(_body(self._buffer))
+
+    @property
+    def at_paragraph_break(self) -> bool:
+        """最近一次增量是否写完了一个段落"""
+        return self._paragraph_done
+
+    def should_stop(self, target_length: int) -> bool:
+        """篇幅超过目标的 DRAFT_MAX_OVERRUN 倍且刚好写完一个段落时结束生成"""
+        if not DRAFT_MAX_OVERRUN or not target_length:
+            return False
+        self.stopped = self.at_paragraph_break and self.completed_words >= target_length * DRAFT_MAX_OVERRUN
+        return self.stopped
+
+    def trim(self, text: str) -> str:
+        """提前结束时去掉最后一个未写完的段落"""
+        return text[:self.completed_length].rstrip() if self.stopped else text
+
+
+def _analyze_file(path: str, target_length: int) -> Dict:
+    with open(path, 'r', encoding='utf-8') as f:
+        text = f.read()
+    return {'path': path, **summarize(text_stats(text), target_length)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Batch analytics for Markdown drafts')
+    parser.add_argument('paths', nargs='+', help='Markdown files')
+    parser.add_argument('--target', type=int, default=0, help='Target length in words (CJK characters)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        for result in pool.map(_analyze_file, args.paths, [args.target] * len(args.paths), chunksize=16):
+            print(json.dumps(result, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
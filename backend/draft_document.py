@@ -0,0 +1,203 @@
+import re
+import hashlib
+from typing import Dict, Iterator, List, Optional, Union
+
+# 在一级、二级标题处切分章节，更深的标题留在所属章节内
+HEADING_PATTERN = re.compile(r'^(#{1,2})\s+(.+?)\s*#*\s*$')
+FENCE_PATTERN = re.compile(r'^\s*(```|~~~)')
+
+
+def content_hash(content: str) -> str:
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()[:16]
+
+
+def split_sections(markdown: str) -> List[str]:
+    """按标题把 Markdown 切成章节，标题之前的内容单独成为一块，代码块里的 # 不参与切分"""
+    sections: List[List[str]] = [[]]
+    in_fence = False
+    for line in (markdown or '').splitlines():
+        if FENCE_PATTERN.match(line):
+            in_fence = not in_fence
+        elif not in_fence and HEADING_PATTERN.match(line) and any(l.strip() for l in sections[-1]):
+            sections.append([])
+        sections[-1].append(line)
+    return [text for text in ('\n'.join(lines).strip('\n') for lines in sections) if text.strip()]
+
+
+class DraftChunk:
+    """草稿中的一个章节
+
+    version 为最后一次修改时文档的版本号，hash 用于判断修订是否真正改变了内容。
+    """
+    __slots__ = ('id', 'content', 'hash', 'version')
+
+    def __init__(self, chunk_id: str, content: str, version: int):
+        self.id = chunk_id
+        self.content = content
+        self.hash = content_hash(content)
+        self.version = version
+
+    @property
+    def title(self) -> str:
+        """章节标题，没有标题的开头部分返回空字符串"""
+        match = HEADING_PATTERN.match(self.content.split('\n', 1)[0])
+        return match.group(2) if match else ''
+
+    def to_dict(self) -> Dict:
+        return {'id': self.id, 'title': self.title, 'content': self.content, 'hash': self.hash, 'version': self.version}
+
+
+class DraftDocument:
+    """按章节分块保存的草稿
+
+    每次修改只替换内容哈希发生变化的章节并提升文档版本号，
+    Markdown 全文在需要时才拼接，并缓存到下一次修改为止。
+    """
+    def __init__(self):
+        self.chunks: List[DraftChunk] = []
+        self.version = 0
+        # 已删除章节 id -> 删除时的版本号，用于增量同步
+        self.removed: Dict[str, int] = {}
+        # 章节顺序最后一次变化（新增、删除或调整顺序）时的版本号
+        self.order_version = 0
+        self._next_id = 1
+        self._rendered: Optional[str] = None
+
+    @classmethod
+    def from_markdown(cls, markdown: str) -> 'DraftDocument':
+        document = cls()
+        document.replace_from_markdown(markdown)
+        return document
+
+    def _new_id(self) -> str:
+        chunk_id = f"s{self._next_id}"
+        self._next_id += 1
+        return chunk_id
+
+    def __bool__(self) -> bool:
+        return bool(self.chunks)
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    def __iter__(self) -> Iterator[DraftChunk]:
+        return iter(self.chunks)
+
+    def __str__(self) -> str:
+        return self.render()
+
+    def render(self) -> str:
+        """拼接为完整的 Markdown"""
+        if self._rendered is None:
+            self._rendered = '\n\n'.join(chunk.content for chunk in self.chunks)
+        return self._rendered
+
+    def get(self, chunk_id: str) -> Optional[DraftChunk]:
+        for chunk in self.chunks:
+            if chunk.id == chunk_id:
+                return chunk
+        return None
+
+    def find_sections(self, text: str) -> List[DraftChunk]:
+        """返回标题在 text 中出现过的章节，用于定位只涉及部分章节的修改意见"""
+        return [chunk for chunk in self.chunks if len(chunk.title) >= 2 and chunk.title in text]
+
+    def _merge(self, old_chunks: List[DraftChunk], sections: List[str]) -> List[str]:
+        """用新的章节文本替换 old_chunks，标题相同的章节沿用原 id
+
+        返回内容变化、新增、删除或调整了位置的章节 id
+        """
+        version = self.version + 1
+        by_title: Dict[str, List[DraftChunk]] = {}
+        for chunk in old_chunks:
+            by_title.setdefault(chunk.title, []).append(chunk)
+
+        merged, changed = [], []
+        for content in sections:
+            candidates = by_title.get(DraftChunk('', content, 0).title)
+            if candidates:
+                chunk = candidates.pop(0)
+                if chunk.hash != content_hash(content):
+                    chunk.content, chunk.hash, chunk.version = content, content_hash(content), version
+                    changed.append(chunk.id)
+            else:
+                chunk = DraftChunk(self._new_id(), content, version)
+                changed.append(chunk.id)
+            merged.append(chunk)
+
+        kept = {chunk.id for chunk in merged}
+        for chunk in old_chunks:
+            if chunk.id not in kept:
+                self.removed[chunk.id] = version
+                changed.append(chunk.id)
+
+        # 只调整了章节顺序时内容哈希都没变，需要单独比较保留下来的章节的先后顺序
+        previous = [chunk.id for chunk in old_chunks if chunk.id in kept]
+        current = [chunk.id for chunk in merged if chunk.id in previous]
+        moved = [chunk_id for before, chunk_id in zip(previous, current) if before != chunk_id and chunk_id not in changed]
+
+        if changed or moved:
+            start = self.chunks.index(old_chunks[0]) if old_chunks else len(self.chunks)
+            self.chunks[start:start + len(old_chunks)] = merged
+            self.version = version
+            if moved or [chunk.id for chunk in merged] != [chunk.id for chunk in old_chunks]:
+                self.order_version = version
+            self._rendered = None
+        return changed + moved
+
+    def replace_from_markdown(self, markdown: str) -> List[str]:
+        """用完整的新草稿替换文档，只有内容变化的章节会提升版本"""
+        return self._merge(list(self.chunks), split_sections(markdown))
+
+    def replace_section(self, chunk_id: str, markdown: str) -> List[str]:
+        """替换单个章节；修订结果缺少标题时沿用原标题，拆成多个章节时依次插入原位置"""
+        chunk = self.get(chunk_id)
+        if chunk is None:
+            raise KeyError(chunk_id)
+        sections = split_sections(markdown)
+        if not sections:
+            return []
+        heading = chunk.content.split('\n', 1)[0]
+        if chunk.title and DraftChunk('', sections[0], 0).title != chunk.title:
+            if HEADING_PATTERN.match(sections[0].split('\n', 1)[0]):
+                sections[0] = sections[0].split('\n', 1)[1].strip('\n') if '\n' in sections[0] else ''
+            sections[0] = f"{heading}\n\n{sections[0]}".rstrip('\n')
+        return self._merge([chunk], sections)
+
+    def changed_since(self, version: int) -> Dict:
+        """返回 version 之后的变化：当前章节顺序及其是否变化、变化的章节和已删除的章节 id"""
+        return {
+            'version': self.version,
+            'order': [chunk.id for chunk in self.chunks],
+            'reordered': self.order_version > version,
+            'chunks': [chunk.to_dict() for chunk in self.chunks if chunk.version > version],
+            'removed': [chunk_id for chunk_id, removed_at in self.removed.items() if removed_at > version]
+        }
+
+    def render_chunks(self, chunk_ids: List[str]) -> str:
+        """只拼接指定的章节"""
+        ids = set(chunk_ids)
+        return '\n\n'.join(chunk.content for chunk in self.chunks if chunk.id in ids)
+
+    def to_dict(self) -> Dict:
+        """持久化格式，章节哈希在加载时重新计算"""
+        return {
+            'version': self.version,
+            'next_id': self._next_id,
+            'order_version': self.order_version,
+            'chunks': [[chunk.id, chunk.content, chunk.version] for chunk in self.chunks],
+            'removed': self.removed
+        }
+
+    @classmethod
+    def from_data(cls, data: Optional[Union[Dict, str]]) -> 'DraftDocument':
+        """从持久化格式恢复，兼容旧的整篇字符串格式"""
+        if not isinstance(data, dict):
+            return cls.from_markdown(data or '')
+        document = cls()
+        document.version = data.get('version', 0)
+        document._next_id = data.get('next_id', 1)
+        document.order_version = data.get('order_version', document.version)
+        document.chunks = [DraftChunk(chunk_id, content, version) for chunk_id, content, version in data.get('chunks', [])]
+        document.removed = data.get('removed', {})
+        return document
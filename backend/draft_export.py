@@ -0,0 +1,373 @@
+import os
+import re
+import sys
+import html
+import zipfile
+import argparse
+import tempfile
+from typing import BinaryIO, Callable, Iterator, Tuple
+
+from file_store import get_state_dir
+from session_store import SessionStore
+from draft_document import DraftChunk, DraftDocument
+from metrics import metrics
+from tracing import traced, set_attributes
+
+# 渲染规则变化时提升版本号，旧的缓存条目自然失效
+RENDER_VERSION = 2
+FORMATS = ('markdown', 'html', 'docx')
+
+FENCE_PATTERN = re.compile(r'^\s*(```|~~~)\s*([\w+-]*)')
+HEADING_PATTERN = re.compile(r'^(#{1,6})\s+(.+?)\s*#*\s*$')
+BULLET_PATTERN = re.compile(r'^\s*[-*+]\s+(.*)$')
+ORDERED_PATTERN = re.compile(r'^\s*\d+[.)]\s+(.*)$')
+QUOTE_PATTERN = re.compile(r'^\s*>\s?(.*)$')
+RULE_PATTERN = re.compile(r'^\s*([-*_])(\s*\1){2,}\s*$')
+# 紧跟在文字行后面、不需要空行就能打断段落的块
+BLOCK_START_PATTERNS = (HEADING_PATTERN, FENCE_PATTERN, BULLET_PATTERN, ORDERED_PATTERN, QUOTE_PATTERN, RULE_PATTERN)
+INLINE_PATTERN = re.compile(r'`([^`]+)`|\*\*(.+?)\*\*|__(.+?)__|\*([^*]+)\*|_([^_]+)_|\[([^\]]+)\]\(([^)\s]+)\)')
+
+
+def parse_blocks(markdown: str) -> Iterator[Tuple]:
+    """把 Markdown 拆成块：heading、paragraph、list、quote、code、rule"""
+    lines = markdown.split('\n')
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        fence = FENCE_PATTERN.match(line)
+        if fence:
+            body = []
+            i += 1
+            while i < len(lines) and not lines[i].strip().startswith(fence.group(1)):
+                body.append(lines[i])
+                i += 1
+            yield ('code', fence.group(2), '\n'.join(body))
+            i += 1
+        elif not line.strip():
+            i += 1
+        elif HEADING_PATTERN.match(line):
+            match = HEADING_PATTERN.match(line)
+            yield ('heading', len(match.group(1)), match.group(2))
+            i += 1
+        elif RULE_PATTERN.match(line):
+            yield ('rule',)
+            i += 1
+        elif BULLET_PATTERN.match(line) or ORDERED_PATTERN.match(line):
+            ordered = not BULLET_PATTERN.match(line)
+            pattern = ORDERED_PATTERN if ordered else BULLET_PATTERN
+            items = []
+            while i < len(lines) and lines[i].strip():
+                match = pattern.match(lines[i])
+                if RULE_PATTERN.match(lines[i]) or (not match and any(
+                        other.match(lines[i]) for other in BLOCK_START_PATTERNS)):
+                    # 标题、引用、代码块或另一种列表直接跟在列表后面
+                    break
+                if match:
+                    items.append(match.group(1))
+                elif items:
+                    # 缩进的续行归入上一项
+                    items[-1] += ' ' + lines[i].strip()
+                i += 1
+            yield ('list', ordered, items)
+        elif QUOTE_PATTERN.match(line):
+            body = []
+            while i < len(lines) and QUOTE_PATTERN.match(lines[i]):
+                body.append(QUOTE_PATTERN.match(lines[i]).group(1))
+                i += 1
+            yield ('quote', ' '.join(part for part in body if part.strip()))
+        else:
+            body = []
+            while (i < len(lines) and lines[i].strip()
+                   and not any(pattern.match(lines[i]) for pattern in BLOCK_START_PATTERNS)):
+                body.append(lines[i].strip())
+                i += 1
+            yield ('paragraph', ' '.join(body))
+
+
+def parse_inline(text: str) -> Iterator[Tuple[str, str, str]]:
+    """把行内 Markdown 拆成 (样式, 文本, 链接) 片段，样式为 text/code/bold/italic/link"""
+    position = 0
+    for match in INLINE_PATTERN.finditer(text):
+        if match.start() > position:
+            yield ('text', text[position:match.start()], '')
+        code, bold, bold_alt, italic, italic_alt, label, href = match.groups()
+        if code is not None:
+            yield ('code', code, '')
+        elif bold is not None or bold_alt is not None:
+            yield ('bold', bold if bold is not None else bold_alt, '')
+        elif italic is not None or italic_alt is not None:
+            yield ('italic', italic if italic is not None else italic_alt, '')
+        else:
+            yield ('link', label, href)
+        position = match.end()
+    if position < len(text):
+        yield ('text', text[position:], '')
+
+
+# ---- HTML ----
+
+HTML_INLINE = {
+    'text': '{}',
+    'code': '<code>{}</code>',
+    'bold': '<strong>{}</strong>',
+    'italic': '<em>{}</em>'
+}
+
+HTML_HEAD = """<!DOCTYPE html>
+<html lang="zh-CN">
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<style>
+body {{ max-width: 42em; margin: 2em auto; padding: 0 1em; font: 16px/1.8 "Noto Serif SC", "Songti SC", serif; color: #222; }}
+h1, h2, h3 {{ line-height: 1.4; page-break-after: avoid; }}
+pre {{ background: #f6f8fa; padding: 1em; overflow-x: auto; page-break-inside: avoid; }}
+blockquote {{ margin: 0; padding-left: 1em; border-left: 3px solid #ccc; color: #555; }}
+@page {{ size: A4; margin: 2cm; }}
+@media print {{ body {{ max-width: none; margin: 0; }} a {{ color: inherit; }} }}
+</style>
+</head>
+<body>
+"""
+HTML_TAIL = "</body>\n</html>\n"
+
+
+def _html_inline(text: str) -> str:
+    parts = []
+    for style, value, href in parse_inline(text):
+        if style == 'link':
+            parts.append(f'<a href="{html.escape(href)}">{html.escape(value)}</a>')
+        else:
+            parts.append(HTML_INLINE[style].format(html.escape(value)))
+    return ''.join(parts)
+
+
+def render_html(markdown: str) -> str:
+    """把一个章节渲染为 HTML 片段"""
+    out = []
+    for block in parse_blocks(markdown):
+        kind = block[0]
+        if kind == 'heading':
+            out.append(f"<h{block[1]}>{_html_inline(block[2])}</h{block[1]}>")
+        elif kind == 'paragraph':
+            out.append(f"<p>{_html_inline(block[1])}</p>")
+        elif kind == 'list':
+            tag = 'ol' if block[1] else 'ul'
+            items = ''.join(f"<li>{_html_inline(item)}</li>" for item in block[2])
+            out.append(f"<{tag}>{items}</{tag}>")
+        elif kind == 'quote':
+            out.append(f"<blockquote><p>{_html_inline(block[1])}</p></blockquote>")
+        elif kind == 'code':
+            language = f' class="language-{block[1]}"' if block[1] else ''
+            out.append(f"<pre><code{language}>{html.escape(block[2])}</code></pre>")
+        elif kind == 'rule':
+            out.append('<hr>')
+    return '\n'.join(out) + '\n'
+
+
+# ---- DOCX ----
+
+DOCX_CONTENT_TYPES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>
+<Override PartName="/word/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.styles+xml"/>
+</Types>"""
+
+DOCX_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="word/document.xml"/>
+</Relationships>"""
+
+DOCX_DOCUMENT_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>
+</Relationships>"""
+
+
+def _docx_style(style_id: str, name: str, size: int, bold: bool = False, extra: str = '') -> str:
+    run = f'<w:rPr>{"<w:b/>" if bold else ""}<w:sz w:val="{size}"/></w:rPr>'
+    return (f'<w:style w:type="paragraph" w:styleId="{style_id}"><w:name w:val="{name}"/>'
+            f'<w:basedOn w:val="Normal"/><w:pPr><w:spacing w:before="240" w:after="120"/>{extra}</w:pPr>{run}</w:style>')
+
+
+DOCX_STYLES = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+               '<w:styles xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+               '<w:style w:type="paragraph" w:default="1" w:styleId="Normal"><w:name w:val="Normal"/>'
+               '<w:pPr><w:spacing w:after="120" w:line="360" w:lineRule="auto"/></w:pPr>'
+               '<w:rPr><w:rFonts w:eastAsia="SimSun"/><w:sz w:val="24"/></w:rPr></w:style>'
+               + _docx_style('Heading1', 'heading 1', 36, True, '<w:outlineLvl w:val="0"/>')
+               + _docx_style('Heading2', 'heading 2', 32, True, '<w:outlineLvl w:val="1"/>')
+               + _docx_style('Heading3', 'heading 3', 28, True, '<w:outlineLvl w:val="2"/>')
+               + _docx_style('Quote', 'Quote', 24, False, '<w:ind w:left="720"/>')
+               + _docx_style('ListParagraph', 'List Paragraph', 24, False, '<w:ind w:left="720" w:hanging="360"/>')
+               + '</w:styles>')
+
+DOCX_HEAD = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+             '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body>')
+DOCX_TAIL = '<w:sectPr><w:pgSz w:w="11906" w:h="16838"/></w:sectPr></w:body></w:document>'
+
+DOCX_RUN_PROPERTIES = {
+    'text': '',
+    'code': '<w:rPr><w:rFonts w:ascii="Consolas" w:hAnsi="Consolas"/></w:rPr>',
+    'bold': '<w:rPr><w:b/></w:rPr>',
+    'italic': '<w:rPr><w:i/></w:rPr>',
+    'link': '<w:rPr><w:u w:val="single"/></w:rPr>'
+}
+
+
+def _docx_text(text: str) -> str:
+    return f'<w:t xml:space="preserve">{html.escape(text, quote=False)}</w:t>'
+
+
+def _docx_paragraph(runs: str, style: str = None) -> str:
+    properties = f'<w:pPr><w:pStyle w:val="{style}"/></w:pPr>' if style else ''
+    return f'<w:p>{properties}{runs}</w:p>'
+
+
+def _docx_inline(text: str) -> str:
+    return ''.join(f'<w:r>{DOCX_RUN_PROPERTIES[style]}{_docx_text(value)}</w:r>'
+                   for style, value, _ in parse_inline(text))
+
+
+def render_docx(markdown: str) -> str:
+    """把一个章节渲染为 WordprocessingML 段落，拼接进 word/document.xml"""
+    out = []
+    for block in parse_blocks(markdown):
+        kind = block[0]
+        if kind == 'heading':
+            out.append(_docx_paragraph(_docx_inline(block[2]), f"Heading{min(block[1], 3)}"))
+        elif kind == 'paragraph':
+            out.append(_docx_paragraph(_docx_inline(block[1])))
+        elif kind == 'list':
+            for number, item in enumerate(block[2], 1):
+                marker = f"{number}. " if block[1] else '• '
+                out.append(_docx_paragraph(f'<w:r>{_docx_text(marker)}</w:r>' + _docx_inline(item), 'ListParagraph'))
+        elif kind == 'quote':
+            out.append(_docx_paragraph(_docx_inline(block[1]), 'Quote'))
+        elif kind == 'code':
+            runs = '<w:r><w:br/></w:r>'.join(f'<w:r>{DOCX_RUN_PROPERTIES["code"]}{_docx_text(line)}</w:r>'
+                                             for line in block[2].split('\n'))
+            out.append(_docx_paragraph(runs))
+        elif kind == 'rule':
+            out.append('<w:p><w:pPr><w:pBdr><w:bottom w:val="single" w:sz="6" w:space="1" w:color="auto"/></w:pBdr></w:pPr></w:p>')
+    return ''.join(out)
+
+
+RENDERERS = {
+    'markdown': lambda markdown: markdown + '\n\n',
+    'html': render_html,
+    'docx': render_docx
+}
+
+
+class RenderCache:
+    """按章节内容哈希缓存渲染结果
+
+    每个条目一个文件，跨进程共享；只修订了一个章节时，再次导出只需渲染这个章节。
+    """
+    def __init__(self, directory: str = None):
+        self.directory = directory or os.path.join(get_state_dir(), 'renders')
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, fmt: str, chunk_hash: str) -> str:
+        return os.path.join(self.directory, fmt, chunk_hash[:2], f"{RENDER_VERSION}-{chunk_hash}")
+
+    def render(self, fmt: str, chunk: DraftChunk, renderer: Callable[[str], str]) -> str:
+        path = self._path(fmt, chunk.hash)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                self.hits += 1
+                return f.read()
+        except FileNotFoundError:
+            pass
+        self.misses += 1
+        rendered = renderer(chunk.content)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(rendered)
+        os.replace(tmp_path, path)
+        return rendered
+
+
+def _sections(document: DraftDocument, fmt: str, cache: RenderCache) -> Iterator[str]:
+    """逐个章节产出渲染结果，任一时刻只有一个章节的输出在内存中"""
+    renderer = RENDERERS[fmt]
+    if fmt == 'markdown':
+        # Markdown 原样输出，不需要缓存
+        for chunk in document:
+            yield renderer(chunk.content)
+        return
+    for chunk in document:
+        yield cache.render(fmt, chunk, renderer)
+
+
+@traced('export.draft')
+def export_document(document: DraftDocument, fmt: str, out: BinaryIO, title: str = '', cache: RenderCache = None):
+    """把草稿以 fmt 格式流式写入 out（二进制流，可以是不可 seek 的管道）"""
+    if fmt not in RENDERERS:
+        raise ValueError(f"Unsupported export format: {fmt}")
+    cache = cache or RenderCache()
+    sections = _sections(document, fmt, cache)
+
+    if fmt == 'docx':
+        with zipfile.ZipFile(out, 'w', zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr('[Content_Types].xml', DOCX_CONTENT_TYPES)
+            archive.writestr('_rels/.rels', DOCX_RELS)
+            archive.writestr('word/_rels/document.xml.rels', DOCX_DOCUMENT_RELS)
+            archive.writestr('word/styles.xml', DOCX_STYLES)
+            with archive.open('word/document.xml', 'w', force_zip64=True) as body:
+                body.write(DOCX_HEAD.encode('utf-8'))
+                for section in sections:
+                    body.write(section.encode('utf-8'))
+                body.write(DOCX_TAIL.encode('utf-8'))
+    else:
+        if fmt == 'html':
+            out.write(HTML_HEAD.format(title=html.escape(title)).encode('utf-8'))
+        for section in sections:
+            out.write(section.encode('utf-8'))
+            out.flush()
+        if fmt == 'html':
+            out.write(HTML_TAIL.encode('utf-8'))
+    out.flush()
+
+    set_attributes({'export.format': fmt, 'export.sections': len(document),
+                    'export.cache_hits': cache.hits, 'export.cache_misses': cache.misses})
+    if cache.hits:
+        metrics.inc('pulitzer_cache_requests_total', cache.hits, cache='render', result='hit')
+    if cache.misses:
+        metrics.inc('pulitzer_cache_requests_total', cache.misses, cache='render', result='miss')
+
+
+def load_draft(session_id: str, store: SessionStore = None) -> Tuple[DraftDocument, str]:
+    """从会话存储读取草稿和主题，不加载 LLM 客户端等其他状态"""
+    data = (store or SessionStore()).load(session_id)
+    if data is None:
+        raise KeyError(session_id)
+    return DraftDocument.from_data(data.get('draft')), data.get('topic', '')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stream a session draft as Markdown, HTML or DOCX to stdout')
+    parser.add_argument('--session', required=True, help='Session ID')
+    parser.add_argument('--format', choices=FORMATS, default='markdown')
+    args = parser.parse_args()
+
+    try:
+        document, topic = load_draft(args.session)
+    except KeyError:
+        print(f"Session not found: {args.session}", file=sys.stderr)
+        return 3
+    if not document:
+        print(f"Session has no draft: {args.session}", file=sys.stderr)
+        return 4
+    export_document(document, args.format, sys.stdout.buffer, title=document.chunks[0].title or topic)
+    metrics.flush()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
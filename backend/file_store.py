@@ -0,0 +1,76 @@
+import os
+import json
+import errno
+import fcntl
+import tempfile
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+
+def get_state_dir() -> str:
+    """获取跨进程共享状态的目录，可通过 PULITZER_STATE_DIR 覆盖"""
+    state_dir = os.getenv('PULITZER_STATE_DIR') or os.path.join(tempfile.gettempdir(), 'pulitzer-ai')
+    os.makedirs(state_dir, exist_ok=True)
+    return state_dir
+
+
+def pid_alive(pid: int) -> bool:
+    """判断本机上的进程是否仍然存活"""
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+class JsonFileStore:
+    """以 JSON 文件保存、用文件锁保护的共享状态
+
+    Node 每次请求都会启动新的 Python 进程，进程内变量无法跨请求或跨 worker 共享，
+    因此需要共享的状态都通过这里读写。
+    """
+    def __init__(self, name: str, directory: str = None):
+        self.directory = directory or get_state_dir()
+        os.makedirs(self.directory, exist_ok=True)
+        self.path = os.path.join(self.directory, f"{name}.json")
+        self.lock_path = f"{self.path}.lock"
+
+    @contextmanager
+    def _lock(self, exclusive: bool) -> Iterator[None]:
+        with open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load(self) -> Dict:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save(self, data: Dict):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def read(self) -> Dict:
+        """读取当前状态的快照"""
+        with self._lock(exclusive=False):
+            return self._load()
+
+    @contextmanager
+    def update(self) -> Iterator[Dict]:
+        """在排他锁内读取-修改-写回状态"""
+        with self._lock(exclusive=True):
+            data = self._load()
+            yield data
+            self._save(data)
@@ -0,0 +1,277 @@
+import os
+import sys
+import json
+import time
+import fcntl
+import logging
+import argparse
+import threading
+from collections import defaultdict
+from types import SimpleNamespace
+from typing import Dict, Iterator, List, Optional
+
+from llm_guard import is_retryable
+from singleflight import request_key
+from tracing import set_attributes
+
+logger = logging.getLogger(__name__)
+
+CASSETTE_MODES = {'record', 'replay', 'replay-fast'}
+
+
+class CassetteMiss(Exception):
+    """回放时磁带中没有该请求的录制结果"""
+
+
+class RecordedError(Exception):
+    """回放录制时发生的上游错误，保留原错误的状态码和是否可重试"""
+    def __init__(self, error: Dict):
+        super().__init__(f"{error['type']}: {error['message']}")
+        self.status_code = error.get('status_code')
+        self.retryable = error.get('retryable', False)
+
+
+def _error_dict(error: Exception) -> Dict:
+    return {'type': type(error).__name__, 'message': str(error),
+            'status_code': getattr(error, 'status_code', None), 'retryable': is_retryable(error)}
+
+
+def _usage_dict(usage) -> Optional[Dict]:
+    if usage is None:
+        return None
+    return {'prompt_tokens': usage.prompt_tokens, 'completion_tokens': usage.completion_tokens}
+
+
+def _usage(data: Optional[Dict]):
+    return SimpleNamespace(**data) if data else None
+
+
+class Cassette:
+    """LLM 调用的录制/回放磁带，一个 JSONL 文件，每行一次调用
+
+    每条记录保存请求的归一化哈希（与 singleflight 相同）、流式增量及其相对请求开始的时间、
+    finish_reason、usage，以及录制时发生的错误。多个进程可以同时向同一磁带追加。
+    回放时相同的请求按录制顺序依次返回，用完后重复最后一次。
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._recordings: Optional[Dict[str, List[Dict]]] = None
+        self._cursors: Dict[str, int] = defaultdict(int)
+
+    def append(self, record: Dict):
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with open(self.path, 'a', encoding='utf-8') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.write(line)
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def records(self) -> Iterator[Dict]:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+        except FileNotFoundError:
+            return
+
+    def next_for(self, key: str) -> Dict:
+        """取出该请求的下一条录制结果"""
+        with self._lock:
+            if self._recordings is None:
+                self._recordings = defaultdict(list)
+                for record in self.records():
+                    self._recordings[record['key']].append(record)
+            recordings = self._recordings.get(key)
+            if not recordings:
+                raise CassetteMiss(f"No recorded response for request {key[:12]} in {self.path}")
+            index = min(self._cursors[key], len(recordings) - 1)
+            self._cursors[key] += 1
+            return recordings[index]
+
+
+class RecordingStream:
+    """包装真实的流式响应，转发每个 chunk 并记录增量和时间，结束、关闭或出错时写入磁带"""
+    def __init__(self, response, cassette: Cassette, record: Dict, started: float):
+        self.response = response
+        self.cassette = cassette
+        self.record = record
+        self.started = started
+        self._written = False
+
+    def __iter__(self):
+        try:
+            for chunk in self.response:
+                offset = round(time.perf_counter() - self.started, 4)
+                usage = getattr(chunk, 'usage', None)
+                if usage is not None:
+                    self.record['usage'] = _usage_dict(usage)
+                if chunk.choices:
+                    choice = chunk.choices[0]
+                    content = getattr(getattr(choice, 'delta', None), 'content', None)
+                    finish_reason = getattr(choice, 'finish_reason', None)
+                    if content or finish_reason:
+                        self.record['chunks'].append([offset, content or '', finish_reason])
+                yield chunk
+        except GeneratorExit:
+            # 调用方提前结束（例如 should_stop），只录制到这里
+            self.record['closed'] = True
+            raise
+        except Exception as e:
+            self.record['error'] = _error_dict(e)
+            raise
+        finally:
+            self._write()
+
+    def close(self):
+        getattr(self.response, 'close', lambda: None)()
+        self.record['closed'] = True
+        self._write()
+
+    def _write(self):
+        if not self._written:
+            self._written = True
+            self.cassette.append(self.record)
+
+
+class ReplayStream:
+    """按录制的时间（或不等待）逐个返回录制的 chunk"""
+    def __init__(self, record: Dict, fast: bool):
+        self.record = record
+        self.fast = fast
+        self._closed = False
+
+    def __iter__(self):
+        started = time.perf_counter()
+        for offset, content, finish_reason in self.record['chunks']:
+            if self._closed:
+                return
+            if not self.fast:
+                delay = started + offset - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            delta = SimpleNamespace(content=content or None)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta, finish_reason=finish_reason)], usage=None)
+        if self.record.get('error'):
+            raise RecordedError(self.record['error'])
+        if self.record.get('usage'):
+            yield SimpleNamespace(choices=[], usage=_usage(self.record['usage']))
+
+    def close(self):
+        self._closed = True
+
+
+class CassetteCompletions:
+    """替代 client.chat.completions：录制模式调用真实接口并记录，回放模式从磁带返回"""
+    def __init__(self, completions, cassette: Cassette, mode: str):
+        self.completions = completions
+        self.cassette = cassette
+        self.mode = mode
+
+    def create(self, **request):
+        key = request_key(request)
+        set_attributes({'llm.cassette': self.mode, 'llm.cassette_key': key[:12]})
+        if self.mode == 'record':
+            return self._record(key, request)
+        return self._replay(self.cassette.next_for(key), request)
+
+    def _record(self, key: str, request: Dict):
+        record = {'key': key, 'model': request.get('model'), 'stream': bool(request.get('stream')),
+                  'recordedAt': time.time(), 'chunks': [], 'usage': None, 'error': None}
+        started = time.perf_counter()
+        try:
+            response = self.completions.create(**request)
+        except Exception as e:
+            record['error'] = _error_dict(e)
+            record['latency'] = round(time.perf_counter() - started, 4)
+            self.cassette.append(record)
+            raise
+        if record['stream']:
+            return RecordingStream(response, self.cassette, record, started)
+        choice = response.choices[0]
+        record['chunks'].append([round(time.perf_counter() - started, 4), choice.message.content,
+                                 getattr(choice, 'finish_reason', None)])
+        record['usage'] = _usage_dict(getattr(response, 'usage', None))
+        self.cassette.append(record)
+        return response
+
+    def _replay(self, record: Dict, request: Dict):
+        fast = self.mode == 'replay-fast'
+        if request.get('stream'):
+            return ReplayStream(record, fast)
+        if not record['stream'] and record['chunks']:
+            offset, content, finish_reason = record['chunks'][0]
+        else:
+            # 录制的是流式调用：等待最后一个增量的时间后一次返回全部内容
+            offset = record['chunks'][-1][0] if record['chunks'] else 0
+            content = ''.join(chunk[1] for chunk in record['chunks'])
+            finish_reason = record['chunks'][-1][2] if record['chunks'] else None
+        if not fast:
+            time.sleep(offset)
+        if record.get('error'):
+            raise RecordedError(record['error'])
+        message = SimpleNamespace(content=content)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason=finish_reason)],
+                               usage=_usage(record.get('usage')))
+
+
+def cassette_mode() -> Optional[str]:
+    """当前进程使用的磁带模式，未设置磁带时为 None"""
+    if not os.getenv('PULITZER_CASSETTE'):
+        return None
+    mode = os.getenv('PULITZER_CASSETTE_MODE', 'replay')
+    if mode not in CASSETTE_MODES:
+        raise ValueError(f"Unknown cassette mode {mode!r}, expected one of {sorted(CASSETTE_MODES)}")
+    return mode
+
+
+def replaying() -> bool:
+    """是否从磁带回放：回放时不访问上游，也就不需要 API key、配额和熔断"""
+    return cassette_mode() in ('replay', 'replay-fast')
+
+
+def wrap_client(client, path: str = None, mode: str = None):
+    """按 PULITZER_CASSETTE（磁带路径）和 PULITZER_CASSETTE_MODE（record / replay / replay-fast）
+    包装 OpenAI 客户端；未设置磁带时原样返回
+    """
+    path = path or os.getenv('PULITZER_CASSETTE')
+    if not path:
+        return client
+    mode = mode or os.getenv('PULITZER_CASSETTE_MODE', 'replay')
+    if mode not in CASSETTE_MODES:
+        raise ValueError(f"Unknown cassette mode {mode!r}, expected one of {sorted(CASSETTE_MODES)}")
+    completions = CassetteCompletions(client.chat.completions, _cassette(path), mode)
+    logger.info(f"LLM calls use cassette {path} ({mode})")
+    return SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+
+# 同一进程内的客户端共用一个磁带对象，回放顺序在进程内保持一致
+_cassettes: Dict[str, Cassette] = {}
+
+
+def _cassette(path: str) -> Cassette:
+    path = os.path.abspath(path)
+    if path not in _cassettes:
+        _cassettes[path] = Cassette(path)
+    return _cassettes[path]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspect an LLM cassette recorded with PULITZER_CASSETTE_MODE=record')
+    parser.add_argument('path', help='Cassette file (JSONL)')
+    args = parser.parse_args()
+
+    for record in Cassette(args.path).records():
+        chunks = record['chunks']
+        ttft = chunks[0][0] if chunks else None
+        duration = chunks[-1][0] if chunks else record.get('latency')
+        characters = sum(len(chunk[1] or '') for chunk in chunks)
+        status = record['error']['type'] if record.get('error') else (chunks[-1][2] if chunks else None)
+        print(f"{record['key'][:12]}  {record.get('model')}  chunks={len(chunks)}  chars={characters}  "
+              f"ttft={ttft}s  duration={duration}s  finish={status or ('closed' if record.get('closed') else '-')}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
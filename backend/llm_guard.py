@@ -0,0 +1,370 @@
+import os
+import time
+import random
+import hashlib
+import logging
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, List, Optional, Tuple, TypeVar
+
+from openai import APIConnectionError, APIStatusError
+
+from file_store import JsonFileStore
+from metrics import metrics
+from tracing import set_attributes
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+# 每个端点保留的最近 429 时间戳个数
+THROTTLE_HISTORY = 20
+
+
+class CircuitOpenError(Exception):
+    """熔断器处于打开状态，请求被直接拒绝"""
+    def __init__(self, retry_after: float):
+        super().__init__(f"LLM circuit is open, retry after {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+class ContextWindowExceeded(Exception):
+    """去掉所有可删减的历史后，提示词仍然放不进模型的上下文窗口"""
+    def __init__(self, prompt_tokens: int, context_window: int):
+        super().__init__(f"Prompt needs ~{prompt_tokens} tokens, exceeding the {context_window}-token context window")
+        self.prompt_tokens = prompt_tokens
+        self.context_window = context_window
+
+
+class StreamInterrupted(Exception):
+    """流式响应在已经输出部分内容之后中断
+
+    已输出的增量无法撤回，因此不能从头重试；partial 为已输出的文本，调用方应从这里续写。
+    """
+    def __init__(self, partial: str, cause: str):
+        super().__init__(f"LLM stream interrupted after {len(partial)} characters: {cause}")
+        self.partial = partial
+
+
+class RateLimitExceeded(Exception):
+    """等待令牌的时间超过了允许的上限"""
+    def __init__(self, retry_after: float):
+        super().__init__(f"LLM rate limit exceeded, retry after {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+def _count_cjk(text: str) -> int:
+    return sum(1 for ch in text if '⺀' <= ch <= '鿿' or '가' <= ch <= '힯')
+
+
+def estimate_text_tokens(text: str) -> int:
+    """粗略估算文本的 token 数（中日韩字符按 1 个，其余按 4 个字符 1 个）"""
+    text = text or ''
+    cjk = _count_cjk(text)
+    return cjk + (len(text) - cjk) // 4
+
+
+def estimate_request_tokens(messages: List[Dict], max_tokens: int = 0) -> int:
+    """粗略估算一次请求占用的 token 数，每条消息另加 4 个格式开销
+
+    预编译模板渲染出的提示词自带 tokens 属性，直接使用。
+    """
+    total = 0
+    for message in messages:
+        content = message.get('content')
+        tokens = getattr(content, 'tokens', None)
+        total += (tokens if tokens is not None else estimate_text_tokens(content)) + 4
+    return total + (max_tokens or 0)
+
+
+def estimate_output_tokens(target_length: int, sample: str = '') -> int:
+    """按目标篇幅估算生成需要的 token 数
+
+    sample（主题、内容类型等）以中日韩文字为主时 target_length 按字数计，每字约 1 个 token；
+    否则按英文单词计，每词约 1.4 个 token。另留 20% 给标题和 Markdown 格式。
+    """
+    letters = [ch for ch in sample or '' if ch.isalpha()]
+    per_word = 1.0 if letters and _count_cjk(''.join(letters)) * 2 >= len(letters) else 1.4
+    return int(target_length * per_word * 1.2)
+
+
+def fit_request(messages: List[Dict], max_tokens: int, context_window: int,
+                min_completion: int = 512) -> Tuple[List[Dict], int, int]:
+    """让请求放进上下文窗口
+
+    依次删去最早的历史消息（保留开头的系统提示和最后的用户提示），直到至少能留出
+    min(max_tokens, min_completion) 个 token 给输出；max_tokens 不超过剩余窗口。
+    返回 (消息, max_tokens, 删去的历史消息数)，删完历史仍放不下时抛出 ContextWindowExceeded。
+    """
+    head = 1 if len(messages) > 1 and messages[0].get('role') == 'system' else 0
+    history = messages[head:-1]
+    prompt_tokens = estimate_request_tokens(messages)
+    needed = min(max_tokens, min_completion)
+
+    dropped = 0
+    while prompt_tokens + needed > context_window and dropped < len(history):
+        prompt_tokens -= estimate_request_tokens([history[dropped]])
+        dropped += 1
+    if prompt_tokens + needed > context_window:
+        raise ContextWindowExceeded(prompt_tokens, context_window)
+
+    fitted = messages[:head] + history[dropped:] + messages[-1:]
+    return fitted, min(max_tokens, context_window - prompt_tokens), dropped
+
+
+def get_retry_after(error: Exception) -> Optional[float]:
+    """从 API 错误的响应头中读取 Retry-After（秒）"""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if not headers:
+        return None
+
+    retry_after_ms = headers.get('retry-after-ms')
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+
+    retry_after = headers.get('retry-after')
+    if not retry_after:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(error: Exception) -> bool:
+    """429、5xx 以及连接/超时错误可以重试；错误自带 retryable 时（如回放的录制错误）以它为准"""
+    retryable = getattr(error, 'retryable', None)
+    if retryable is not None:
+        return retryable
+    if isinstance(error, (APIConnectionError, ConnectionError, TimeoutError)):
+        return True
+    status_code = getattr(error, 'status_code', None)
+    return status_code is not None and (status_code == 429 or status_code >= 500)
+
+
+class TokenBucket:
+    """令牌桶，状态保存在共享字典中，由调用方负责加锁"""
+    def __init__(self, name: str, capacity: float, refill_per_second: float):
+        self.name = name
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+
+    def try_acquire(self, state: Dict, amount: float, now: float) -> float:
+        """尝试取出令牌，成功返回 0，否则返回需要等待的秒数"""
+        bucket = state.setdefault(self.name, {'tokens': self.capacity, 'updated': now})
+        elapsed = max(0.0, now - bucket['updated'])
+        tokens = min(self.capacity, bucket['tokens'] + elapsed * self.refill_per_second)
+        bucket['updated'] = now
+
+        # 单次请求超过桶容量时按满桶处理，避免永远无法获得令牌
+        amount = min(amount, self.capacity)
+        if tokens >= amount:
+            bucket['tokens'] = tokens - amount
+            return 0.0
+        bucket['tokens'] = tokens
+        return (amount - tokens) / self.refill_per_second
+
+    def available(self, state: Dict, now: float) -> float:
+        """当前可用的令牌数，不修改状态"""
+        bucket = state.get(self.name)
+        if bucket is None:
+            return self.capacity
+        return min(self.capacity, bucket['tokens'] + max(0.0, now - bucket['updated']) * self.refill_per_second)
+
+
+class CircuitBreaker:
+    """带半开探测的熔断器，状态保存在共享字典中，由调用方负责加锁"""
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int, recovery_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+
+    def _state(self, state: Dict) -> Dict:
+        return state.setdefault('breaker', {
+            'state': self.CLOSED,
+            'failures': 0,
+            'opened_at': 0.0,
+            'probe_started': 0.0
+        })
+
+    def before_call(self, state: Dict, now: float) -> float:
+        """允许调用返回 0 并占用半开探测名额，否则返回剩余的熔断时间"""
+        breaker = self._state(state)
+        if breaker['state'] == self.CLOSED:
+            return 0.0
+
+        if breaker['state'] == self.OPEN:
+            remaining = breaker['opened_at'] + self.recovery_timeout - now
+            if remaining > 0:
+                return remaining
+            breaker['state'] = self.HALF_OPEN
+            breaker['probe_started'] = now
+            logger.info("LLM circuit half-open, sending probe request")
+            return 0.0
+
+        # 半开状态只放行一个探测请求；探测进程若异常退出，超时后允许新的探测
+        if now - breaker['probe_started'] >= self.recovery_timeout:
+            breaker['probe_started'] = now
+            return 0.0
+        return breaker['probe_started'] + self.recovery_timeout - now
+
+    def record_success(self, state: Dict):
+        breaker = self._state(state)
+        if breaker['state'] != self.CLOSED:
+            logger.info("LLM circuit closed")
+        breaker.update(state=self.CLOSED, failures=0, opened_at=0.0, probe_started=0.0)
+
+    def blocked_for(self, state: Dict, now: float) -> float:
+        """熔断器拒绝调用的剩余时间，不修改状态"""
+        breaker = state.get('breaker')
+        if not breaker or breaker['state'] == self.CLOSED:
+            return 0.0
+        started = breaker['opened_at'] if breaker['state'] == self.OPEN else breaker['probe_started']
+        return max(0.0, started + self.recovery_timeout - now)
+
+    def record_failure(self, state: Dict, now: float):
+        breaker = self._state(state)
+        breaker['failures'] += 1
+        if breaker['state'] == self.HALF_OPEN or breaker['failures'] >= self.failure_threshold:
+            if breaker['state'] != self.OPEN:
+                logger.warning(f"LLM circuit opened after {breaker['failures']} failures")
+            breaker.update(state=self.OPEN, opened_at=now, probe_started=0.0)
+
+
+class LLMGuard:
+    """LLM 调用的准入层：令牌桶限流、Retry-After 感知的退避重试和跨进程熔断
+
+    所有状态按 API 地址保存在共享文件中，同一台机器上的所有 worker 进程共同遵守。
+    """
+    def __init__(self,
+                 base_url: str = '',
+                 requests_per_minute: int = None,
+                 tokens_per_minute: int = None,
+                 max_retries: int = 3,
+                 base_delay: float = 1.0,
+                 max_delay: float = 30.0,
+                 max_wait: float = None,
+                 failure_threshold: int = None,
+                 recovery_timeout: float = None,
+                 store: JsonFileStore = None):
+        requests_per_minute = requests_per_minute or int(os.getenv('LLM_REQUESTS_PER_MINUTE', '60'))
+        tokens_per_minute = tokens_per_minute or int(os.getenv('LLM_TOKENS_PER_MINUTE', '200000'))
+        self.request_bucket = TokenBucket('requests', requests_per_minute, requests_per_minute / 60.0)
+        self.token_bucket = TokenBucket('tokens', tokens_per_minute, tokens_per_minute / 60.0)
+        self.breaker = CircuitBreaker(
+            failure_threshold or int(os.getenv('LLM_BREAKER_FAILURES', '5')),
+            recovery_timeout or float(os.getenv('LLM_BREAKER_RECOVERY', '30'))
+        )
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_wait = max_wait if max_wait is not None else float(os.getenv('LLM_MAX_ADMISSION_WAIT', '60'))
+        endpoint_id = hashlib.md5(base_url.encode('utf-8')).hexdigest()[:12]
+        self.store = store or JsonFileStore(f"llm_guard_{endpoint_id}")
+
+    def _admit(self, tokens: int):
+        """等待熔断器和令牌桶放行"""
+        waited = 0.0
+        while True:
+            now = time.time()
+            with self.store.update() as state:
+                # 其他进程收到的 Retry-After 对所有进程生效
+                wait = max(0.0, state.get('not_before', 0.0) - now)
+                # 先只查看熔断器，令牌桶放行后再占用半开探测名额，避免限流等待期间占着探测
+                breaker_wait = self.breaker.blocked_for(state, now) if not wait else 0.0
+                if breaker_wait:
+                    raise CircuitOpenError(breaker_wait)
+                if not wait:
+                    wait = self.request_bucket.try_acquire(state, 1, now)
+                if not wait:
+                    wait = self.token_bucket.try_acquire(state, tokens, now)
+                    if wait:
+                        # 归还已取出的请求令牌
+                        state['requests']['tokens'] += 1
+                if not wait:
+                    self.breaker.before_call(state, now)
+
+            if not wait:
+                return
+            if waited + wait > self.max_wait:
+                raise RateLimitExceeded(wait)
+            logger.info(f"LLM admission waiting {wait:.2f}s")
+            time.sleep(wait)
+            waited += wait
+
+    def backoff(self, attempt: int, error: Exception) -> float:
+        """第 attempt 次重试前的等待时间"""
+        retry_after = get_retry_after(error)
+        if retry_after is not None:
+            # 在服务端给出的时间上加少量抖动，避免所有 worker 同时醒来
+            return min(self.max_delay, retry_after) + random.uniform(0, self.base_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def _record_failure(self, error: Exception, delay: float):
+        now = time.time()
+        with self.store.update() as state:
+            if getattr(error, 'status_code', None) == 429:
+                state['not_before'] = max(state.get('not_before', 0.0), now + delay)
+                # 最近的 429 记录，供凭据池判断各个 key 的健康程度
+                state['throttled_at'] = (state.get('throttled_at', []) + [now])[-THROTTLE_HISTORY:]
+            else:
+                self.breaker.record_failure(state, now)
+
+    def status(self, tokens: int = 0) -> Dict:
+        """不占用令牌地查看当前状态：需要等待的秒数、配额使用比例和最近一分钟内的 429 次数"""
+        now = time.time()
+        state = self.store.read()
+        requests = self.request_bucket.available(state, now)
+        available_tokens = self.token_bucket.available(state, now)
+        wait = max(
+            state.get('not_before', 0.0) - now,
+            self.breaker.blocked_for(state, now),
+            (1 - requests) / self.request_bucket.refill_per_second,
+            (min(tokens, self.token_bucket.capacity) - available_tokens) / self.token_bucket.refill_per_second,
+            0.0
+        )
+        return {
+            'wait': wait,
+            'load': max(1 - requests / self.request_bucket.capacity, 1 - available_tokens / self.token_bucket.capacity),
+            'throttled': sum(1 for at in state.get('throttled_at', []) if now - at < 60),
+            'breaker': state.get('breaker', {}).get('state', CircuitBreaker.CLOSED)
+        }
+
+    def call(self, fn: Callable[[], T], tokens: int = 0) -> T:
+        """在限流和熔断保护下执行 fn，失败时按退避策略重试"""
+        attempt = 0
+        while True:
+            self._admit(tokens)
+            try:
+                result = fn()
+            except Exception as e:
+                if not is_retryable(e):
+                    # 服务端正常给出了 4xx 响应（如 400），说明上游可用；本地异常不改变熔断器状态
+                    if isinstance(e, APIStatusError) and 400 <= e.status_code < 500:
+                        with self.store.update() as state:
+                            self.breaker.record_success(state)
+                    raise
+                delay = self.backoff(attempt, e)
+                self._record_failure(e, delay)
+                if attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                metrics.inc('pulitzer_llm_retries_total', reason=type(e).__name__)
+                set_attributes({'llm.retries': attempt})
+                logger.warning(f"LLM call failed ({type(e).__name__}), retry {attempt}/{self.max_retries} in {delay:.2f}s")
+                time.sleep(delay)
+                continue
+
+            with self.store.update() as state:
+                self.breaker.record_success(state)
+            return result
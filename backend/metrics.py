@@ -0,0 +1,190 @@
+import os
+import sys
+import time
+import atexit
+import argparse
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Iterator, Tuple
+
+from file_store import JsonFileStore
+
+# 覆盖一次轮次/LLM 调用从几十毫秒到数分钟的范围
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+# 每秒生成 token 数的分桶
+RATE_BUCKETS = (1, 5, 10, 20, 30, 50, 75, 100, 150, 250)
+# 每篇长文的续写次数分桶
+CONTINUATION_BUCKETS = (0, 1, 2, 3, 4, 6, 8)
+
+METRIC_HELP = {
+    'pulitzer_turns_total': 'Conversation turns handled, by state and status',
+    'pulitzer_turn_seconds': 'Turn latency by the state the turn started in',
+    'pulitzer_llm_requests_total': 'LLM API requests, by model and status',
+    'pulitzer_llm_request_seconds': 'Total LLM request latency',
+    'pulitzer_llm_ttft_seconds': 'Time to first streamed token',
+    'pulitzer_llm_tokens_per_second': 'Completion tokens per second after the first token',
+    'pulitzer_llm_prompt_tokens_total': 'Prompt tokens sent to the LLM',
+    'pulitzer_llm_completion_tokens_total': 'Completion tokens received from the LLM',
+    'pulitzer_llm_retries_total': 'LLM calls retried after a retryable error',
+    'pulitzer_llm_early_stop_total': 'Streamed generations stopped early by the caller',
+    'pulitzer_draft_checkpoints_total': 'Partial draft checkpoints written to the session store',
+    'pulitzer_draft_resumed_total': 'Draft generations resumed from a checkpoint, by checkpoint state',
+    'pulitzer_llm_continuations': 'Continuation requests per long-form generation truncated by max_tokens',
+    'pulitzer_llm_key_requests_total': 'LLM requests sent with each pooled API key, by status',
+    'pulitzer_llm_key_throttled_total': 'HTTP 429 responses received for each pooled API key',
+    'pulitzer_llm_key_load': 'Share of the per-minute request or token quota of each pooled API key in use',
+    'pulitzer_llm_pool_capacity': 'Per-minute capacity of the healthy pooled API keys, by resource',
+    'pulitzer_llm_pool_keys': 'Pooled API keys, by health',
+    'pulitzer_outline_parse_total': 'Outline generations, by JSON parse result',
+    'pulitzer_question_dedup_total': 'Interview questions regenerated as near-duplicates, by final result',
+    'pulitzer_cache_requests_total': 'Cache lookups (singleflight, turn replay), by result',
+}
+
+
+def _label_key(labels: Dict[str, str]) -> str:
+    def escape(value) -> str:
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return ','.join(f'{name}="{escape(value)}"' for name, value in sorted(labels.items()))
+
+
+class Metrics:
+    """计数器和直方图
+
+    每个请求都在独立的 Python 进程里执行，指标先在进程内累积，
+    请求结束时合并进共享文件，由 worker 的 /metrics 或命令行统一导出。
+    """
+    def __init__(self, store: JsonFileStore = None):
+        self.store = store or JsonFileStore('metrics')
+        self.lock = threading.Lock()
+        self._counters: Dict[Tuple[str, str], float] = defaultdict(float)
+        self._histograms: Dict[Tuple[str, str], Dict] = {}
+        self._gauges: Dict[Tuple[str, str], float] = {}
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """计数器加 value"""
+        with self.lock:
+            self._counters[(name, _label_key(labels))] += value
+
+    def set(self, name: str, value: float, **labels):
+        """设置仪表盘的当前值，各进程之间以最后写入的为准"""
+        with self.lock:
+            self._gauges[(name, _label_key(labels))] = value
+
+    def observe(self, name: str, value: float, buckets: Tuple[float, ...] = DEFAULT_BUCKETS, **labels):
+        """记录一次直方图观测值"""
+        with self.lock:
+            key = (name, _label_key(labels))
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {
+                    'buckets': list(buckets), 'counts': [0] * len(buckets), 'sum': 0.0, 'count': 0
+                }
+            for i, bound in enumerate(histogram['buckets']):
+                if value <= bound:
+                    histogram['counts'][i] += 1
+                    break
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    @contextmanager
+    def timer(self, name: str, **labels) -> Iterator[None]:
+        """记录代码块耗时（秒）"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def flush(self):
+        """把进程内累积的指标合并进共享文件"""
+        with self.lock:
+            counters, self._counters = self._counters, defaultdict(float)
+            histograms, self._histograms = self._histograms, {}
+            gauges, self._gauges = self._gauges, {}
+        if not counters and not histograms and not gauges:
+            return
+        with self.store.update() as data:
+            stored_counters = data.setdefault('counters', {})
+            for (name, labels), value in counters.items():
+                series = stored_counters.setdefault(name, {})
+                series[labels] = series.get(labels, 0) + value
+            stored_histograms = data.setdefault('histograms', {})
+            for (name, labels), histogram in histograms.items():
+                series = stored_histograms.setdefault(name, {})
+                stored = series.get(labels)
+                if stored is None or stored['buckets'] != histogram['buckets']:
+                    series[labels] = histogram
+                    continue
+                stored['counts'] = [a + b for a, b in zip(stored['counts'], histogram['counts'])]
+                stored['sum'] += histogram['sum']
+                stored['count'] += histogram['count']
+            stored_gauges = data.setdefault('gauges', {})
+            for (name, labels), value in gauges.items():
+                stored_gauges.setdefault(name, {})[labels] = value
+
+    def render(self) -> str:
+        """以 Prometheus 文本格式导出所有进程汇总后的指标"""
+        self.flush()
+        data = self.store.read()
+        lines = []
+        for name, series in sorted(data.get('counters', {}).items()):
+            lines.append(f"# HELP {name} {METRIC_HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} counter")
+            for labels, value in sorted(series.items()):
+                lines.append(f"{name}{{{labels}}} {value:g}" if labels else f"{name} {value:g}")
+        for name, series in sorted(data.get('gauges', {}).items()):
+            lines.append(f"# HELP {name} {METRIC_HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in sorted(series.items()):
+                lines.append(f"{name}{{{labels}}} {value:g}" if labels else f"{name} {value:g}")
+        for name, series in sorted(data.get('histograms', {}).items()):
+            lines.append(f"# HELP {name} {METRIC_HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} histogram")
+            for labels, histogram in sorted(series.items()):
+                prefix = f"{labels}," if labels else ''
+                cumulative = 0
+                for bound, count in zip(histogram['buckets'], histogram['counts']):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{prefix}le="{bound:g}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {histogram["count"]}')
+                suffix = f"{{{labels}}}" if labels else ''
+                lines.append(f"{name}_sum{suffix} {histogram['sum']:g}")
+                lines.append(f"{name}_count{suffix} {histogram['count']}")
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        """清空所有已记录的指标"""
+        with self.lock:
+            self._counters = defaultdict(float)
+            self._histograms = {}
+            self._gauges = {}
+        with self.store.update() as data:
+            data.clear()
+
+
+metrics = Metrics()
+# 进程退出前把未合并的指标写入共享文件
+atexit.register(metrics.flush)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export collected engine metrics')
+    parser.add_argument('--output', help='Write Prometheus text to this file (e.g. for a textfile collector)')
+    parser.add_argument('--reset', action='store_true', help='Clear collected metrics')
+    args = parser.parse_args()
+
+    if args.reset:
+        metrics.reset()
+        return
+    text = metrics.render()
+    if args.output:
+        with open(f"{args.output}.tmp", 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(f"{args.output}.tmp", args.output)
+    else:
+        sys.stdout.write(text)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,226 @@
+import os
+import re
+import sys
+import glob
+import json
+import time
+import pstats
+import argparse
+import cProfile
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from typing import Iterator, List, Set
+
+from file_store import get_state_dir
+
+PROFILE_MODES = {'cpu', 'sample', 'memory'}
+# 采样间隔（秒），采样模式的开销与之成反比
+SAMPLE_INTERVAL = float(os.getenv('PULITZER_PROFILE_INTERVAL', '0.005'))
+
+# tracemalloc 是进程级的，Python 3.12 起同一时刻也只能有一个 cProfile 处于启用状态；
+# 分片 worker 在多个线程中处理请求，使用这两种剖析的请求逐个执行
+_exclusive = threading.Lock()
+
+
+def get_profile_dir() -> str:
+    profile_dir = os.getenv('PULITZER_PROFILE_DIR') or os.path.join(get_state_dir(), 'profiles')
+    os.makedirs(profile_dir, exist_ok=True)
+    return profile_dir
+
+
+def requested_modes(flag=None) -> Set[str]:
+    """解析要启用的剖析模式
+
+    flag 来自请求的 context.profile，未指定时读取 PULITZER_PROFILE 环境变量。
+    取值为逗号分隔的 cpu / sample / memory，true 或 1 等同于 cpu,memory。
+    """
+    if flag is None or flag is False:
+        flag = os.getenv('PULITZER_PROFILE', '')
+    if flag is True or str(flag).lower() in ('1', 'true', 'yes'):
+        return {'cpu', 'memory'}
+    return {mode.strip() for mode in str(flag).lower().split(',')} & PROFILE_MODES
+
+
+class StackSampler:
+    """后台线程定期采样目标线程的调用栈，输出可直接生成火焰图的折叠栈格式"""
+    def __init__(self, thread_id: int, interval: float = SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+@contextmanager
+def profiled(request_id: str, modes: Set[str]) -> Iterator[None]:
+    """在 modes 指定的剖析器下执行代码块，结果按请求 id 写入剖析目录
+
+    每个请求生成 <request id>.json（耗时、内存峰值、产物列表），以及
+    .prof（cProfile）、.stacks（折叠栈采样）、.mem.json（tracemalloc 分配热点）。
+    cpu 和 memory 剖析同一时刻只能有一个请求使用，其他请求等待；采样只针对当前线程，不受限制。
+    """
+    if not modes:
+        yield
+        return
+
+    if modes & {'cpu', 'memory'}:
+        waited = time.perf_counter()
+        with _exclusive:
+            with _profiled(request_id, modes, time.perf_counter() - waited):
+                yield
+    else:
+        with _profiled(request_id, modes, 0.0):
+            yield
+
+
+@contextmanager
+def _profiled(request_id: str, modes: Set[str], waited: float) -> Iterator[None]:
+    base = os.path.join(get_profile_dir(), re.sub(r'[^\w.-]', '_', request_id))
+    profiler = cProfile.Profile() if 'cpu' in modes else None
+    sampler = StackSampler(threading.get_ident()) if 'sample' in modes else None
+    trace_memory = 'memory' in modes and not tracemalloc.is_tracing()
+    if trace_memory:
+        tracemalloc.start(25)
+    if sampler:
+        sampler.start()
+    started = time.perf_counter()
+    if profiler:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler:
+            profiler.disable()
+        elapsed = time.perf_counter() - started
+        summary = {'request_id': request_id, 'modes': sorted(modes), 'seconds': round(elapsed, 4),
+                   'waited': round(waited, 4), 'files': []}
+
+        if sampler:
+            sampler.stop()
+            with open(f"{base}.stacks", 'w', encoding='utf-8') as f:
+                for stack, count in sampler.samples.most_common():
+                    f.write(f"{stack} {count}\n")
+            summary['files'].append(f"{base}.stacks")
+        if profiler:
+            profiler.dump_stats(f"{base}.prof")
+            summary['files'].append(f"{base}.prof")
+        if trace_memory:
+            # 排除剖析器自身的分配
+            snapshot = tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, cProfile.__file__),
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, __file__)
+            ])
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            sites = [
+                {'site': str(stat.traceback[0]), 'size': stat.size, 'count': stat.count}
+                for stat in snapshot.statistics('lineno')[:50]
+            ]
+            with open(f"{base}.mem.json", 'w', encoding='utf-8') as f:
+                json.dump({'peak': peak, 'sites': sites}, f, ensure_ascii=False, indent=2)
+            summary['peak_memory'] = peak
+            summary['files'].append(f"{base}.mem.json")
+
+        with open(f"{base}.json", 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+
+
+def _find(pattern: str, suffix: str, paths: List[str]) -> List[str]:
+    if paths:
+        return [path for path in paths if path.endswith(suffix)]
+    return sorted(glob.glob(os.path.join(get_profile_dir(), pattern)))
+
+
+def top_cpu(paths: List[str], sort: str, limit: int):
+    """合并多个 cProfile 结果，打印热点函数"""
+    files = _find('*.prof', '.prof', paths)
+    if not files:
+        print("No cProfile results found", file=sys.stderr)
+        return
+    stats = pstats.Stats(*files, stream=sys.stdout)
+    print(f"Aggregated {len(files)} profiles")
+    stats.strip_dirs().sort_stats(sort).print_stats(limit)
+
+
+def top_samples(paths: List[str], limit: int):
+    """合并多个采样结果，按独占和包含样本数打印热点"""
+    files = _find('*.stacks', '.stacks', paths)
+    self_samples, total_samples = Counter(), Counter()
+    total = 0
+    for path in files:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                stack, _, count = line.rstrip('\n').rpartition(' ')
+                count = int(count)
+                frames = stack.split(';')
+                total += count
+                self_samples[frames[-1]] += count
+                for frame in set(frames):
+                    total_samples[frame] += count
+    if not total:
+        print("No samples found", file=sys.stderr)
+        return
+    print(f"Aggregated {total} samples from {len(files)} requests")
+    print(f"{'self%':>7} {'total%':>7}  function")
+    for frame, count in self_samples.most_common(limit):
+        print(f"{count / total:>7.1%} {total_samples[frame] / total:>7.1%}  {frame}")
+
+
+def top_memory(paths: List[str], limit: int):
+    """合并多个 tracemalloc 快照，打印分配最多的代码位置"""
+    files = _find('*.mem.json', '.mem.json', paths)
+    sizes, counts, peaks = Counter(), Counter(), []
+    for path in files:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        peaks.append(data['peak'])
+        for site in data['sites']:
+            sizes[site['site']] += site['size']
+            counts[site['site']] += site['count']
+    if not files:
+        print("No memory snapshots found", file=sys.stderr)
+        return
+    print(f"Aggregated {len(files)} snapshots, max peak {max(peaks) / 1024:.1f} KiB")
+    for site, size in sizes.most_common(limit):
+        print(f"{size / len(files) / 1024:>10.1f} KiB avg {counts[site] / len(files):>8.0f} blocks  {site}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Aggregate per-request profiles')
+    parser.add_argument('kind', choices=['cpu', 'sample', 'memory'], help='Which profiles to aggregate')
+    parser.add_argument('paths', nargs='*', help='Profile files (defaults to every profile in the profile dir)')
+    parser.add_argument('--limit', type=int, default=25)
+    parser.add_argument('--sort', default='cumulative', help='pstats sort key for cpu profiles')
+    args = parser.parse_args()
+
+    if args.kind == 'cpu':
+        top_cpu(args.paths, args.sort, args.limit)
+    elif args.kind == 'sample':
+        top_samples(args.paths, args.limit)
+    else:
+        top_memory(args.paths, args.limit)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,133 @@
+import json
+import string
+import functools
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Tuple
+
+from llm_guard import estimate_text_tokens
+
+
+class Prompt(str):
+    """渲染后的提示词，附带预估的 token 数，可以直接当作字符串使用"""
+    tokens: int
+
+    def __new__(cls, text: str, tokens: int) -> 'Prompt':
+        prompt = super().__new__(cls, text)
+        prompt.tokens = tokens
+        return prompt
+
+
+class Fragment:
+    """已序列化的提示词片段"""
+    __slots__ = ('text', 'tokens')
+
+    def __init__(self, text: str, tokens: int = None):
+        self.text = text
+        self.tokens = estimate_text_tokens(text) if tokens is None else tokens
+
+
+def static_prompt(fn):
+    """装饰器：固定文本的提示词只构造一次，并附带预估的 token 数"""
+    cache: List[Prompt] = []
+
+    @functools.wraps(fn)
+    def wrapper() -> Prompt:
+        if not cache:
+            text = fn()
+            cache.append(Prompt(text, estimate_text_tokens(text)))
+        return cache[0]
+    return wrapper
+
+
+def _indent(text: str, depth: int) -> str:
+    """把 indent=2 的 JSON 文本嵌套到第 depth 层"""
+    return text.replace('\n', '\n' + '  ' * depth) if depth else text
+
+
+class PromptTemplate:
+    """预编译的提示词模板
+
+    模板语法与 str.format 相同，编译时把模板拆成静态文本和占位符，
+    静态部分的 token 数只计算一次；渲染时只需拼接。
+    占位符的值可以是字符串、数字或 Fragment。
+    """
+    __slots__ = ('parts', 'static_tokens')
+
+    def __init__(self, template: str):
+        self.parts: List[Tuple[str, str]] = []
+        static = []
+        for literal, field, _, _ in string.Formatter().parse(template):
+            self.parts.append((literal, field))
+            static.append(literal)
+        self.static_tokens = estimate_text_tokens(''.join(static))
+
+    def render(self, **values) -> Prompt:
+        pieces, tokens = [], self.static_tokens
+        for literal, field in self.parts:
+            pieces.append(literal)
+            if field is None:
+                continue
+            value = values[field]
+            if isinstance(value, Fragment):
+                pieces.append(value.text)
+                tokens += value.tokens
+            else:
+                value = str(value)
+                pieces.append(value)
+                tokens += estimate_text_tokens(value)
+        return Prompt(''.join(pieces), tokens)
+
+
+class FragmentCache:
+    """按 (名称, 版本) 缓存序列化后的片段
+
+    同一版本的大纲、设置、回答列表在一轮中只序列化一次；
+    对象变化时调用方提供新的版本号，旧版本按最近最少使用淘汰。
+    """
+    def __init__(self, max_entries: int = 64):
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[Hashable, Fragment]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _get(self, key: Hashable, build) -> Fragment:
+        fragment = self._entries.get(key)
+        if fragment is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return fragment
+        self.misses += 1
+        fragment = build()
+        self._entries[key] = fragment
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return fragment
+
+    def json(self, name: str, version: Hashable, value: Any, depth: int = 0) -> Fragment:
+        """value 的 json.dumps(indent=2, ensure_ascii=False) 结果，depth 为嵌套层数
+
+        value 可以是返回待序列化对象的无参函数，命中缓存时不会调用。
+        """
+        def build():
+            data = value() if callable(value) else value
+            return Fragment(_indent(json.dumps(data, indent=2, ensure_ascii=False), depth))
+        return self._get((name, version, depth), build)
+
+
+def json_value(value: Any) -> Fragment:
+    """标量值的 JSON 片段"""
+    return Fragment(json.dumps(value, ensure_ascii=False))
+
+
+def json_object(fields: Dict[str, Fragment], depth: int = 0) -> Fragment:
+    """用已序列化的字段拼出与 json.dumps(dict, indent=2, ensure_ascii=False) 相同的文本
+
+    字段的片段需要按 depth + 1 层缩进序列化。
+    """
+    if not fields:
+        return Fragment('{}')
+    pad = '  ' * (depth + 1)
+    keys = [f"{pad}{json.dumps(key, ensure_ascii=False)}: " for key in fields]
+    text = '{\n' + ',\n'.join(key + fragment.text for key, fragment in zip(keys, fields.values())) + '\n' + '  ' * depth + '}'
+    tokens = sum(fragment.tokens for fragment in fields.values()) + estimate_text_tokens(''.join(keys))
+    return Fragment(text, tokens)
@@ -0,0 +1,355 @@
+import os
+import re
+import sys
+import json
+import time
+import html
+import random
+import sqlite3
+import hashlib
+import threading
+import argparse
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from file_store import get_state_dir
+
+# 中日韩文字按重叠的二元组切分：unicode61 分词器会把连续的汉字当作一个词，
+# 索引和查询时都把汉字串改写为以空格分隔的二元组，任意两个字以上的子串都能按短语匹配
+CJK_CHAR = r'[⺀-鿿가-힯]'
+CJK_RUN_PATTERN = re.compile(f'{CJK_CHAR}+')
+TERM_PATTERN = re.compile(r'\w+', re.UNICODE)
+SNIPPET_CHARS = 40
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    topic TEXT,
+    content_type TEXT,
+    state TEXT,
+    updated_at REAL
+);
+CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions(updated_at DESC);
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    ref TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    title TEXT,
+    body TEXT,
+    hash TEXT NOT NULL,
+    UNIQUE (session_id, ref)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5(
+    title, body, content='', tokenize='unicode61 remove_diacritics 2'
+);
+"""
+
+# 排序只在最近的 SEARCH_CANDIDATES 条命中里进行：FTS5 的 bm25() 需要扫描整个索引统计短语的文档频率，
+# 常见词的查询耗时会随索引规模增长；候选集按 rowid 倒序读取可以提前结束，耗时与索引规模无关
+SEARCH_CANDIDATES = int(os.getenv('SEARCH_CANDIDATES', '300'))
+# BM25 参数，标题中的命中按 TITLE_WEIGHT 倍计
+BM25_K1, BM25_B, TITLE_WEIGHT = 1.2, 0.75, 5.0
+
+
+def _bigrams(match) -> str:
+    run = match.group(0)
+    if len(run) == 1:
+        return f' {run} '
+    return ' ' + ' '.join(run[i:i + 2] for i in range(len(run) - 1)) + ' '
+
+
+def segment(text: str) -> str:
+    """索引前把中日韩文字改写为二元组"""
+    return CJK_RUN_PATTERN.sub(_bigrams, text or '')
+
+
+def build_query(query: str) -> Optional[str]:
+    """把用户输入转换为 FTS5 查询：每个词为一个短语，词之间为 AND
+
+    单个汉字和最后一个拉丁词按前缀匹配。
+    """
+    phrases = []
+    for term in TERM_PATTERN.findall(query or ''):
+        phrase = '"' + ' '.join(segment(term).split()) + '"'
+        if CJK_RUN_PATTERN.fullmatch(term) and len(term) == 1:
+            phrase += '*'
+        phrases.append(phrase)
+    if not phrases:
+        return None
+    if not CJK_RUN_PATTERN.search(phrases[-1]) and not phrases[-1].endswith('*'):
+        phrases[-1] += '*'
+    return ' '.join(phrases)
+
+
+def make_snippet(text: str, terms: List[str]) -> str:
+    """截取第一个命中词附近的文字并用 <mark> 标出所有命中词"""
+    text = ' '.join((text or '').split())
+    if not terms:
+        return html.escape(text[:SNIPPET_CHARS * 2])
+    pattern = re.compile('|'.join(re.escape(term) for term in sorted(terms, key=len, reverse=True)), re.IGNORECASE)
+    first = pattern.search(text)
+    start = max((first.start() if first else 0) - SNIPPET_CHARS, 0)
+    end = min(start + SNIPPET_CHARS * 2, len(text))
+    window = text[start:end]
+    marked = []
+    position = 0
+    for match in pattern.finditer(window):
+        marked.append(html.escape(window[position:match.start()]))
+        marked.append(f"<mark>{html.escape(match.group(0))}</mark>")
+        position = match.end()
+    marked.append(html.escape(window[position:]))
+    return ('…' if start else '') + ''.join(marked) + ('…' if end < len(text) else '')
+
+
+def session_documents(collaborator) -> Iterator[Tuple[str, str, str, str, str]]:
+    """从协作会话中取出需要索引的文档：(ref, kind, title, body, hash)"""
+    def entry(ref, kind, title, body, digest=None):
+        digest = digest or hashlib.sha1(f"{title}\x00{body}".encode('utf-8')).hexdigest()[:16]
+        return ref, kind, title, body, digest
+
+    if collaborator.topic:
+        yield entry('topic', 'topic', collaborator.topic, collaborator.content_type or '')
+    if collaborator.outline:
+        lines = []
+        for section, items in collaborator.outline.items():
+            lines.append(section)
+            lines.extend(str(item) for item in (items if isinstance(items, list) else [items]))
+        yield entry('outline', 'outline', collaborator.topic, '\n'.join(lines))
+    for section in collaborator.interview_responses.sections():
+        body = '\n'.join(f"{item.question}\n{item.answer}" for item in collaborator.interview_responses.for_section(section))
+        yield entry(f"interview:{section}", 'interview', section, body)
+    for chunk in collaborator.draft:
+        yield entry(f"draft:{chunk.id}", 'draft', chunk.title or collaborator.topic, chunk.content, chunk.hash)
+
+
+class SearchIndex:
+    """过去会话的全文索引（SQLite FTS5）
+
+    每次保存会话时增量更新：按内容哈希比较，只重写发生变化的主题、大纲、
+    面试部分和草稿章节。数据库使用 WAL 模式，多个 Python 进程可以同时读写。
+    SQLite 连接不能跨线程使用，分片 worker 的每个请求线程各自打开一个连接。
+    """
+    def __init__(self, path: str = None):
+        self.path = path or os.path.join(get_state_dir(), 'search.db')
+        self._local = threading.local()
+        self.conn.executescript(SCHEMA)
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """当前线程的连接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def close(self):
+        """关闭当前线程的连接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def index_documents(self, session_id: str, documents: List[Tuple[str, str, str, str, str]],
+                        topic: str = '', content_type: str = '', state: str = '') -> int:
+        """更新一个会话的文档，返回重写的文档数"""
+        with self.conn:
+            self.conn.execute(
+                'INSERT INTO sessions (session_id, topic, content_type, state, updated_at) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT(session_id) DO UPDATE SET topic = excluded.topic, content_type = excluded.content_type, '
+                'state = excluded.state, updated_at = excluded.updated_at',
+                (session_id, topic, content_type, state, time.time())
+            )
+            existing = {ref: (doc_id, digest) for doc_id, ref, digest in self.conn.execute(
+                'SELECT id, ref, hash FROM documents WHERE session_id = ?', (session_id,))}
+
+            written = 0
+            for ref, kind, title, body, digest in documents:
+                doc_id, old_digest = existing.pop(ref, (None, None))
+                if old_digest == digest:
+                    continue
+                if doc_id is not None:
+                    self._delete_document(doc_id)
+                doc_id = self.conn.execute(
+                    'INSERT INTO documents (session_id, ref, kind, title, body, hash) VALUES (?, ?, ?, ?, ?, ?)',
+                    (session_id, ref, kind, title, body, digest)).lastrowid
+                self.conn.execute('INSERT INTO documents_fts (rowid, title, body) VALUES (?, ?, ?)',
+                                  (doc_id, segment(title), segment(body)))
+                written += 1
+
+            # 已删除的章节等
+            for doc_id, _ in existing.values():
+                self._delete_document(doc_id)
+            return written + len(existing)
+
+    def _delete_document(self, doc_id: int):
+        """无内容的 FTS5 表删除时需要提供原来索引的文本"""
+        title, body = self.conn.execute('SELECT title, body FROM documents WHERE id = ?', (doc_id,)).fetchone()
+        self.conn.execute("INSERT INTO documents_fts (documents_fts, rowid, title, body) VALUES ('delete', ?, ?, ?)",
+                          (doc_id, segment(title), segment(body)))
+        self.conn.execute('DELETE FROM documents WHERE id = ?', (doc_id,))
+
+    def index_collaborator(self, session_id: str, collaborator) -> int:
+        return self.index_documents(session_id, list(session_documents(collaborator)), collaborator.topic,
+                                    collaborator.content_type, collaborator.state.value)
+
+    def delete_session(self, session_id: str):
+        with self.conn:
+            for (doc_id,) in self.conn.execute('SELECT id FROM documents WHERE session_id = ?', (session_id,)).fetchall():
+                self._delete_document(doc_id)
+            self.conn.execute('DELETE FROM sessions WHERE session_id = ?', (session_id,))
+
+    def search(self, query: str, page: int = 1, page_size: int = 20, kind: str = None) -> Dict:
+        """按相关度分页搜索，结果带高亮片段
+
+        只有最近的 SEARCH_CANDIDATES 条命中参与排序，更早的命中不会出现在结果中，
+        此时返回的 truncated 为 True。候选内按 BM25 的词频饱和与长度归一化打分；
+        所有候选都包含全部查询词，逆文档频率对排序没有影响，因此省略。
+        """
+        match = build_query(query)
+        page, page_size = max(int(page), 1), min(max(int(page_size), 1), 100)
+        empty = {'query': query, 'page': page, 'pageSize': page_size, 'hasMore': False, 'truncated': False,
+                 'results': []}
+        if match is None:
+            return empty
+
+        sql = ("SELECT d.session_id, d.kind, d.ref, d.title, d.body FROM documents_fts "
+               "JOIN documents d ON d.id = documents_fts.rowid WHERE documents_fts MATCH ?")
+        params: List = [match]
+        if kind:
+            sql += ' AND d.kind = ?'
+            params.append(kind)
+        sql += ' ORDER BY documents_fts.rowid DESC LIMIT ?'
+        # 多取一条，用来判断是否有命中被排除在候选之外
+        params.append(SEARCH_CANDIDATES + 1)
+        try:
+            candidates = self.conn.execute(sql, params).fetchall()
+        except sqlite3.OperationalError:
+            # 查询语法无法解析时按无结果处理
+            return empty
+        if not candidates:
+            return empty
+        truncated = len(candidates) > SEARCH_CANDIDATES
+        candidates = candidates[:SEARCH_CANDIDATES]
+
+        terms = [term.lower() for term in TERM_PATTERN.findall(query)]
+        average_length = sum(len(row[4] or '') for row in candidates) / len(candidates) or 1
+        scored = []
+        for row in candidates:
+            title, body = (row[3] or '').lower(), (row[4] or '').lower()
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * len(body) / average_length)
+            score = 0.0
+            for term in terms:
+                tf = TITLE_WEIGHT * title.count(term) + body.count(term)
+                score += tf * (BM25_K1 + 1) / (tf + norm)
+            scored.append((score, row))
+        scored.sort(key=lambda item: item[0], reverse=True)
+
+        offset = (page - 1) * page_size
+        page_rows = scored[offset:offset + page_size]
+        placeholders = ','.join('?' * len(page_rows))
+        sessions = {session_id: (topic, updated_at) for session_id, topic, updated_at in self.conn.execute(
+            f"SELECT session_id, topic, updated_at FROM sessions WHERE session_id IN ({placeholders})",
+            [row[0] for _, row in page_rows])}
+        results = []
+        for score, (session_id, kind, ref, title, body) in page_rows:
+            topic, updated_at = sessions.get(session_id, (None, None))
+            results.append({
+                'sessionId': session_id,
+                'kind': kind,
+                'ref': ref,
+                'title': title,
+                'topic': topic,
+                'updatedAt': updated_at,
+                'snippet': make_snippet(body if any(term in (body or '').lower() for term in terms) else title, terms),
+                'score': round(score, 4)
+            })
+        return {'query': query, 'page': page, 'pageSize': page_size, 'hasMore': len(scored) > offset + page_size,
+                'truncated': truncated, 'results': results}
+
+    def list_sessions(self, page: int = 1, page_size: int = 20) -> Dict:
+        """按最近更新时间列出已索引的会话"""
+        page, page_size = max(int(page), 1), min(max(int(page_size), 1), 100)
+        rows = self.conn.execute(
+            'SELECT session_id, topic, content_type, state, updated_at FROM sessions '
+            'ORDER BY updated_at DESC LIMIT ? OFFSET ?', (page_size + 1, (page - 1) * page_size)).fetchall()
+        return {
+            'page': page,
+            'pageSize': page_size,
+            'hasMore': len(rows) > page_size,
+            'sessions': [{'sessionId': session_id, 'topic': topic, 'contentType': content_type,
+                          'state': state.upper() if state else state, 'updatedAt': updated_at}
+                         for session_id, topic, content_type, state, updated_at in rows[:page_size]]
+        }
+
+
+_ALPHABET = '的是了在人有我他这个们中来上大为和国地到以说时要就出会可也你对生能而子那得于着下自之年过发后作里用道行所然家种事成方多经么去法学如都同现当没动面起看定天分'
+
+
+def benchmark(sessions: int, queries: int):
+    """生成 sessions 个模拟会话并测量搜索延迟
+
+    模拟文本由两三个字的词按 Zipf 分布组成，分别查询高频、中频和低频词。
+    """
+    path = os.path.join(get_state_dir(), f'search-bench-{sessions}.db')
+    index = SearchIndex(path)
+    index.conn.execute('PRAGMA synchronous=OFF')
+    rng = random.Random(0)
+    vocabulary = list(dict.fromkeys(''.join(rng.choices(_ALPHABET, k=rng.choice((2, 3)))) for _ in range(30000)))
+    weights = [1 / rank for rank in range(1, len(vocabulary) + 1)]
+    text = lambda words: ''.join(rng.choices(vocabulary, weights, k=words))
+
+    count = index.conn.execute('SELECT COUNT(*) FROM sessions').fetchone()[0]
+    started = time.perf_counter()
+    for i in range(count, sessions):
+        documents = [('topic', 'topic', text(4), 'Article'),
+                     ('outline', 'outline', '', '\n'.join(text(5) for _ in range(5))),
+                     ('interview:背景', 'interview', '背景', text(80)),
+                     ('draft:s1', 'draft', text(3), text(250))]
+        index.index_documents(f"bench-{i}", [(*doc, str(i)) for doc in documents], documents[0][2], 'Article', 'complete')
+    if sessions > count:
+        print(f"indexed {sessions - count} sessions in {time.perf_counter() - started:.1f}s")
+
+    for rank in (1, 10, 100, 1000, 10000):
+        term = vocabulary[rank - 1]
+        timings = []
+        for _ in range(queries):
+            started = time.perf_counter()
+            result = index.search(term, page=rng.randint(1, 5))
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        print(f"rank {rank:>5} {term:>4} p50={timings[len(timings) // 2]:.2f}ms "
+              f"p95={timings[int(len(timings) * 0.95)]:.2f}ms results={len(result['results'])}")
+    index.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Full-text index over past sessions')
+    sub = parser.add_subparsers(dest='command', required=True)
+    search = sub.add_parser('search', help='Search sessions, print JSON')
+    search.add_argument('--query', required=True)
+    search.add_argument('--page', type=int, default=1)
+    search.add_argument('--page-size', type=int, default=20)
+    search.add_argument('--kind', choices=['topic', 'outline', 'interview', 'draft'])
+    history = sub.add_parser('history', help='List indexed sessions, print JSON')
+    history.add_argument('--page', type=int, default=1)
+    history.add_argument('--page-size', type=int, default=20)
+    bench = sub.add_parser('bench', help='Measure search latency on synthetic sessions')
+    bench.add_argument('--sessions', type=int, default=100000)
+    bench.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+
+    if args.command == 'bench':
+        benchmark(args.sessions, args.queries)
+        return
+    index = SearchIndex()
+    if args.command == 'search':
+        data = index.search(args.query, args.page, args.page_size, args.kind)
+    else:
+        data = index.list_sessions(args.page, args.page_size)
+    print(json.dumps({'status': 'success', 'data': data}, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
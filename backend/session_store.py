@@ -0,0 +1,116 @@
+import os
+import time
+import hashlib
+from typing import Dict, Optional, Tuple
+
+from file_store import JsonFileStore, get_state_dir
+from metrics import metrics
+
+# 流式生成草稿时两次检查点之间的最短间隔（秒）
+DRAFT_CHECKPOINT_INTERVAL = float(os.getenv('DRAFT_CHECKPOINT_INTERVAL', '2'))
+
+
+class SessionStore:
+    """持久化保存协作会话状态，一个会话一个文件
+
+    会话状态不再只存在于某个进程的内存里，任何 worker 都可以从这里接管会话。
+    """
+    def __init__(self, directory: str = None):
+        self.directory = directory or os.path.join(get_state_dir(), 'sessions')
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _store(self, session_id: str, suffix: str = '') -> JsonFileStore:
+        name = hashlib.sha256(session_id.encode('utf-8')).hexdigest()
+        return JsonFileStore(name + suffix, self.directory)
+
+    def _remove(self, store: JsonFileStore) -> bool:
+        if not os.path.exists(store.path):
+            return False
+        os.unlink(store.path)
+        if os.path.exists(store.lock_path):
+            os.unlink(store.lock_path)
+        return True
+
+    def load(self, session_id: str) -> Optional[Dict]:
+        """读取会话状态，不存在时返回 None"""
+        return self._store(session_id).read() or None
+
+    def stamp(self, session_id: str) -> Optional[Tuple[int, int]]:
+        """会话文件的标识（inode 和修改时间），不存在时返回 None
+
+        每次保存都会用新文件替换旧文件，标识变化说明会话被保存过。
+        """
+        try:
+            stat = os.stat(self._store(session_id).path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    def save(self, session_id: str, state: Dict):
+        """整体覆盖保存会话状态"""
+        with self._store(session_id).update() as data:
+            data.clear()
+            data.update(state)
+
+    def delete(self, session_id: str) -> bool:
+        """删除会话状态和草稿检查点"""
+        self.clear_checkpoint(session_id)
+        return self._remove(self._store(session_id))
+
+    def load_checkpoint(self, session_id: str) -> Optional[Dict]:
+        """读取草稿生成的检查点，不存在时返回 None"""
+        return self._store(session_id, '.checkpoint').read() or None
+
+    def save_checkpoint(self, session_id: str, checkpoint: Dict):
+        """覆盖保存草稿生成的检查点"""
+        with self._store(session_id, '.checkpoint').update() as data:
+            data.clear()
+            data.update(checkpoint)
+
+    def clear_checkpoint(self, session_id: str) -> bool:
+        """删除草稿生成的检查点"""
+        return self._remove(self._store(session_id, '.checkpoint'))
+
+
+class DraftCheckpoint:
+    """流式生成草稿时定期把已写完的段落保存到会话存储
+
+    进程退出或上游连接中断时，下一次生成同一篇草稿（主题、类型、大纲、篇幅和设置都不变）
+    会从检查点继续，只需要生成缺失的部分。生成完成时检查点标记为 complete，
+    在草稿随会话状态保存之后由 SessionManager 删除。
+    """
+    def __init__(self, store: Optional[SessionStore], session_id: str, key: str,
+                 interval: float = DRAFT_CHECKPOINT_INTERVAL):
+        self.store = store if session_id else None
+        self.session_id = session_id
+        self.key = key
+        self.interval = interval
+        saved = self.store.load_checkpoint(session_id) if self.store else None
+        if saved and saved.get('key') != key:
+            saved = None
+        # 可以继续的已写完部分；complete 为 True 时是完整的草稿
+        self.text = saved['text'] if saved else ''
+        self.complete = bool(saved and saved.get('complete'))
+        self._saved_length = len(self.text)
+        self._saved_at = time.monotonic()
+
+    def update(self, text: str, force: bool = False):
+        """保存已写完的部分；距上次保存不足 interval 秒或没有新内容时跳过"""
+        if not self.store or len(text) <= self._saved_length:
+            return
+        if not force and time.monotonic() - self._saved_at < self.interval:
+            return
+        self._save(text, complete=False)
+
+    def finish(self, text: str):
+        """保存完整的草稿"""
+        if self.store:
+            self._save(text, complete=True)
+
+    def _save(self, text: str, complete: bool):
+        self.store.save_checkpoint(self.session_id, {
+            'key': self.key, 'text': text, 'complete': complete, 'updatedAt': time.time()
+        })
+        self._saved_length = len(text)
+        self._saved_at = time.monotonic()
+        metrics.inc('pulitzer_draft_checkpoints_total', complete=str(complete).lower())
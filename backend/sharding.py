@@ -0,0 +1,295 @@
+import sys
+import json
+import time
+import bisect
+import hashlib
+import logging
+import argparse
+import threading
+import multiprocessing
+import urllib.request
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, List, Optional
+
+from metrics import metrics
+from tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_VIRTUAL_NODES = 128
+
+
+def _hash(value: str) -> int:
+    # 与 src/utils/hashRing.js 保持一致：md5 前 8 个十六进制字符
+    return int(hashlib.md5(value.encode('utf-8')).hexdigest()[:8], 16)
+
+
+class ConsistentHashRing:
+    """带虚拟节点的一致性哈希环，把会话 id 映射到 worker"""
+    def __init__(self, nodes: Iterable[str] = (), virtual_nodes: int = DEFAULT_VIRTUAL_NODES):
+        self.virtual_nodes = virtual_nodes
+        self._points: List[int] = []
+        self._owners: Dict[int, str] = {}
+        self.nodes = set()
+        for node in nodes:
+            self.add_node(node)
+
+    def add_node(self, node: str):
+        if node in self.nodes:
+            return
+        self.nodes.add(node)
+        for i in range(self.virtual_nodes):
+            point = _hash(f"{node}#{i}")
+            if point in self._owners:
+                continue
+            self._owners[point] = node
+            bisect.insort(self._points, point)
+
+    def remove_node(self, node: str):
+        if node not in self.nodes:
+            return
+        self.nodes.discard(node)
+        self._points = [p for p in self._points if self._owners[p] != node]
+        self._owners = {p: n for p, n in self._owners.items() if n != node}
+
+    def get_node(self, key: str) -> Optional[str]:
+        """返回负责该 key 的 worker"""
+        if not self._points:
+            return None
+        index = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._owners[self._points[index]]
+
+
+class ShardWorker:
+    """一个分片 worker：内存中只保留自己负责的会话
+
+    worker 加入或离开时，不再归自己负责的会话会先写入持久化存储再从内存移除，
+    新的负责者在第一次请求时从存储中加载，从而完成交接。
+    """
+    def __init__(self, worker_id: str, handler: Callable[[str, object, Dict], Dict] = None):
+        self.worker_id = worker_id
+        self.ring = ConsistentHashRing([worker_id])
+        self.handler = handler
+        # 同一会话的请求串行处理，不同会话并发
+        self.session_locks = defaultdict(threading.Lock)
+        self.lock = threading.Lock()
+
+    def _default_handler(self, session_id, input_data, context):
+        import content_collab_local_llm as engine
+        return engine.handle_request(session_id, input_data, context)
+
+    def handle_turn(self, session_id: str, input_data, context: Dict, traceparent: str = None) -> Dict:
+        owner = self.ring.get_node(session_id)
+        if owner != self.worker_id:
+            logger.warning(f"Session {session_id} belongs to {owner}, serving on {self.worker_id}")
+        handler = self.handler or self._default_handler
+        with self.lock:
+            session_lock = self.session_locks[session_id]
+        try:
+            with tracer.span('worker.turn', {'worker.id': self.worker_id, 'session.id': session_id},
+                             traceparent=traceparent):
+                with session_lock:
+                    return handler(session_id, input_data, context or {})
+        finally:
+            tracer.flush()
+
+    def set_members(self, members: Iterable[str]) -> List[str]:
+        """更新成员列表，返回被交接出去的会话
+
+        交接出去的会话在各自的会话锁内移除：正在处理的轮次先完成并保存，之后才从内存中移除。
+        """
+        with self.lock:
+            self.ring = ConsistentHashRing(members)
+            if self.handler:
+                return []
+            import content_collab_local_llm as engine
+            handed_off = [
+                session_id for session_id in list(engine.session_manager.sessions)
+                if self.ring.get_node(session_id) != self.worker_id
+            ]
+        evicted = []
+        for session_id in handed_off:
+            with self.lock:
+                session_lock = self.session_locks[session_id]
+            with session_lock:
+                # 等待期间成员可能再次变化，会话又归自己负责时保留
+                with self.lock:
+                    owner = self.ring.get_node(session_id)
+                if owner != self.worker_id:
+                    engine.session_manager.evict_session(session_id)
+                    evicted.append(session_id)
+        if evicted:
+            logger.info(f"Worker {self.worker_id} handed off {len(evicted)} sessions")
+        return evicted
+
+
+def _make_request_handler(worker: ShardWorker):
+    class WorkerRequestHandler(BaseHTTPRequestHandler):
+        def _send(self, status: int, body: Dict):
+            payload = json.dumps(body, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            if self.path == '/health':
+                self._send(200, {'status': 'success', 'worker': worker.worker_id})
+            elif self.path == '/metrics':
+                payload = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+            else:
+                self._send(404, {'status': 'error', 'message': 'not found'})
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            try:
+                body = json.loads(self.rfile.read(length) or b'{}')
+                if self.path == '/turn':
+                    result = worker.handle_turn(body.get('session'), body.get('input'), body.get('context'),
+                                                self.headers.get('traceparent'))
+                    self._send(200, result)
+                elif self.path == '/membership':
+                    handed_off = worker.set_members(body.get('workers', []))
+                    self._send(200, {'status': 'success', 'handedOff': handed_off})
+                else:
+                    self._send(404, {'status': 'error', 'message': 'not found'})
+            except Exception as e:
+                logger.error(f"Worker {worker.worker_id} request failed: {e}")
+                self._send(500, {'status': 'error', 'message': str(e)})
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    return WorkerRequestHandler
+
+
+class WorkerHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # 默认 backlog 只有 5，突发并发时会直接重置连接
+    request_queue_size = 256
+
+
+def serve(worker_id: str, port: int, host: str = '127.0.0.1', handler=None):
+    """启动分片 worker 的 HTTP 服务"""
+    worker = ShardWorker(worker_id, handler)
+    server = WorkerHTTPServer((host, port), _make_request_handler(worker))
+    logger.info(f"Shard worker {worker_id} listening on {host}:{port}")
+    server.serve_forever()
+
+
+def _post(url: str, body: Dict, timeout: float = 60) -> Dict:
+    request = urllib.request.Request(
+        url,
+        data=json.dumps(body).encode('utf-8'),
+        headers={'Content-Type': 'application/json'}
+    )
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+def _simulated_turn(latency: float, cpu_time: float, slots: int):
+    """压测用的轮次处理：模拟 LLM 等待和本地 CPU 开销，并写入会话存储
+
+    每个 worker 同时最多处理 slots 个轮次，代表单个 worker 的容量上限。
+    """
+    semaphore = threading.Semaphore(slots)
+
+    def handler(session_id, input_data, context):
+        from session_store import SessionStore
+        with semaphore:
+            time.sleep(latency)
+            deadline = time.process_time() + cpu_time
+            while time.process_time() < deadline:
+                pass
+            SessionStore().save(session_id, {'last_input': input_data})
+        return {'status': 'success', 'data': {'response': 'ok'}}
+    return handler
+
+
+def _bench_worker(worker_id: str, port: int, latency: float, cpu_time: float, slots: int):
+    serve(worker_id, port, handler=_simulated_turn(latency, cpu_time, slots))
+
+
+def benchmark(worker_counts: List[int], sessions: int, turns: int,
+              latency: float, cpu_time: float, slots: int, base_port: int = 18100):
+    """多进程压测：会话按一致性哈希分散到各 worker，吞吐应随 worker 数线性增长"""
+    results = []
+    for count in worker_counts:
+        workers = {f"w{i}": f"http://127.0.0.1:{base_port + i}" for i in range(count)}
+        processes = [
+            multiprocessing.Process(target=_bench_worker, args=(worker_id, base_port + i, latency, cpu_time, slots), daemon=True)
+            for i, worker_id in enumerate(workers)
+        ]
+        for process in processes:
+            process.start()
+        time.sleep(0.5)
+
+        ring = ConsistentHashRing(workers)
+        for url in workers.values():
+            _post(f"{url}/membership", {'workers': list(workers)})
+
+        def drive(session_index: int):
+            session_id = f"bench-{session_index}"
+            url = workers[ring.get_node(session_id)]
+            for turn in range(turns):
+                _post(f"{url}/turn", {'session': session_id, 'input': f"turn {turn}", 'context': {}})
+
+        started = time.time()
+        threads = [threading.Thread(target=drive, args=(i,)) for i in range(sessions)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - started
+
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+
+        throughput = sessions * turns / elapsed
+        results.append({'workers': count, 'turns': sessions * turns, 'seconds': elapsed, 'throughput': throughput})
+        base_port += count
+
+    baseline = results[0]['throughput'] / results[0]['workers']
+    print(f"{'workers':>8} {'turns':>8} {'seconds':>9} {'turns/s':>9} {'scaling':>8}")
+    for row in results:
+        scaling = row['throughput'] / baseline / row['workers']
+        print(f"{row['workers']:>8} {row['turns']:>8} {row['seconds']:>9.2f} {row['throughput']:>9.1f} {scaling:>8.2f}")
+    return results
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='Session sharding worker')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    serve_parser = subparsers.add_parser('serve', help='Run a shard worker')
+    serve_parser.add_argument('--worker-id', required=True)
+    serve_parser.add_argument('--port', type=int, required=True)
+    serve_parser.add_argument('--host', default='127.0.0.1')
+
+    bench_parser = subparsers.add_parser('bench', help='Measure throughput scaling with simulated turns')
+    bench_parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    bench_parser.add_argument('--sessions', type=int, default=64)
+    bench_parser.add_argument('--turns', type=int, default=5)
+    bench_parser.add_argument('--latency', type=float, default=0.05, help='Simulated LLM wait per turn')
+    bench_parser.add_argument('--cpu-time', type=float, default=0.0, help='Simulated CPU work per turn')
+    bench_parser.add_argument('--slots', type=int, default=1, help='Concurrent turns per worker')
+
+    args = parser.parse_args()
+    if args.command == 'serve':
+        serve(args.worker_id, args.port, args.host)
+    else:
+        benchmark(args.workers, args.sessions, args.turns, args.latency, args.cpu_time, args.slots)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,233 @@
+import os
+import json
+import time
+import hashlib
+import logging
+from typing import Callable, Dict, Optional, Tuple
+
+from file_store import get_state_dir, pid_alive
+from llm_guard import StreamInterrupted
+from metrics import metrics
+from tracing import set_attributes
+
+logger = logging.getLogger(__name__)
+
+# 超过该时间的结果文件不再被复用，只等待清理
+RESULT_TTL = 300
+
+
+def request_key(payload: Dict) -> str:
+    """计算请求的归一化哈希：消息内容中的空白差异不影响结果"""
+    normalized = dict(payload)
+    normalized.pop('stream', None)
+    normalized['messages'] = [
+        {
+            'role': message.get('role'),
+            'content': ' '.join((message.get('content') or '').split())
+        }
+        for message in payload.get('messages', [])
+    ]
+    raw = json.dumps(normalized, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class SingleFlight:
+    """合并相同的并发 LLM 请求
+
+    第一个到达的进程（leader）真正发起请求，并把流式增量逐行写入共享文件；
+    同一时刻到达的相同请求（follower）不再调用 API，而是跟读该文件，
+    把增量转发给自己的 on_delta 回调，最后拿到同一份完整结果。
+    leader 失败时，尚未转发任何增量的 follower 自行重新发起请求；
+    已经转发过部分增量的 follower 抛出 StreamInterrupted，由调用方从已输出的内容续写。
+
+    锁文件内容为 "pid token"，先写入临时文件再硬链接为锁，其他进程不会读到空的或写了一半的锁。
+    每次运行的 token 不同：增量文件按 token 命名，结果中也带有 token，
+    follower 不会读到上一次运行残留的增量或结果。
+    """
+    def __init__(self, directory: str = None, poll_interval: float = 0.05):
+        self.directory = directory or os.path.join(get_state_dir(), 'singleflight')
+        os.makedirs(self.directory, exist_ok=True)
+        self.poll_interval = poll_interval
+
+    def _paths(self, key: str) -> Dict[str, str]:
+        base = os.path.join(self.directory, key)
+        return {
+            'base': base,
+            'lock': f"{base}.lock",
+            'done': f"{base}.done"
+        }
+
+    def _stream_path(self, paths: Dict[str, str], token: str) -> str:
+        return f"{paths['base']}.{token}.stream"
+
+    def _try_lead(self, paths: Dict[str, str]) -> Optional[str]:
+        """尝试成为 leader，成功时返回本次运行的 token"""
+        token = os.urandom(8).hex()
+        tmp_path = f"{paths['lock']}.{token}"
+        with open(tmp_path, 'w') as f:
+            f.write(f"{os.getpid()} {token}")
+        try:
+            os.link(tmp_path, paths['lock'])
+        except FileExistsError:
+            return None
+        finally:
+            os.unlink(tmp_path)
+        return token
+
+    def _leader(self, paths: Dict[str, str]) -> Optional[Tuple[int, str]]:
+        """读取锁中的 leader pid 和 token；没有锁时返回 None，内容无效时 pid 为 0"""
+        try:
+            with open(paths['lock'], 'r') as f:
+                parts = f.read().split()
+        except FileNotFoundError:
+            return None
+        try:
+            return int(parts[0]), parts[1] if len(parts) > 1 else ''
+        except (IndexError, ValueError):
+            return 0, ''
+
+    def _cleanup_expired(self):
+        now = time.time()
+        for name in os.listdir(self.directory):
+            if not name.endswith(('.stream', '.done')):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                if now - os.path.getmtime(path) > RESULT_TTL:
+                    os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def run(self,
+            key: str,
+            fn: Callable[[Callable[[str], None]], str],
+            on_delta: Callable[[str], None] = None,
+            meta: Dict = None) -> str:
+        """执行 fn(emit) 或加入正在进行的相同请求，返回完整响应
+
+        meta 为可选的附加信息（如 finish_reason）：leader 的 fn 写入其中的内容随结果一起保存，
+        follower 拿到结果时复制到自己的 meta 中。
+        """
+        paths = self._paths(key)
+        if meta is None:
+            meta = {}
+        while True:
+            token = self._try_lead(paths)
+            if token:
+                metrics.inc('pulitzer_cache_requests_total', cache='singleflight', result='miss')
+                set_attributes({'cache.singleflight': 'miss'})
+                return self._lead(paths, token, fn, on_delta, meta)
+
+            leader = self._leader(paths)
+            if leader is None:
+                # leader 刚好结束并删除了锁
+                result = self._read_done(paths)
+                if result is not None and result.get('status') == 'success':
+                    metrics.inc('pulitzer_cache_requests_total', cache='singleflight', result='hit')
+                    set_attributes({'cache.singleflight': 'hit'})
+                    meta.update(result.get('meta') or {})
+                    if on_delta:
+                        on_delta(result['result'])
+                    return result['result']
+                continue
+
+            pid, token = leader
+            # pid 为 0 的锁无效（pid_alive(0) 总是成立），与已退出的 leader 一样视为没有被持有
+            if pid <= 0 or not pid_alive(pid):
+                logger.warning(f"Singleflight leader {pid or 'unknown'} is gone, taking over {key[:12]}")
+                try:
+                    os.unlink(paths['lock'])
+                except FileNotFoundError:
+                    pass
+                continue
+
+            logger.info(f"Joining in-flight LLM request {key[:12]} led by {pid}")
+            result = self._follow(paths, pid, token, on_delta, meta)
+            if result is not None:
+                metrics.inc('pulitzer_cache_requests_total', cache='singleflight', result='hit')
+                set_attributes({'cache.singleflight': 'hit'})
+                return result
+            # leader 失败时自行重新发起请求
+
+    def _lead(self, paths, token: str, fn, on_delta, meta: Dict) -> str:
+        self._cleanup_expired()
+        stream_file = open(self._stream_path(paths, token), 'a', encoding='utf-8')
+
+        def emit(delta: str):
+            stream_file.write(json.dumps(delta, ensure_ascii=False) + '\n')
+            stream_file.flush()
+            if on_delta:
+                on_delta(delta)
+
+        done = {'status': 'error', 'error': 'interrupted', 'token': token}
+        try:
+            result = fn(emit)
+            done = {'status': 'success', 'result': result, 'meta': meta, 'token': token}
+            return result
+        except Exception as e:
+            done = {'status': 'error', 'error': str(e), 'token': token}
+            raise
+        finally:
+            stream_file.close()
+            with open(f"{paths['done']}.tmp", 'w', encoding='utf-8') as f:
+                json.dump(done, f, ensure_ascii=False)
+            os.replace(f"{paths['done']}.tmp", paths['done'])
+            os.unlink(paths['lock'])
+
+    def _read_done(self, paths) -> Optional[Dict]:
+        try:
+            if time.time() - os.path.getmtime(paths['done']) > RESULT_TTL:
+                return None
+            with open(paths['done'], 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _follow(self, paths, pid: int, token: str, on_delta, meta: Dict) -> Optional[str]:
+        """跟读 leader 的增量文件，直到 leader 写出最终结果
+
+        只接受带有该 leader token 的结果，之前运行留下的结果文件被忽略。
+        leader 失败且尚未转发任何增量时返回 None；已转发部分增量时抛出 StreamInterrupted。
+        """
+        stream_path = self._stream_path(paths, token)
+        offset = 0
+        pending = b''
+        forwarded = []
+        while True:
+            done = self._read_done(paths)
+            if done is not None and done.get('token') != token:
+                done = None
+            try:
+                with open(stream_path, 'rb') as f:
+                    f.seek(offset)
+                    data = f.read()
+                    offset += len(data)
+            except FileNotFoundError:
+                data = b''
+
+            # 只处理完整的行，避免读到写了一半的多字节字符
+            pending += data
+            *lines, pending = pending.split(b'\n')
+            for line in lines:
+                if line:
+                    delta = json.loads(line.decode('utf-8'))
+                    forwarded.append(delta)
+                    if on_delta:
+                        on_delta(delta)
+
+            if done is not None:
+                if done.get('status') == 'success':
+                    meta.update(done.get('meta') or {})
+                    return done['result']
+                error = done.get('error')
+            elif not pid_alive(pid):
+                error = f"leader {pid} exited"
+            else:
+                time.sleep(self.poll_interval)
+                continue
+
+            logger.warning(f"Singleflight leader failed: {error}")
+            if forwarded:
+                # 已转发的增量无法撤回，重新发起请求会让调用方收到重复的内容
+                raise StreamInterrupted(''.join(forwarded), error)
+            return None
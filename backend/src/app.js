@@ -2,6 +2,7 @@ require('dotenv').config();
 const express = require('express');
 const cors = require('cors');
 const { errorHandler } = require('./utils/errorHandler');
+const tracing = require('./utils/tracing');
 const swaggerUi = require('swagger-ui-express');
 const swaggerSpec = require('./config/swagger');
 
@@ -9,6 +10,7 @@ const swaggerSpec = require('./config/swagger');
 const collaborationRoutes = require('./routes/collaborationRoutes');
 const interviewRoutes = require('./routes/interviewRoutes');
 const draftRoutes = require('./routes/draftRoutes');
+const workerRoutes = require('./routes/workerRoutes');
 
 const app = express();
 
@@ -18,7 +20,8 @@ const corsOptions = {
     ? 'http://localhost:5173'  // Vite 默认端口
     : ['https://wmilysrsttsc.sealosgzg.site'],
   methods: ['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS'],
-  allowedHeaders: ['Content-Type', 'Accept'],
+  allowedHeaders: ['Content-Type', 'Accept', 'Idempotency-Key', 'traceparent'],
+  exposedHeaders: ['traceparent', 'Retry-After', 'Content-Disposition'],
   credentials: true,
   maxAge: 86400
 };
@@ -29,6 +32,9 @@ app.use(cors(corsOptions));
 // 添加预检请求处理
 app.options('*', cors(corsOptions));
 
+// 链路追踪：每个请求一个根 span
+app.use(tracing.middleware());
+
 // 其他中间件
 app.use(express.json());
 app.use(express.urlencoded({ extended: true }));
@@ -44,7 +50,7 @@ app.get('/api/v1/docs.json', (req, res) => {
 
 // 添加全局请求日志中间件
 app.use((req, res, next) => {
-  console.log(`[${new Date().toISOString()}] ${req.method} ${req.originalUrl}`);
+  console.log(`[${new Date().toISOString()}] [${tracing.currentSpan()?.traceId}] ${req.method} ${req.originalUrl}`);
   console.log('Headers:', req.headers);
   console.log('Body:', req.body);
   next();
@@ -53,6 +59,7 @@ app.use((req, res, next) => {
 // API路由
 app.use('/api/v1/collaboration', collaborationRoutes);
 app.use('/api/v1/draft', draftRoutes);
+app.use('/api/v1/workers', workerRoutes);
 
 // 404处理
 app.use((req, res, next) => {
@@ -2,6 +2,9 @@ const pythonService = require('../services/pythonService');
 const { ApiError } = require('../utils/errorHandler');
 const { v4: uuidv4 } = require('uuid');
 
+// 搜索结果的文档类型
+const SEARCH_KINDS = ['topic', 'outline', 'interview', 'draft'];
+
 /**
  * 协作会话控制器
  */
@@ -107,6 +110,8 @@ class CollaborationController {
     try {
       const { sessionId } = req.params;
       const { input, context } = req.body;
+      // 幂等键：优先使用请求头，兼容放在请求体中的 turnId
+      const turnId = req.get('Idempotency-Key') || req.body.turnId;
 
       if (!input) {
         throw new ApiError(400, '输入内容不能为空');
@@ -117,7 +122,7 @@ class CollaborationController {
         context
       });
 
-      const result = await pythonService.processInput(sessionId, input, context);
+      const result = await pythonService.processInput(sessionId, input, context, turnId);
       res.status(200).json(result);
     } catch (error) {
       next(error);
@@ -130,13 +135,52 @@ class CollaborationController {
   async getMessages(req, res, next) {
     try {
       const { sessionId } = req.params;
-      const result = await pythonService.getSessionMessages(sessionId);
+      const result = await pythonService.getSessionMessages(sessionId, req.query.since);
       res.status(200).json(result);
     } catch (error) {
       next(error);
     }
   }
 
+  /**
+   * 全文搜索过去的会话
+   */
+  async searchSessions(req, res, next) {
+    try {
+      const { q, page, pageSize, kind } = req.query;
+      if (!q || !q.trim()) {
+        throw new ApiError(400, '缺少必要的参数：q');
+      }
+      if (kind && !SEARCH_KINDS.includes(kind)) {
+        throw new ApiError(400, `不支持的文档类型: ${kind}`);
+      }
+
+      const data = await pythonService.searchSessions({ query: q, page, pageSize, kind });
+      res.status(200).json({
+        status: 'success',
+        data
+      });
+    } catch (error) {
+      next(error);
+    }
+  }
+
+  /**
+   * 列出持久化的历史会话
+   */
+  async getSessionHistory(req, res, next) {
+    try {
+      const { page, pageSize } = req.query;
+      const data = await pythonService.listSessionHistory({ page, pageSize });
+      res.status(200).json({
+        status: 'success',
+        data
+      });
+    } catch (error) {
+      next(error);
+    }
+  }
+
   /**
    * 获取会话信息
    */
@@ -1,4 +1,13 @@
 const pythonService = require('../services/pythonService');
+const pythonRunner = require('../utils/pythonRunner');
+const { ApiError } = require('../utils/errorHandler');
+
+// 导出格式 -> [Content-Type, 扩展名]
+const EXPORT_FORMATS = {
+  markdown: ['text/markdown; charset=utf-8', 'md'],
+  html: ['text/html; charset=utf-8', 'html'],
+  docx: ['application/vnd.openxmlformats-officedocument.wordprocessingml.document', 'docx']
+};
 
 /**
  * 草稿生成控制器
@@ -37,6 +46,38 @@ class DraftController {
       next(error);
     }
   }
+
+  /**
+   * 流式导出草稿（Markdown、HTML 或 DOCX）
+   */
+  async exportDraft(req, res, next) {
+    try {
+      const { sessionId } = req.params;
+      const format = req.query.format || 'markdown';
+      if (!EXPORT_FORMATS[format]) {
+        throw new ApiError(400, `不支持的导出格式: ${format}`);
+      }
+      const [contentType, extension] = EXPORT_FORMATS[format];
+
+      await pythonRunner.streamScript({
+        user: sessionId,
+        script: 'draft_export.py',
+        args: ['--session', sessionId, '--format', format],
+        output: res,
+        onStart: () => {
+          res.status(200);
+          res.set('Content-Type', contentType);
+          res.set('Content-Disposition', `attachment; filename="draft-${sessionId}.${extension}"`);
+        },
+        errors: {
+          3: [404, '会话不存在'],
+          4: [404, '草稿尚未生成']
+        }
+      });
+    } catch (error) {
+      next(error);
+    }
+  }
 }
 
 module.exports = new DraftController(); 
\ No newline at end of file
@@ -12,6 +12,8 @@ class InterviewController {
     try {
       const { sessionId } = req.params;
       const { input, context } = req.body;
+      // 幂等键：优先使用请求头，兼容放在请求体中的 turnId
+      const turnId = req.get('Idempotency-Key') || req.body.turnId;
 
       if (!input) {
         throw new ApiError(400, '输入内容不能为空');
@@ -22,7 +24,7 @@ class InterviewController {
         context
       });
 
-      const result = await pythonService.processInput(sessionId, input, context);
+      const result = await pythonService.processInput(sessionId, input, context, turnId);
       
       // 直接返回标准化的响应
       res.status(200).json(result);
@@ -108,7 +110,7 @@ class InterviewController {
   async getMessages(req, res, next) {
     try {
       const { sessionId } = req.params;
-      const result = await pythonService.getSessionMessages(sessionId);
+      const result = await pythonService.getSessionMessages(sessionId, req.query.since);
       res.status(200).json(result);
     } catch (error) {
       next(error);
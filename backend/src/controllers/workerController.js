@@ -0,0 +1,84 @@
+const shardRouter = require('../utils/shardRouter');
+const scheduler = require('../utils/scheduler');
+const { ApiError } = require('../utils/errorHandler');
+
+/**
+ * 分片 worker 管理控制器
+ */
+class WorkerController {
+  /**
+   * 列出当前 worker
+   */
+  async listWorkers(req, res, next) {
+    try {
+      res.status(200).json({
+        status: 'success',
+        data: {
+          workers: shardRouter.listWorkers()
+        }
+      });
+    } catch (error) {
+      next(error);
+    }
+  }
+
+  /**
+   * 加入 worker，触发会话重新平衡
+   */
+  async addWorker(req, res, next) {
+    try {
+      const { id, url } = req.body;
+      if (!id || !url) {
+        throw new ApiError(400, '缺少必要的参数：id, url');
+      }
+
+      await shardRouter.addWorker(id, url);
+      res.status(201).json({
+        status: 'success',
+        data: {
+          workers: shardRouter.listWorkers()
+        }
+      });
+    } catch (error) {
+      next(error);
+    }
+  }
+
+  /**
+   * 移除 worker，其会话交接给其他 worker
+   */
+  async removeWorker(req, res, next) {
+    try {
+      const { workerId } = req.params;
+      const removed = await shardRouter.removeWorker(workerId);
+      if (!removed) {
+        throw new ApiError(404, 'worker 不存在');
+      }
+
+      res.status(200).json({
+        status: 'success',
+        data: {
+          workers: shardRouter.listWorkers()
+        }
+      });
+    } catch (error) {
+      next(error);
+    }
+  }
+
+  /**
+   * 调度器状态：运行数、各优先级队列深度、排队等待和被拒绝的请求数
+   */
+  async getScheduler(req, res, next) {
+    try {
+      res.status(200).json({
+        status: 'success',
+        data: scheduler.snapshot()
+      });
+    } catch (error) {
+      next(error);
+    }
+  }
+}
+
+module.exports = new WorkerController();
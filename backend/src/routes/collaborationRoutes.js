@@ -100,6 +100,110 @@ router.get('/sessions/:sessionId', collaborationController.getSession);
  */
 router.delete('/sessions/:sessionId', collaborationController.endSession);
 
+/**
+ * @swagger
+ * /collaboration/search:
+ *   get:
+ *     summary: 全文搜索过去的会话
+ *     description: 在主题、大纲、面试回答和草稿章节中搜索，按相关度排序并返回高亮片段。只有最近的 SEARCH_CANDIDATES 条（默认 300）命中参与排序，更早的命中不会返回
+ *     tags: [协作会话]
+ *     parameters:
+ *       - in: query
+ *         name: q
+ *         required: true
+ *         schema:
+ *           type: string
+ *         description: 搜索词，多个词之间为“与”
+ *       - in: query
+ *         name: kind
+ *         schema:
+ *           type: string
+ *           enum: [topic, outline, interview, draft]
+ *         description: 只搜索某一类文档
+ *       - in: query
+ *         name: page
+ *         schema:
+ *           type: integer
+ *           default: 1
+ *       - in: query
+ *         name: pageSize
+ *         schema:
+ *           type: integer
+ *           default: 20
+ *           maximum: 100
+ *     responses:
+ *       200:
+ *         description: 搜索结果
+ *         content:
+ *           application/json:
+ *             schema:
+ *               type: object
+ *               properties:
+ *                 status:
+ *                   type: string
+ *                   example: success
+ *                 data:
+ *                   type: object
+ *                   properties:
+ *                     page:
+ *                       type: integer
+ *                     pageSize:
+ *                       type: integer
+ *                     hasMore:
+ *                       type: boolean
+ *                     truncated:
+ *                       type: boolean
+ *                       description: 命中超过 SEARCH_CANDIDATES 条，只在最近的命中中排序；可以加更多搜索词缩小范围
+ *                     results:
+ *                       type: array
+ *                       items:
+ *                         type: object
+ *                         properties:
+ *                           sessionId:
+ *                             type: string
+ *                           kind:
+ *                             type: string
+ *                           ref:
+ *                             type: string
+ *                           title:
+ *                             type: string
+ *                           topic:
+ *                             type: string
+ *                           snippet:
+ *                             type: string
+ *                             description: 已转义的 HTML，命中词以 <mark> 标出
+ *                           score:
+ *                             type: number
+ *       400:
+ *         description: 缺少搜索词或文档类型无效
+ */
+router.get('/search', collaborationController.searchSessions);
+
+/**
+ * @swagger
+ * /collaboration/history:
+ *   get:
+ *     summary: 列出历史会话
+ *     description: 按最近更新时间分页列出持久化的会话，服务重启后仍然可见
+ *     tags: [协作会话]
+ *     parameters:
+ *       - in: query
+ *         name: page
+ *         schema:
+ *           type: integer
+ *           default: 1
+ *       - in: query
+ *         name: pageSize
+ *         schema:
+ *           type: integer
+ *           default: 20
+ *           maximum: 100
+ *     responses:
+ *       200:
+ *         description: 会话列表
+ */
+router.get('/history', collaborationController.getSessionHistory);
+
 // 消息相关路由
 router.post('/sessions/:sessionId/input', collaborationController.processInput);
 router.get('/sessions/:sessionId/messages', collaborationController.getMessages);
@@ -90,4 +90,44 @@ router.post('/sessions/:sessionId/draft', draftController.generateDraft);
  */
 router.put('/sessions/:sessionId/draft', draftController.reviseDraft);
 
+/**
+ * @swagger
+ * /draft/sessions/{sessionId}/export:
+ *   get:
+ *     summary: 流式导出草稿
+ *     description: 按章节渲染并流式返回，章节渲染结果按内容哈希缓存；HTML 带打印样式，可直接转为 PDF
+ *     tags: [草稿管理]
+ *     parameters:
+ *       - in: path
+ *         name: sessionId
+ *         required: true
+ *         schema:
+ *           type: string
+ *           format: uuid
+ *         description: 会话ID
+ *       - in: query
+ *         name: format
+ *         schema:
+ *           type: string
+ *           enum: [markdown, html, docx]
+ *           default: markdown
+ *         description: 导出格式
+ *     responses:
+ *       200:
+ *         description: 导出的文件
+ *         content:
+ *           text/markdown: {}
+ *           text/html: {}
+ *           application/vnd.openxmlformats-officedocument.wordprocessingml.document: {}
+ *       400:
+ *         description: 不支持的导出格式
+ *       404:
+ *         $ref: '#/components/responses/NotFound'
+ *       503:
+ *         description: 服务繁忙，稍后按 Retry-After 重试
+ *       500:
+ *         $ref: '#/components/responses/ServerError'
+ */
+router.get('/sessions/:sessionId/export', draftController.exportDraft);
+
 module.exports = router; 
\ No newline at end of file
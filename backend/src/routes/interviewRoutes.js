@@ -35,6 +35,12 @@ router.use((req, res, next) => {
  *               input:
  *                 type: string
  *                 description: 用户输入内容
+ *               context:
+ *                 type: object
+ *                 properties:
+ *                   knownVersion:
+ *                     type: integer
+ *                     description: 客户端已同步到的状态版本，省略时返回完整快照
  *     responses:
  *       200:
  *         description: 处理结果
@@ -53,8 +59,18 @@ router.use((req, res, next) => {
  *                       type: string
  *                     state:
  *                       type: string
+ *                     version:
+ *                       type: integer
+ *                       description: 本次响应后的状态版本
+ *                     delta:
+ *                       type: boolean
+ *                       description: 为 true 时 context 和 messages 只包含 knownVersion 之后的变化
  *                     context:
  *                       type: object
+ *                     messages:
+ *                       type: array
+ *                       items:
+ *                         type: object
  */
 router.post('/sessions/:sessionId/input', interviewController.processInput);
 
@@ -126,7 +142,7 @@ router.get('/sessions/:sessionId/next-question', interviewController.getNextQues
 router.post('/sessions/:sessionId/skip', interviewController.skipQuestion);
 
 /**
- * 获取会话消息历史
+ * 获取会话消息历史，?since=<version> 只返回该版本之后新增的消息
  */
 router.get('/sessions/:sessionId/messages', interviewController.getMessages);
 
@@ -0,0 +1,70 @@
+const express = require('express');
+const router = express.Router();
+const workerController = require('../controllers/workerController');
+
+/**
+ * @swagger
+ * /workers:
+ *   get:
+ *     summary: 列出会话分片 worker
+ *     tags: [分片]
+ *     responses:
+ *       200:
+ *         description: worker 列表
+ *   post:
+ *     summary: 加入 worker 并重新平衡会话
+ *     tags: [分片]
+ *     requestBody:
+ *       required: true
+ *       content:
+ *         application/json:
+ *           schema:
+ *             type: object
+ *             required:
+ *               - id
+ *               - url
+ *             properties:
+ *               id:
+ *                 type: string
+ *               url:
+ *                 type: string
+ *     responses:
+ *       201:
+ *         description: worker 已加入
+ */
+router.get('/', workerController.listWorkers);
+router.post('/', workerController.addWorker);
+
+/**
+ * @swagger
+ * /workers/scheduler:
+ *   get:
+ *     summary: Python 引擎调度和准入控制状态
+ *     tags: [分片]
+ *     responses:
+ *       200:
+ *         description: 并发上限、运行数、各优先级队列深度、排队等待时间和被拒绝的请求数
+ */
+router.get('/scheduler', workerController.getScheduler);
+
+/**
+ * @swagger
+ * /workers/{workerId}:
+ *   delete:
+ *     summary: 移除 worker，其会话交接给其他 worker
+ *     tags: [分片]
+ *     parameters:
+ *       - in: path
+ *         name: workerId
+ *         required: true
+ *         schema:
+ *           type: string
+ *     responses:
+ *       200:
+ *         description: worker 已移除
+ *       404:
+ *         $ref: '#/components/responses/NotFound'
+ */
+router.delete('/:workerId', workerController.removeWorker);
+
+module.exports = router;
@@ -1,10 +1,30 @@
 const pythonRunner = require('../utils/pythonRunner');
 const { ApiError } = require('../utils/errorHandler');
+const { withSpan } = require('../utils/tracing');
+
+// 响应快照中包含的上下文字段
+const SNAPSHOT_FIELDS = [
+  'currentState',
+  'lastInput',
+  'outline',
+  'settings',
+  'initialization',
+  'selectedType',
+  'topic',
+  'wordCount',
+  'currentSection',
+  'usage',
+  'analytics',
+  'draftChanges'
+];
 
 class PythonService {
   constructor() {
     this.sessions = new Map(); // 存储会话状态
     this.messageHistory = new Map(); // 存储消息历史
+    this.pendingTurns = new Map(); // 正在执行的轮次: `${sessionId}:${turnId}` -> Promise
+    this.completedTurns = new Map(); // 已完成的轮次结果，按插入顺序淘汰
+    this.maxCompletedTurns = 1000;
   }
 
   /**
@@ -22,6 +42,10 @@ class PythonService {
         id: sessionId,
         state: 'TOPIC_SELECTION',
         lastInteraction: new Date(),
+        version: 0, // 每次状态变化加一
+        fieldVersions: {}, // 上下文字段 -> 最后一次变化时的版本
+        // 草稿章节：id -> { chunk, version }，version 为章节最后一次变化时的会话版本
+        draft: { order: [], chunks: {}, removed: {} },
         context: {
           initialization: initialData,
           selectedType: initialData.type,
@@ -67,18 +91,167 @@ class PythonService {
   /**
    * 获取会话消息历史
    */
-  async getSessionMessages(sessionId) {
+  async getSessionMessages(sessionId, since) {
     const messages = this.messageHistory.get(sessionId) || [];
+    const known = Number(since);
+    return {
+      status: 'success',
+      data: Number.isInteger(known) && known >= 0
+        ? messages.filter(message => (message.version || 0) > known)
+        : messages
+    };
+  }
+
+  /**
+   * 提交一轮状态变化：版本号加一，记录值发生变化的上下文字段，给新消息标上版本
+   */
+  _commitChanges(session, changes, newMessages = []) {
+    session.version += 1;
+    const { draftChanges, ...fields } = changes;
+    if (draftChanges) {
+      this._applyDraftChanges(session, draftChanges);
+    }
+    for (const [key, value] of Object.entries(fields)) {
+      if (JSON.stringify(session.context[key]) !== JSON.stringify(value)) {
+        session.context[key] = value;
+        session.fieldVersions[key] = session.version;
+      }
+    }
+    for (const message of newMessages) {
+      message.version = session.version;
+    }
+  }
+
+  /**
+   * 本轮是否会生成整篇草稿：面试已经进行到大纲的最后一个部分
+   */
+  _isDraftTurn(session) {
+    const sections = Object.keys(session.context.outline || {});
+    return session.state === 'INTERVIEW' && sections.length > 0 &&
+      session.context.currentSection === sections[sections.length - 1];
+  }
+
+  /**
+   * 合并 Python 返回的草稿变化（只含变化的章节），并更新完整的草稿 Markdown
+   */
+  _applyDraftChanges(session, changes) {
+    const draft = session.draft || (session.draft = { order: [], chunks: {}, removed: {} });
+    for (const chunk of changes.chunks || []) {
+      draft.chunks[chunk.id] = { chunk, version: session.version };
+      delete draft.removed[chunk.id];
+    }
+    // order 为当前全部章节，不在其中的章节已被删除；只调整顺序时 chunks 为空，同样需要同步
+    if (changes.order && changes.order.join() !== draft.order.join()) {
+      draft.order = changes.order;
+      draft.orderVersion = session.version;
+    }
+    const current = new Set(draft.order);
+    for (const id of [...(changes.removed || []), ...Object.keys(draft.chunks)]) {
+      if (!current.has(id) && draft.chunks[id]) {
+        delete draft.chunks[id];
+        draft.removed[id] = session.version;
+      }
+    }
+    session.fieldVersions.draftChanges = session.version;
+    session.context.draft = draft.order
+      .filter(id => draft.chunks[id])
+      .map(id => draft.chunks[id].chunk.content)
+      .join('\n\n');
+  }
+
+  /**
+   * 客户端同步到 known 版本之后的草稿变化：当前章节顺序及其是否变化、之后变化的章节和删除的章节 id
+   */
+  _draftChanges(session, known) {
+    const { order, chunks, removed } = session.draft;
+    return {
+      order,
+      reordered: (session.draft.orderVersion || 0) > known,
+      chunks: order.filter(id => chunks[id] && chunks[id].version > known).map(id => chunks[id].chunk),
+      removed: Object.keys(removed).filter(id => removed[id] > known)
+    };
+  }
+
+  /**
+   * 构造响应
+   *
+   * 客户端提供 knownVersion 时只返回此后变化的上下文字段和新增消息（delta 为 true），
+   * 没有提供或版本无效（例如服务重启后）时返回完整快照，客户端据此重新同步。
+   */
+  _buildResponse(session, messages, response, knownVersion) {
+    const known = Number(knownVersion);
+    const delta = knownVersion !== undefined && knownVersion !== null &&
+      Number.isInteger(known) && known >= 0 && known <= session.version;
+
+    const context = { sessionId: session.id };
+    for (const key of SNAPSHOT_FIELDS) {
+      if (key === 'draftChanges') {
+        // 草稿按章节同步：完整快照包含全部章节，增量响应只包含客户端版本之后变化的章节
+        if ((session.fieldVersions.draftChanges || 0) > (delta ? known : 0)) {
+          context.draftChanges = this._draftChanges(session, delta ? known : 0);
+        }
+      } else if (!delta || (session.fieldVersions[key] || 0) > known) {
+        context[key] = session.context[key];
+      }
+    }
+
     return {
       status: 'success',
-      data: messages
+      data: {
+        response,
+        state: session.state,
+        version: session.version,
+        delta,
+        context,
+        messages: delta ? messages.filter(message => (message.version || 0) > known) : messages
+      }
     };
   }
 
   /**
    * 处理会话中的用户输入
+   *
+   * 带 turnId 的请求是幂等的：重试已完成的轮次直接重放结果，
+   * 重试正在执行的轮次则等待同一个结果，不会重复追加消息或调用 LLM。
+   * context.knownVersion 为客户端已同步到的版本，响应只包含此后的变化。
    */
-  async processInput(sessionId, input, context) {
+  async processInput(sessionId, input, context, turnId) {
+    return withSpan('pythonService.processInput', { 'session.id': sessionId, 'turn.id': turnId || null }, (span) => {
+      if (!turnId) {
+        return this._processTurn(sessionId, input, context);
+      }
+
+      const key = `${sessionId}:${turnId}`;
+      if (this.completedTurns.has(key)) {
+        console.log(`[PythonService] Replaying completed turn ${turnId} for session ${sessionId}`);
+        span.setAttribute('cache.turn', 'hit');
+        return this.completedTurns.get(key);
+      }
+      if (this.pendingTurns.has(key)) {
+        console.log(`[PythonService] Attaching to in-progress turn ${turnId} for session ${sessionId}`);
+        span.setAttribute('cache.turn', 'joined');
+        return this.pendingTurns.get(key);
+      }
+
+      span.setAttribute('cache.turn', 'miss');
+      const pending = this._processTurn(sessionId, input, { ...context, turnId })
+        .then((result) => {
+          this.completedTurns.set(key, result);
+          if (this.completedTurns.size > this.maxCompletedTurns) {
+            this.completedTurns.delete(this.completedTurns.keys().next().value);
+          }
+          return result;
+        })
+        .finally(() => {
+          this.pendingTurns.delete(key);
+        });
+
+      this.pendingTurns.set(key, pending);
+      return pending;
+    });
+  }
+
+  async _processTurn(sessionId, input, context) {
     console.log(`[PythonService] Processing input for session ${sessionId}:`, { 
       input, 
       context,
@@ -97,33 +270,22 @@ class PythonService {
       // 处理初始化命令
       if (typeof input === 'object' && input.type === 'INITIALIZE_SESSION') {
         const { topic, articleType, wordCount, settings } = input.data;
-        
-        // 构造初始响应
-        const initialResponse = {
-          status: 'success',
-          data: {
-            response: `我将帮助您撰写一篇关于"${topic}"的${wordCount}字${articleType}文章。\n\n让我们开始讨论文章的大纲。我会为您生成一个初步的大纲建议。`,
-            state: 'TOPIC_SELECTION',
-            context: {
-              ...session.context,
-              initialization: {
-                topic,
-                type: articleType,
-                wordCount,
-                settings
-              }
-            },
-            messages: [
-              {
-                role: 'assistant',
-                content: `我将帮助您撰写一篇关于"${topic}"的${wordCount}字${articleType}文章。\n\n让我们开始讨论文章的大纲。我会为您生成一个初步的大纲建议。`
-              }
-            ]
-          }
+        const initialMessage = {
+          role: 'assistant',
+          content: `我将帮助您撰写一篇关于"${topic}"的${wordCount}字${articleType}文章。\n\n让我们开始讨论文章的大纲。我会为您生成一个初步的大纲建议。`
         };
 
         // 更新消息历史
-        this.messageHistory.set(sessionId, initialResponse.data.messages);
+        const initialMessages = [initialMessage];
+        this.messageHistory.set(sessionId, initialMessages);
+        this._commitChanges(session, {
+          initialization: {
+            topic,
+            type: articleType,
+            wordCount,
+            settings
+          }
+        }, initialMessages);
 
         // 生成大纲
         const outlineResult = await pythonRunner.interact(sessionId, {
@@ -136,77 +298,56 @@ class PythonService {
           }
         }, {
           ...context,
-          currentState: 'TOPIC_SELECTION',
-          messageHistory: initialResponse.data.messages
+          currentState: 'TOPIC_SELECTION'
         });
 
         // 如果成功生成大纲，更新状态和响应
         if (outlineResult.status === 'success' && outlineResult.data.outline) {
-          const outlineResponse = {
-            status: 'success',
-            data: {
-              response: `我已经为您生成了一个初步的大纲建议，请审阅：\n\n${JSON.stringify(outlineResult.data.outline, null, 2)}`,
-              state: 'OUTLINE_REVIEW',
-              context: {
-                ...session.context,
-                outline: outlineResult.data.outline,
-                initialization: {
-                  topic,
-                  type: articleType,
-                  wordCount,
-                  settings
-                }
-              },
-              messages: [
-                ...initialResponse.data.messages,
-                {
-                  role: 'assistant',
-                  content: `我已经为您生成了一个初步的大纲建议，请审阅：\n\n${JSON.stringify(outlineResult.data.outline, null, 2)}`
-                }
-              ]
-            }
+          const outlineMessage = {
+            role: 'assistant',
+            content: `我已经为您生成了一个初步的大纲建议，请审阅：\n\n${JSON.stringify(outlineResult.data.outline, null, 2)}`
           };
 
-          // 更新会话状态
+          // 更新会话状态和消息历史
           session.state = 'OUTLINE_REVIEW';
-          session.context.outline = outlineResult.data.outline;
-          
-          // 更新消息历史
-          this.messageHistory.set(sessionId, outlineResponse.data.messages);
-          return outlineResponse;
+          initialMessages.push(outlineMessage);
+          this._commitChanges(session, {
+            outline: outlineResult.data.outline,
+            currentState: session.state
+          }, [outlineMessage]);
+          return this._buildResponse(session, initialMessages, outlineMessage.content, context?.knownVersion);
         }
 
-        return initialResponse;
+        return this._buildResponse(session, initialMessages, initialMessage.content, context?.knownVersion);
       }
 
-      // 添加用户输入到消息历史
-      messages.push({
-        role: 'user',
-        content: typeof input === 'object' ? JSON.stringify(input) : input
-      });
+      // 添加用户输入到消息历史（服务重启后的重试不会重复追加）
+      const turnId = context?.turnId;
+      const newMessages = [];
+      if (!turnId || !messages.some(message => message.turnId === turnId && message.role === 'user')) {
+        newMessages.push({
+          role: 'user',
+          content: typeof input === 'object' ? JSON.stringify(input) : input,
+          ...(turnId && { turnId })
+        });
+      }
 
-      // 传递完整的上下文到Python脚本
+      // Python 端维护自己的对话历史，这里只传上下文；contextVersion 为已合并的 Python 上下文版本，
+      // 与 Python 端不一致（第一次调用、响应丢失、服务重启）时 Python 返回全部字段
       const result = await pythonRunner.interact(sessionId, input, {
         ...context,
         currentState: session.state,
         lastState: session.state,
-        messageHistory: messages
+        contextVersion: session.contextVersion,
+        draftTurn: this._isDraftTurn(session)
       });
 
       // 更新会话状态
       session.lastInteraction = new Date();
       
-      // 从 result.data 中提取数据
-      const { response, state, context: newContext } = result.data;
-      
-      // 更新会话上下文
-      session.context = {
-        ...session.context,
-        ...newContext,
-        lastInput: input,
-        lastResponse: response,
-        currentState: state || session.state
-      };
+      // 从 result.data 中提取数据，context 只包含有变化的字段
+      const { response, state, context: newContext, contextVersion } = result.data;
+      session.contextVersion = contextVersion;
 
       // 如果有新状态，更新会话状态
       if (state) {
@@ -215,36 +356,26 @@ class PythonService {
       }
 
       // 添加AI响应到消息历史
-      if (response) {
-        messages.push({
+      if (response && !(turnId && messages.some(message => message.turnId === turnId && message.role === 'assistant'))) {
+        newMessages.push({
           role: 'assistant',
-          content: response
+          content: response,
+          ...(turnId && { turnId })
         });
       }
 
-      // 更新消息历史
+      // 更新会话上下文和消息历史
+      messages.push(...newMessages);
       this.messageHistory.set(sessionId, messages);
+      this._commitChanges(session, {
+        ...newContext,
+        lastInput: input,
+        lastResponse: response,
+        currentState: session.state
+      }, newMessages);
 
       // 构造标准响应格式
-      const standardResponse = {
-        status: 'success',
-        data: {
-          response,
-          state: session.state,
-          context: {
-            sessionId,
-            currentState: session.state,
-            lastInput: input,
-            outline: session.context.outline || {},
-            settings: session.context.settings || {},
-            initialization: context?.initialization || null,
-            selectedType: session.context.selectedType,
-            topic: session.context.topic,
-            wordCount: session.context.wordCount
-          },
-          messages
-        }
-      };
+      const standardResponse = this._buildResponse(session, messages, response, context?.knownVersion);
 
       console.log(`[PythonService] Final response:`, standardResponse);
       return standardResponse;
@@ -261,18 +392,38 @@ class PythonService {
     const session = await this.getSession(sessionId);
     
     try {
-      // 调用Python生成草稿
-      const result = await pythonRunner.runScript({
-        args: ['--generate-draft', '--session', sessionId]
+      // 与普通轮次一样经由 interact 发送，分片模式下由负责该会话的 worker 在会话锁内处理
+      const result = await pythonRunner.interact(sessionId, { type: 'GENERATE_DRAFT', data: {} }, {
+        contextVersion: session.contextVersion
       });
 
-      session.context.draft = result;
-      return { draft: result };
+      return this._applyDraftResult(session, result);
     } catch (error) {
+      if (error instanceof ApiError) throw error;
       throw new ApiError(500, '生成草稿失败: ' + error.message);
     }
   }
 
+  /**
+   * 记录草稿命令的结果：更新会话状态和上下文（草稿变化、统计），并把回复追加到消息历史
+   */
+  _applyDraftResult(session, result) {
+    if (result.status !== 'success') {
+      throw new ApiError(500, result.message || result.error?.message || 'Python 返回错误');
+    }
+    const { draft, response, state, context, contextVersion } = result.data;
+    session.contextVersion = contextVersion;
+    const messages = this.messageHistory.get(session.id) || [];
+    const newMessages = response ? [{ role: 'assistant', content: response }] : [];
+    messages.push(...newMessages);
+    this.messageHistory.set(session.id, messages);
+
+    session.state = state || session.state;
+    session.lastInteraction = new Date();
+    this._commitChanges(session, { ...context, draft, currentState: session.state }, newMessages);
+    return { draft, state: session.state, version: session.version };
+  }
+
   /**
    * 修改草稿内容
    */
@@ -281,17 +432,38 @@ class PythonService {
     
     try {
       // 发送修改请求到Python
-      const result = await pythonRunner.runScript({
-        args: ['--revise-draft', '--feedback', feedback, '--session', sessionId]
+      const result = await pythonRunner.interact(sessionId, { type: 'REVISE_DRAFT', data: { feedback } }, {
+        contextVersion: session.contextVersion
       });
 
-      session.context.draft = result;
-      return { draft: result };
+      return this._applyDraftResult(session, result);
     } catch (error) {
+      if (error instanceof ApiError) throw error;
       throw new ApiError(500, '修改草稿失败: ' + error.message);
     }
   }
 
+  /**
+   * 在过去会话的主题、大纲、面试回答和草稿中全文搜索
+   */
+  async searchSessions({ query, page = 1, pageSize = 20, kind }) {
+    const args = ['search', '--query', query, '--page', String(page), '--page-size', String(pageSize)];
+    if (kind) args.push('--kind', kind);
+    const result = await pythonRunner.runScript({ script: 'search_index.py', args });
+    return result.data;
+  }
+
+  /**
+   * 按最近更新时间列出持久化的会话，服务重启后仍然可见
+   */
+  async listSessionHistory({ page = 1, pageSize = 20 }) {
+    const result = await pythonRunner.runScript({
+      script: 'search_index.py',
+      args: ['history', '--page', String(page), '--page-size', String(pageSize)]
+    });
+    return result.data;
+  }
+
   /**
    * 结束会话
    */
@@ -299,10 +471,11 @@ class PythonService {
     const session = await this.getSession(sessionId);
     
     try {
-      // 清理Python进程
-      await pythonRunner.runScript({
-        args: ['--end-session', '--session', sessionId]
-      });
+      // 清理Python端的会话（分片模式下由负责该会话的 worker 处理）
+      const result = await pythonRunner.interact(sessionId, { type: 'END_SESSION', data: {} });
+      if (result.status !== 'success') {
+        throw new Error(result.message || result.error?.message || 'Python 返回错误');
+      }
 
       this.sessions.delete(sessionId);
       return true;
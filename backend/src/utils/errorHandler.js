@@ -21,6 +21,11 @@ const errorHandler = (err, req, res, next) => {
   err.statusCode = err.statusCode || 500;
   err.status = err.status || 'error';
 
+  // 过载时告诉客户端多久之后重试
+  if (err.retryAfter) {
+    res.set('Retry-After', String(err.retryAfter));
+  }
+
   if (process.env.NODE_ENV === 'development') {
     res.status(err.statusCode).json({
       status: err.status,
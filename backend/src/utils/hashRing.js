@@ -0,0 +1,63 @@
+const crypto = require('crypto');
+
+const DEFAULT_VIRTUAL_NODES = 128;
+
+// 与 sharding.py 保持一致：md5 前 8 个十六进制字符
+function hash(value) {
+  return parseInt(crypto.createHash('md5').update(value).digest('hex').slice(0, 8), 16);
+}
+
+/**
+ * 带虚拟节点的一致性哈希环
+ */
+class HashRing {
+  constructor(nodes = [], virtualNodes = DEFAULT_VIRTUAL_NODES) {
+    this.virtualNodes = virtualNodes;
+    this.points = [];
+    this.owners = new Map();
+    this.nodes = new Set();
+    nodes.forEach(node => this.addNode(node));
+  }
+
+  addNode(node) {
+    if (this.nodes.has(node)) return;
+    this.nodes.add(node);
+    for (let i = 0; i < this.virtualNodes; i++) {
+      const point = hash(`${node}#${i}`);
+      if (this.owners.has(point)) continue;
+      this.owners.set(point, node);
+      this.points.push(point);
+    }
+    this.points.sort((a, b) => a - b);
+  }
+
+  removeNode(node) {
+    if (!this.nodes.delete(node)) return;
+    this.points = this.points.filter(point => this.owners.get(point) !== node);
+    for (const [point, owner] of this.owners) {
+      if (owner === node) this.owners.delete(point);
+    }
+  }
+
+  /**
+   * 返回负责该 key 的节点
+   */
+  getNode(key) {
+    if (this.points.length === 0) return null;
+    const target = hash(key);
+    // 二分查找第一个大于 target 的点
+    let low = 0;
+    let high = this.points.length;
+    while (low < high) {
+      const mid = (low + high) >> 1;
+      if (this.points[mid] <= target) {
+        low = mid + 1;
+      } else {
+        high = mid;
+      }
+    }
+    return this.owners.get(this.points[low % this.points.length]);
+  }
+}
+
+module.exports = HashRing;
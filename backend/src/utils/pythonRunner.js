@@ -1,5 +1,10 @@
 const { PythonShell } = require('python-shell');
+const { spawn } = require('child_process');
 const path = require('path');
+const shardRouter = require('./shardRouter');
+const scheduler = require('./scheduler');
+const { currentSpan, withSpan } = require('./tracing');
+const { ApiError } = require('./errorHandler');
 
 class PythonRunner {
   constructor() {
@@ -11,8 +16,16 @@ class PythonRunner {
 
   /**
    * 执行Python脚本并获取结果
+   *
+   * priority 和 user 决定任务在调度器中的排队位置，默认按交互式任务处理；
+   * deadlineMs 为请求期限，预计等待超过期限时抛出 503 ApiError；
+   * script 为 backend 目录下的其他脚本，默认运行协作引擎
    */
-  async runScript(options = {}) {
+  async runScript({ priority = 'interactive', user, deadlineMs, ...options } = {}) {
+    return scheduler.run({ priority, user, deadlineMs }, () => this._spawn(options));
+  }
+
+  async _spawn({ script, ...options }) {
     const defaultOptions = {
       mode: 'text',
       pythonPath: this.pythonPath,
@@ -22,6 +35,11 @@ class PythonRunner {
     };
 
     const pythonOptions = { ...defaultOptions, ...options };
+    // Python 端的 span 挂在当前 span 之下
+    const span = currentSpan();
+    if (span) {
+      pythonOptions.env = { ...process.env, ...pythonOptions.env, TRACEPARENT: span.traceparent };
+    }
     console.log('[PythonRunner] Running script with args:', pythonOptions.args);
 
     // 实际的Python脚本执行
@@ -30,7 +48,7 @@ class PythonRunner {
       let error = [];
       let debugOutput = [];
 
-      const pyshell = new PythonShell(path.basename(this.scriptPath), pythonOptions);
+      const pyshell = new PythonShell(script || path.basename(this.scriptPath), pythonOptions);
 
       pyshell.on('message', (message) => {
         try {
@@ -72,6 +90,52 @@ class PythonRunner {
     });
   }
 
+  /**
+   * 运行 backend 目录下的 Python 脚本，把标准输出原样写入 output 流
+   *
+   * python-shell 按行解析文本，不适合二进制输出，这里直接用 child_process。
+   * onStart 在收到第一块输出时调用（用于设置响应头），脚本未输出就失败时
+   * 按退出码 errors[code] 抛出 ApiError，已开始输出后失败则中断 output。
+   */
+  async streamScript({ priority = 'bulk', user, deadlineMs, script, args = [], output, onStart, errors = {} }) {
+    return scheduler.run({ priority, user, deadlineMs }, () => new Promise((resolve, reject) => {
+      const span = currentSpan();
+      const child = spawn(this.pythonPath, ['-u', path.join(path.dirname(this.scriptPath), script), ...args], {
+        env: span ? { ...process.env, TRACEPARENT: span.traceparent } : process.env
+      });
+      const stderr = [];
+      let started = false;
+
+      child.stdout.once('data', () => {
+        started = true;
+        onStart?.();
+      });
+      // pipe 会在 output 写不动时暂停读取，内存占用不随文档大小增长
+      child.stdout.pipe(output, { end: false });
+      child.stderr.on('data', (data) => stderr.push(data));
+      // 客户端断开时结束脚本
+      output.once('close', () => child.kill());
+
+      child.on('error', reject);
+      child.on('close', (code) => {
+        if (code === 0) {
+          output.end();
+          resolve();
+          return;
+        }
+        const message = Buffer.concat(stderr).toString().trim();
+        console.error('[PythonRunner] Stream script error:', message);
+        if (started) {
+          output.destroy(new Error(message));
+          resolve();
+          return;
+        }
+        const [statusCode, errorMessage] = errors[code] || [500, '导出失败'];
+        reject(new ApiError(statusCode, errorMessage));
+      });
+    }));
+  }
+
   /**
    * 与Python脚本进行交互式通信
    */
@@ -80,12 +144,28 @@ class PythonRunner {
       const inputStr = typeof input === 'object' ? JSON.stringify(input) : input;
       console.log('[PythonRunner] Processing request for session:', sessionId);
 
-      const result = await this.runScript({
-        args: [
-          '--session', sessionId,
-          '--input', inputStr,
-          '--context', JSON.stringify(context || {})
-        ]
+      // 配置了分片 worker 时转发给负责该会话的 worker，否则在本地启动脚本
+      const result = await withSpan('pythonRunner.interact', {
+        'session.id': sessionId,
+        'python.mode': shardRouter.isEnabled() ? 'shard' : 'process'
+      }, async (span) => {
+        const job = {
+          priority: scheduler.classify(input, context || {}),
+          user: context?.userId || sessionId,
+          deadlineMs: context?.deadlineMs
+        };
+        const response = shardRouter.isEnabled()
+          ? await scheduler.run(job, () => shardRouter.forward(sessionId, input, context || {}))
+          : await this.runScript({
+            ...job,
+            args: [
+              '--session', sessionId,
+              '--input', inputStr,
+              '--context', JSON.stringify(context || {})
+            ]
+          });
+        span.setAttribute('python.status', response?.status);
+        return response;
       });
 
       if (!result || typeof result !== 'object') {
@@ -106,6 +186,10 @@ class PythonRunner {
       return result;
     } catch (error) {
       console.error('[PythonRunner] Error:', error.message);
+      // 准入控制拒绝的请求直接以 503 返回给客户端
+      if (error instanceof ApiError) {
+        throw error;
+      }
       return {
         status: 'error',
         error: {
@@ -0,0 +1,299 @@
+const os = require('os');
+const { currentSpan, withSpan } = require('./tracing');
+const { ApiError } = require('./errorHandler');
+
+// 优先级从高到低：交互式的问题/大纲、修订、批量草稿
+const PRIORITY_CLASSES = ['interactive', 'revision', 'bulk'];
+
+/**
+ * Python 引擎前的调度器
+ *
+ * 同时运行的任务数不超过 PYTHON_CONCURRENCY。任务是大部分时间在等待 LLM 响应的 Python 进程，
+ * 默认并发按 I/O 密集估算（CPU 核数的 4 倍，至少 8），而不是 CPU 核数。
+ * 其中 SCHEDULER_INTERACTIVE_SLOTS 个名额（默认四分之一）只留给交互式任务：正在运行的任务不会被抢占，
+ * 修订和批量草稿最多占满其余名额，长时间的草稿生成不会挡住所有交互式轮次。
+ * 排队的任务先按优先级分类，同一类中按用户轮转，单个用户的大量任务不会挡住其他用户。
+ * 高优先级任务会越过已排队（但未开始运行）的低优先级任务；
+ * 低优先级任务被越过 SCHEDULER_MAX_PREEMPTIONS 次后提升一级，避免饿死。
+ * 排队等待时间单独记录在 span 上（scheduler.queue_wait_ms），与执行时间分开。
+ *
+ * 准入控制：排队任务数不超过 SCHEDULER_MAX_QUEUE，队列满时挤掉最后排队的低优先级任务，
+ * 没有可挤掉的任务则拒绝新任务；按各优先级各自的平均执行时间估算的等待时间超过请求期限
+ * （context.deadlineMs，默认 PYTHON_REQUEST_DEADLINE_MS）时直接拒绝。
+ * 被拒绝的请求返回 503 和 Retry-After，而不是排队到超时。
+ */
+class Scheduler {
+  constructor() {
+    this.concurrency = Number(process.env.PYTHON_CONCURRENCY) || Math.max(8, os.cpus().length * 4);
+    const interactiveSlots = process.env.SCHEDULER_INTERACTIVE_SLOTS !== undefined
+      ? Number(process.env.SCHEDULER_INTERACTIVE_SLOTS)
+      : Math.ceil(this.concurrency / 4);
+    this.interactiveSlots = Math.max(0, Math.min(interactiveSlots, this.concurrency - 1));
+    this.maxPreemptions = Number(process.env.SCHEDULER_MAX_PREEMPTIONS) || 20;
+    this.maxQueue = Number(process.env.SCHEDULER_MAX_QUEUE) || this.concurrency * 10;
+    this.defaultDeadlineMs = Number(process.env.PYTHON_REQUEST_DEADLINE_MS) || 120000;
+    // 各优先级的平均执行时间（指数移动平均），用于估算排队等待时间；
+    // 草稿生成可能持续几分钟，与交互式轮次共用一个平均值会让交互式请求被误判超期
+    const initialServiceMs = Number(process.env.SCHEDULER_INITIAL_SERVICE_MS) || 5000;
+    this.avgServiceMs = Object.fromEntries(PRIORITY_CLASSES.map(priority => [priority, initialServiceMs]));
+    this.running = 0;
+    this.runningJobs = new Set();
+    this.shed = { queue_full: 0, deadline: 0, expired: 0 };
+    // 每个优先级一个 Map：用户 -> 该用户的任务队列，Map 的插入顺序即轮转顺序
+    this.queues = PRIORITY_CLASSES.map(() => new Map());
+    this.stats = Object.fromEntries(PRIORITY_CLASSES.map(priority => [priority, {
+      completed: 0,
+      preempted: 0,
+      queueWaitMs: 0,
+      maxQueueWaitMs: 0
+    }]));
+  }
+
+  /**
+   * 根据输入和会话状态判断任务优先级
+   *
+   * 会生成整篇草稿的轮次（最后一个部分的面试回答、生成草稿命令）按 bulk 处理，
+   * 不占用交互式任务的名额。
+   */
+  classify(input, context = {}) {
+    if (context.draftTurn || input?.type === 'GENERATE_DRAFT') return 'bulk';
+    if (input?.type === 'REVISE_DRAFT') return 'revision';
+    if (typeof input === 'string' && input.startsWith('revise:')) return 'revision';
+    if (context.currentState === 'DRAFT_REVIEW') return 'revision';
+    return 'interactive';
+  }
+
+  /**
+   * 当前排队的任务数，按优先级分类
+   */
+  queueDepth() {
+    return Object.fromEntries(PRIORITY_CLASSES.map((priority, level) => [
+      priority,
+      [...this.queues[level].values()].reduce((total, jobs) => total + jobs.length, 0)
+    ]));
+  }
+
+  queuedCount() {
+    return this.queues.reduce((total, queue) => total + [...queue.values()].reduce((n, jobs) => n + jobs.length, 0), 0);
+  }
+
+  /**
+   * 优先级为 level 的任务可以使用的名额数：交互式任务可以使用全部名额
+   */
+  _slots(level) {
+    return level === 0 ? this.concurrency : this.concurrency - this.interactiveSlots;
+  }
+
+  /**
+   * 估算优先级为 level 的新任务需要等待的时间（毫秒）
+   *
+   * 等待最早结束的运行中任务空出名额，再加上排在前面的任务按各自类别的平均执行时间分摊到可用名额上。
+   */
+  expectedWaitMs(level) {
+    const slots = this._slots(level);
+    if (this.running < slots) return 0;
+    const now = Date.now();
+    const firstFree = Math.min(...[...this.runningJobs].map(job =>
+      Math.max(0, this.avgServiceMs[job.kind] - (now - job.startedAt))));
+    let ahead = 0;
+    for (let l = 0; l <= level; l++) {
+      for (const jobs of this.queues[l].values()) {
+        for (const job of jobs) ahead += this.avgServiceMs[job.kind];
+      }
+    }
+    return Math.round(firstFree + ahead / slots);
+  }
+
+  /**
+   * 调度器和准入控制的状态
+   */
+  snapshot() {
+    return {
+      concurrency: this.concurrency,
+      interactiveSlots: this.interactiveSlots,
+      running: this.running,
+      maxQueue: this.maxQueue,
+      queueDepth: this.queueDepth(),
+      avgServiceMs: Object.fromEntries(Object.entries(this.avgServiceMs).map(([priority, ms]) => [priority, Math.round(ms)])),
+      shed: this.shed,
+      classes: this.stats
+    };
+  }
+
+  _reject(reason, waitMs) {
+    this.shed[reason] += 1;
+    const error = new ApiError(503, '服务繁忙，请稍后重试');
+    error.retryAfter = Math.max(1, Math.ceil(waitMs / 1000));
+    error.reason = reason;
+    return error;
+  }
+
+  /**
+   * 排队执行 fn，返回 fn 的结果；超出容量或期限时抛出 503 ApiError
+   */
+  async run({ priority = 'interactive', user = 'anonymous', deadlineMs } = {}, fn) {
+    const level = Math.max(PRIORITY_CLASSES.indexOf(priority), 0);
+    const queued = Date.now();
+    const deadline = queued + (Number(deadlineMs) || this.defaultDeadlineMs);
+
+    const expectedWaitMs = this.expectedWaitMs(level);
+    if (queued + expectedWaitMs > deadline) {
+      currentSpan()?.setAttributes({ 'scheduler.shed': 'deadline', 'scheduler.expected_wait_ms': expectedWaitMs });
+      throw this._reject('deadline', expectedWaitMs);
+    }
+
+    const job = await withSpan('scheduler.wait', { 'scheduler.priority': PRIORITY_CLASSES[level], 'user.id': user }, (span) => {
+      // kind 为任务原本的类别，提升优先级后仍按它统计执行时间
+      const job = { level, priority: PRIORITY_CLASSES[level], kind: PRIORITY_CLASSES[level], user, preemptions: 0, deadline };
+      const started = new Promise((resolve, reject) => {
+        job.start = resolve;
+        job.reject = reject;
+      });
+      this._admit(job);
+      this._dispatch();
+      return started.then(() => {
+        span.setAttribute('scheduler.preemptions', job.preemptions);
+        return job;
+      });
+    });
+
+    const queueWaitMs = Date.now() - queued;
+    const stats = this.stats[job.priority];
+    stats.queueWaitMs += queueWaitMs;
+    stats.maxQueueWaitMs = Math.max(stats.maxQueueWaitMs, queueWaitMs);
+    currentSpan()?.setAttributes({
+      'scheduler.priority': job.priority,
+      'scheduler.queue_wait_ms': queueWaitMs,
+      'scheduler.preemptions': job.preemptions
+    });
+
+    const started = Date.now();
+    try {
+      return await fn();
+    } finally {
+      this.avgServiceMs[job.kind] = 0.8 * this.avgServiceMs[job.kind] + 0.2 * (Date.now() - started);
+      stats.completed += 1;
+      this.running -= 1;
+      this.runningJobs.delete(job);
+      this._dispatch();
+    }
+  }
+
+  /**
+   * 队列已满时挤掉最后排队的更低优先级任务，没有则拒绝新任务
+   */
+  _admit(job) {
+    if (this.queuedCount() >= this.maxQueue) {
+      const victim = this._lastQueued(job.level + 1);
+      if (!victim) {
+        throw this._reject('queue_full', this.expectedWaitMs(job.level));
+      }
+      victim.reject(this._reject('queue_full', this.expectedWaitMs(victim.level)));
+    }
+    this._enqueue(job);
+  }
+
+  /**
+   * 从最低优先级开始，取出并返回最后排队的任务
+   */
+  _lastQueued(minLevel) {
+    for (let level = this.queues.length - 1; level >= minLevel; level--) {
+      const users = [...this.queues[level].keys()];
+      if (!users.length) continue;
+      const user = users[users.length - 1];
+      const jobs = this.queues[level].get(user);
+      const job = jobs.pop();
+      if (!jobs.length) {
+        this.queues[level].delete(user);
+      }
+      return job;
+    }
+    return null;
+  }
+
+  _enqueue(job) {
+    // 新任务越过所有已排队的低优先级任务
+    for (let level = job.level + 1; level < this.queues.length; level++) {
+      for (const jobs of this.queues[level].values()) {
+        for (const queuedJob of jobs) {
+          queuedJob.preemptions += 1;
+          this.stats[queuedJob.priority].preempted += 1;
+        }
+      }
+    }
+
+    const queue = this.queues[job.level];
+    if (!queue.has(job.user)) {
+      queue.set(job.user, []);
+    }
+    queue.get(job.user).push(job);
+    this._promoteStarved(job.level + 1);
+  }
+
+  /**
+   * 被越过次数过多的任务提升一级优先级
+   */
+  _promoteStarved(fromLevel) {
+    for (let level = fromLevel; level < this.queues.length; level++) {
+      for (const [user, jobs] of this.queues[level]) {
+        const starved = jobs.filter(job => job.preemptions >= this.maxPreemptions);
+        if (!starved.length) continue;
+
+        const remaining = jobs.filter(job => job.preemptions < this.maxPreemptions);
+        if (remaining.length) {
+          this.queues[level].set(user, remaining);
+        } else {
+          this.queues[level].delete(user);
+        }
+        const target = this.queues[level - 1];
+        if (!target.has(user)) {
+          target.set(user, []);
+        }
+        for (const job of starved) {
+          job.level = level - 1;
+          job.priority = PRIORITY_CLASSES[level - 1];
+          job.preemptions = 0;
+          target.get(user).push(job);
+        }
+      }
+    }
+  }
+
+  _next() {
+    for (const [level, queue] of this.queues.entries()) {
+      // 留给交互式任务的名额不分给更低优先级的任务
+      if (this.running >= this._slots(level)) continue;
+      const entry = queue.entries().next();
+      if (entry.done) continue;
+
+      // 取出轮转顺序中第一个用户的任务，该用户还有任务时移到队尾
+      const [user, jobs] = entry.value;
+      const job = jobs.shift();
+      queue.delete(user);
+      if (jobs.length) {
+        queue.set(user, jobs);
+      }
+      return job;
+    }
+    return null;
+  }
+
+  _dispatch() {
+    while (this.running < this.concurrency) {
+      const job = this._next();
+      if (!job) return;
+      // 排队期间已经超过期限的任务不再执行
+      if (Date.now() > job.deadline) {
+        job.reject(this._reject('expired', this.expectedWaitMs(job.level)));
+        continue;
+      }
+      this.running += 1;
+      job.startedAt = Date.now();
+      this.runningJobs.add(job);
+      job.start();
+    }
+  }
+}
+
+module.exports = new Scheduler();
+module.exports.PRIORITY_CLASSES = PRIORITY_CLASSES;
@@ -0,0 +1,122 @@
+const HashRing = require('./hashRing');
+const { currentSpan } = require('./tracing');
+
+/**
+ * 会话分片路由
+ *
+ * 通过 PYTHON_WORKERS 配置 worker，例如 "w1=http://10.0.0.1:8101,w2=http://10.0.0.2:8101"。
+ * 每个会话按一致性哈希固定路由到一个 worker（python sharding.py serve）。
+ * worker 加入或离开时广播新的成员列表，不再负责的会话由原 worker 写回存储后交接。
+ * 未配置 worker 时保持原来的本地进程模式。
+ */
+class ShardRouter {
+  constructor() {
+    this.workers = new Map();
+    this.ring = new HashRing();
+    (process.env.PYTHON_WORKERS || '')
+      .split(',')
+      .map(entry => entry.trim())
+      .filter(Boolean)
+      .forEach(entry => {
+        const [id, url] = entry.split('=');
+        this.workers.set(id, url);
+        this.ring.addNode(id);
+      });
+
+    if (this.isEnabled()) {
+      this.broadcastMembership().catch(error => {
+        console.error('[ShardRouter] Initial membership broadcast failed:', error.message);
+      });
+    }
+  }
+
+  isEnabled() {
+    return this.workers.size > 0;
+  }
+
+  listWorkers() {
+    return [...this.workers].map(([id, url]) => ({ id, url }));
+  }
+
+  getWorker(sessionId) {
+    const id = this.ring.getNode(sessionId);
+    return id ? { id, url: this.workers.get(id) } : null;
+  }
+
+  async addWorker(id, url) {
+    this.workers.set(id, url);
+    this.ring.addNode(id);
+    console.log(`[ShardRouter] Worker joined: ${id} (${url})`);
+    await this.broadcastMembership();
+  }
+
+  async removeWorker(id) {
+    const url = this.workers.get(id);
+    if (!this.workers.delete(id)) return false;
+    this.ring.removeNode(id);
+    console.log(`[ShardRouter] Worker left: ${id}`);
+    // 被摘除的 worker 可能只是暂时不可达：也通知它（不等待），仍在运行时立即交出全部会话，
+    // 重新加入前不再保留过期的会话副本
+    this._sendMembership(id, url, [...this.workers.keys()]);
+    await this.broadcastMembership();
+    return true;
+  }
+
+  /**
+   * 通知所有 worker 当前成员列表，触发会话交接
+   */
+  async broadcastMembership() {
+    const workers = [...this.workers.keys()];
+    await Promise.all([...this.workers].map(([id, url]) => this._sendMembership(id, url, workers)));
+  }
+
+  async _sendMembership(id, url, workers) {
+    try {
+      const response = await fetch(`${url}/membership`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ workers })
+      });
+      const result = await response.json();
+      if (result.handedOff?.length) {
+        console.log(`[ShardRouter] ${id} handed off ${result.handedOff.length} sessions`);
+      }
+    } catch (error) {
+      console.error(`[ShardRouter] Failed to update membership on ${id}:`, error.message);
+    }
+  }
+
+  /**
+   * 把一轮请求转发给负责该会话的 worker；worker 不可达时摘除并重新路由一次
+   */
+  async forward(sessionId, input, context, retry = true) {
+    const worker = this.getWorker(sessionId);
+    if (!worker) {
+      throw new Error('No Python worker available');
+    }
+
+    try {
+      const headers = { 'Content-Type': 'application/json' };
+      const span = currentSpan();
+      if (span) {
+        span.setAttribute('worker.id', worker.id);
+        headers.traceparent = span.traceparent;
+      }
+      const response = await fetch(`${worker.url}/turn`, {
+        method: 'POST',
+        headers,
+        body: JSON.stringify({ session: sessionId, input, context })
+      });
+      return await response.json();
+    } catch (error) {
+      console.error(`[ShardRouter] Worker ${worker.id} unreachable:`, error.message);
+      if (!retry || this.workers.size <= 1) {
+        throw error;
+      }
+      await this.removeWorker(worker.id);
+      return this.forward(sessionId, input, context, false);
+    }
+  }
+}
+
+module.exports = new ShardRouter();
@@ -0,0 +1,134 @@
+const fs = require('fs');
+const os = require('os');
+const path = require('path');
+const crypto = require('crypto');
+const { AsyncLocalStorage } = require('async_hooks');
+
+/**
+ * 轻量级链路追踪，span 字段与 OpenTelemetry 一致
+ *
+ * 每个 Express 请求开启一条 trace（或沿用请求头中的 W3C traceparent），
+ * 通过 TRACEPARENT 环境变量或 traceparent 请求头传给 Python，
+ * Node 和 Python 的 span 都追加写入同一个 JSON-lines 文件，可用 `python tracing.py` 查看。
+ */
+const storage = new AsyncLocalStorage();
+const enabled = process.env.PULITZER_TRACING !== '0';
+const stateDir = process.env.PULITZER_STATE_DIR || path.join(os.tmpdir(), 'pulitzer-ai');
+const traceFile = process.env.PULITZER_TRACE_FILE || path.join(stateDir, 'traces.jsonl');
+const TRACEPARENT_PATTERN = /^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$/;
+
+if (enabled) {
+  fs.mkdirSync(path.dirname(traceFile), { recursive: true });
+}
+
+function parseTraceparent(header) {
+  const match = TRACEPARENT_PATTERN.exec((header || '').trim());
+  return match ? { traceId: match[1], spanId: match[2] } : null;
+}
+
+class Span {
+  constructor(name, parent, attributes = {}) {
+    this.name = name;
+    this.traceId = parent ? parent.traceId : crypto.randomBytes(16).toString('hex');
+    this.spanId = crypto.randomBytes(8).toString('hex');
+    this.parentSpanId = parent ? parent.spanId : null;
+    this.attributes = { ...attributes };
+    this.status = { code: 'OK' };
+    this.startTime = BigInt(Date.now()) * 1000000n;
+    this.started = process.hrtime.bigint();
+    this.ended = false;
+  }
+
+  setAttribute(key, value) {
+    this.attributes[key] = value;
+  }
+
+  setAttributes(attributes) {
+    Object.assign(this.attributes, attributes);
+  }
+
+  recordException(error) {
+    this.status = { code: 'ERROR', message: error.message };
+    this.attributes['exception.type'] = error.name;
+  }
+
+  get traceparent() {
+    return `00-${this.traceId}-${this.spanId}-01`;
+  }
+
+  end() {
+    if (this.ended) return;
+    this.ended = true;
+    if (!enabled) return;
+
+    const duration = process.hrtime.bigint() - this.started;
+    const record = {
+      traceId: this.traceId,
+      spanId: this.spanId,
+      parentSpanId: this.parentSpanId,
+      name: this.name,
+      service: 'node',
+      startTimeUnixNano: this.startTime.toString(),
+      endTimeUnixNano: (this.startTime + duration).toString(),
+      durationMs: Number(duration) / 1e6,
+      attributes: this.attributes,
+      status: this.status
+    };
+    fs.appendFile(traceFile, JSON.stringify(record) + '\n', (error) => {
+      if (error) console.error('[Tracing] Failed to export span:', error.message);
+    });
+  }
+}
+
+/**
+ * 当前异步上下文中的 span
+ */
+function currentSpan() {
+  return storage.getStore() || null;
+}
+
+/**
+ * 在子 span 中执行 fn(span)，fn 可以是异步函数
+ */
+async function withSpan(name, attributes, fn) {
+  const span = new Span(name, currentSpan(), attributes);
+  return storage.run(span, async () => {
+    try {
+      return await fn(span);
+    } catch (error) {
+      span.recordException(error);
+      throw error;
+    } finally {
+      span.end();
+    }
+  });
+}
+
+/**
+ * Express 中间件：为每个请求开启根 span，并在响应头中返回 traceparent
+ */
+function middleware() {
+  return (req, res, next) => {
+    const span = new Span(`${req.method} ${req.path}`, parseTraceparent(req.get('traceparent')), {
+      'http.method': req.method,
+      'http.target': req.originalUrl
+    });
+    res.setHeader('traceparent', span.traceparent);
+    res.on('finish', () => {
+      span.setAttribute('http.status_code', res.statusCode);
+      if (res.statusCode >= 500) {
+        span.status = { code: 'ERROR' };
+      }
+      span.end();
+    });
+    storage.run(span, next);
+  };
+}
+
+module.exports = {
+  Span,
+  currentSpan,
+  withSpan,
+  middleware,
+  parseTraceparent
+};
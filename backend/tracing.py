@@ -0,0 +1,228 @@
+import os
+import re
+import sys
+import json
+import time
+import atexit
+import fcntl
+import logging
+import secrets
+import argparse
+import functools
+import threading
+import contextvars
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+from file_store import get_state_dir
+
+TRACEPARENT_PATTERN = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$')
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar('current_span', default=None)
+
+
+def get_trace_file() -> str:
+    """span 导出文件，与 Node 端（src/utils/tracing.js）写入同一个文件"""
+    return os.getenv('PULITZER_TRACE_FILE') or os.path.join(get_state_dir(), 'traces.jsonl')
+
+
+def parse_traceparent(header: Optional[str]) -> Optional[Dict[str, str]]:
+    """解析 W3C traceparent，返回 trace id 和父 span id"""
+    match = TRACEPARENT_PATTERN.match((header or '').strip())
+    if not match:
+        return None
+    return {'trace_id': match.group(1), 'span_id': match.group(2)}
+
+
+class Span:
+    """一个 span，导出格式与 OpenTelemetry 的字段命名一致"""
+    def __init__(self, name: str, trace_id: str, parent_span_id: Optional[str], attributes: Dict):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_span_id = parent_span_id
+        self.attributes = dict(attributes)
+        self.status = {'code': 'OK'}
+        self.start_time = time.time_ns()
+        self._started = time.perf_counter()
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def set_attributes(self, attributes: Dict):
+        self.attributes.update(attributes)
+
+    def record_exception(self, error: BaseException):
+        self.status = {'code': 'ERROR', 'message': str(error)}
+        self.attributes['exception.type'] = type(error).__name__
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def to_dict(self) -> Dict:
+        duration = time.perf_counter() - self._started
+        return {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'parentSpanId': self.parent_span_id,
+            'name': self.name,
+            'service': 'python',
+            'startTimeUnixNano': self.start_time,
+            'endTimeUnixNano': self.start_time + int(duration * 1e9),
+            'durationMs': round(duration * 1000, 3),
+            'attributes': self.attributes,
+            'status': self.status
+        }
+
+
+class Tracer:
+    """进程内 span 缓冲，请求结束时追加写入导出文件"""
+    def __init__(self):
+        self.enabled = os.getenv('PULITZER_TRACING', '1') != '0'
+        self.lock = threading.Lock()
+        self._finished: List[Dict] = []
+
+    @contextmanager
+    def span(self, name: str, attributes: Dict = None, traceparent: str = None) -> Iterator[Span]:
+        """开始一个子 span
+
+        没有当前 span 时，依次使用 traceparent 参数和 TRACEPARENT 环境变量作为远端父 span，
+        都没有时开始一条新的 trace。
+        """
+        parent = _current_span.get()
+        if parent is not None:
+            trace_id, parent_span_id = parent.trace_id, parent.span_id
+        else:
+            remote = parse_traceparent(traceparent) or parse_traceparent(os.getenv('TRACEPARENT'))
+            if remote:
+                trace_id, parent_span_id = remote['trace_id'], remote['span_id']
+            else:
+                trace_id, parent_span_id = secrets.token_hex(16), None
+
+        span = Span(name, trace_id, parent_span_id, attributes or {})
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.record_exception(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            if self.enabled:
+                with self.lock:
+                    self._finished.append(span.to_dict())
+
+    def flush(self):
+        """把已结束的 span 追加写入导出文件"""
+        with self.lock:
+            finished, self._finished = self._finished, []
+        if not finished:
+            return
+        payload = ''.join(json.dumps(span, ensure_ascii=False) + '\n' for span in finished)
+        with open(get_trace_file(), 'a', encoding='utf-8') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.write(payload)
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def current_span() -> Optional[Span]:
+    """当前 span，没有时返回 None"""
+    return _current_span.get()
+
+
+def set_attributes(attributes: Dict):
+    """给当前 span 添加属性，没有当前 span 时忽略"""
+    span = _current_span.get()
+    if span is not None:
+        span.set_attributes(attributes)
+
+
+def traced(name: str):
+    """装饰器：函数调用期间处于一个名为 name 的 span 中"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with tracer.span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class TraceIdFilter(logging.Filter):
+    """给日志记录加上 trace_id 字段，便于按请求检索日志"""
+    def filter(self, record: logging.LogRecord) -> bool:
+        span = _current_span.get()
+        record.trace_id = span.trace_id if span is not None else '-'
+        return True
+
+
+tracer = Tracer()
+# 进程退出前导出尚未写出的 span
+atexit.register(tracer.flush)
+
+
+def load_spans(path: str) -> Dict[str, List[Dict]]:
+    traces = defaultdict(list)
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                span = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            traces[span['traceId']].append(span)
+    return traces
+
+
+def print_trace(spans: List[Dict]):
+    """按父子关系缩进打印一条 trace"""
+    children = defaultdict(list)
+    span_ids = {span['spanId'] for span in spans}
+    for span in sorted(spans, key=lambda s: int(s['startTimeUnixNano'])):
+        parent = span.get('parentSpanId') if span.get('parentSpanId') in span_ids else None
+        children[parent].append(span)
+    trace_start = min(int(span['startTimeUnixNano']) for span in spans)
+
+    def walk(parent, depth):
+        for span in children.get(parent, []):
+            offset = (int(span['startTimeUnixNano']) - trace_start) / 1e6
+            attributes = ' '.join(f"{k}={v}" for k, v in span.get('attributes', {}).items())
+            error = ' ERROR' if span.get('status', {}).get('code') == 'ERROR' else ''
+            print(f"{'  ' * depth}{span['name']} [{span.get('service')}] "
+                  f"+{offset:.1f}ms {span['durationMs']:.1f}ms{error} {attributes}")
+            walk(span['spanId'], depth + 1)
+    walk(None, 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspect exported trace spans')
+    parser.add_argument('trace_id', nargs='?', help='Print this trace as a tree')
+    parser.add_argument('--file', default=None, help='Span file (defaults to the shared trace file)')
+    parser.add_argument('--slowest', type=int, default=10, help='Number of slowest traces to list')
+    args = parser.parse_args()
+
+    traces = load_spans(args.file or get_trace_file())
+    if args.trace_id:
+        if args.trace_id not in traces:
+            print(f"Trace {args.trace_id} not found", file=sys.stderr)
+            return 1
+        print_trace(traces[args.trace_id])
+        return 0
+
+    def duration(spans):
+        start = min(int(s['startTimeUnixNano']) for s in spans)
+        end = max(int(s['endTimeUnixNano']) for s in spans)
+        return (end - start) / 1e6
+
+    ranked = sorted(traces.items(), key=lambda item: duration(item[1]), reverse=True)
+    for trace_id, spans in ranked[:args.slowest]:
+        root = min(spans, key=lambda s: int(s['startTimeUnixNano']))
+        print(f"{trace_id} {duration(spans):>10.1f}ms {len(spans):>4} spans  {root['name']}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
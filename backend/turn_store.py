@@ -0,0 +1,117 @@
+import os
+import json
+import time
+import hashlib
+import logging
+from typing import Callable, Dict, Optional
+
+from file_store import get_state_dir, pid_alive
+from metrics import metrics
+from tracing import set_attributes
+
+logger = logging.getLogger(__name__)
+
+# 已完成轮次的保留时间，覆盖前端重试和用户刷新页面的窗口
+TURN_TTL = 24 * 3600
+
+
+class TurnStore:
+    """按 (session, turn id) 保存已完成轮次的结果，实现重试幂等
+
+    - 已完成的轮次直接重放保存的结果，不再调用 LLM；
+    - 正在执行的轮次，重复请求等待原请求完成后返回同一结果；
+    - 失败的轮次不保存，重试时重新执行。
+    """
+    def __init__(self, directory: str = None, poll_interval: float = 0.1):
+        self.directory = directory or os.path.join(get_state_dir(), 'turns')
+        os.makedirs(self.directory, exist_ok=True)
+        self.poll_interval = poll_interval
+
+    def _paths(self, session_id: str, turn_id: str) -> Dict[str, str]:
+        key = hashlib.sha256(f"{session_id}:{turn_id}".encode('utf-8')).hexdigest()
+        base = os.path.join(self.directory, key)
+        return {'lock': f"{base}.lock", 'result': f"{base}.json"}
+
+    def get(self, session_id: str, turn_id: str) -> Optional[Dict]:
+        """读取已完成轮次的结果"""
+        path = self._paths(session_id, turn_id)['result']
+        try:
+            if time.time() - os.path.getmtime(path) > TURN_TTL:
+                return None
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _save(self, path: str, result: Dict):
+        with open(f"{path}.tmp", 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False)
+        os.replace(f"{path}.tmp", path)
+
+    def _cleanup_expired(self):
+        now = time.time()
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                if now - os.path.getmtime(path) > TURN_TTL:
+                    os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def run(self, session_id: str, turn_id: str, fn: Callable[[], Dict]) -> Dict:
+        """执行一个轮次，或重放/等待同一轮次的结果"""
+        paths = self._paths(session_id, turn_id)
+        while True:
+            result = self.get(session_id, turn_id)
+            if result is not None:
+                logger.info(f"Replaying completed turn {turn_id} for session {session_id}")
+                metrics.inc('pulitzer_cache_requests_total', cache='turn', result='hit')
+                set_attributes({'cache.turn': 'hit'})
+                return result
+
+            try:
+                fd = os.open(paths['lock'], os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if self._wait_for_owner(paths):
+                    continue
+                logger.warning(f"Owner of turn {turn_id} is gone, re-running")
+                try:
+                    os.unlink(paths['lock'])
+                except FileNotFoundError:
+                    pass
+                continue
+
+            with os.fdopen(fd, 'w') as f:
+                f.write(str(os.getpid()))
+            try:
+                # 拿到锁后再确认一次，避免与刚完成的请求竞争
+                result = self.get(session_id, turn_id)
+                if result is not None:
+                    metrics.inc('pulitzer_cache_requests_total', cache='turn', result='hit')
+                    set_attributes({'cache.turn': 'hit'})
+                    return result
+                metrics.inc('pulitzer_cache_requests_total', cache='turn', result='miss')
+                set_attributes({'cache.turn': 'miss'})
+                result = fn()
+                if result and result.get('status') == 'success':
+                    self._cleanup_expired()
+                    self._save(paths['result'], result)
+                return result
+            finally:
+                os.unlink(paths['lock'])
+
+    def _wait_for_owner(self, paths: Dict[str, str]) -> bool:
+        """等待正在执行的同一轮次结束；持有者进程已退出时返回 False"""
+        logger.info("Turn already in progress, waiting for it to finish")
+        while os.path.exists(paths['lock']):
+            try:
+                with open(paths['lock'], 'r') as f:
+                    pid = int(f.read().strip() or 0)
+            except (FileNotFoundError, ValueError):
+                pid = 0
+            if pid and not pid_alive(pid):
+                return False
+            time.sleep(self.poll_interval)
+        return True
@@ -0,0 +1,83 @@
+import os
+import json
+import logging
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+
+def get_prices() -> Dict[str, Dict[str, float]]:
+    """每千 token 的价格，按模型配置
+
+    LLM_PRICES 形如 {"deepseek-ai/DeepSeek-R1": {"prompt": 0.004, "completion": 0.016}}，
+    未列出的模型使用 LLM_PRICE_PROMPT_PER_1K / LLM_PRICE_COMPLETION_PER_1K。
+    """
+    try:
+        return json.loads(os.getenv('LLM_PRICES', '{}'))
+    except json.JSONDecodeError:
+        logger.warning("Invalid LLM_PRICES, ignoring")
+        return {}
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    price = get_prices().get(model) or {
+        'prompt': float(os.getenv('LLM_PRICE_PROMPT_PER_1K', '0')),
+        'completion': float(os.getenv('LLM_PRICE_COMPLETION_PER_1K', '0'))
+    }
+    return (prompt_tokens * price.get('prompt', 0) + completion_tokens * price.get('completion', 0)) / 1000
+
+
+def _empty_totals() -> Dict:
+    return {'calls': 0, 'estimated_calls': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0, 'cost': 0.0}
+
+
+def _add(totals: Dict, prompt_tokens: int, completion_tokens: int, cost: float, reported: bool):
+    totals['calls'] += 1
+    if not reported:
+        totals['estimated_calls'] += 1
+    totals['prompt_tokens'] += prompt_tokens
+    totals['completion_tokens'] += completion_tokens
+    totals['total_tokens'] += prompt_tokens + completion_tokens
+    totals['cost'] = round(totals['cost'] + cost, 6)
+
+
+class UsageLedger:
+    """单个会话的 token 用量和费用，按会话状态和调用档位（profile）分别汇总
+
+    budget 为会话的 token 上限，0 表示不限制。
+    """
+    def __init__(self, budget: int = 0):
+        self.budget = budget
+        self.totals = _empty_totals()
+        self.by_state: Dict[str, Dict] = {}
+        self.by_profile: Dict[str, Dict] = {}
+
+    def record(self, state: str, profile: str, model: str,
+               prompt_tokens: int, completion_tokens: int, reported: bool = True) -> float:
+        """记录一次调用，返回本次费用"""
+        cost = estimate_cost(model, prompt_tokens, completion_tokens)
+        _add(self.totals, prompt_tokens, completion_tokens, cost, reported)
+        _add(self.by_state.setdefault(state, _empty_totals()), prompt_tokens, completion_tokens, cost, reported)
+        _add(self.by_profile.setdefault(profile, _empty_totals()), prompt_tokens, completion_tokens, cost, reported)
+        return cost
+
+    @property
+    def over_budget(self) -> bool:
+        return bool(self.budget) and self.totals['total_tokens'] >= self.budget
+
+    def to_dict(self) -> Dict:
+        return {
+            'budget': self.budget,
+            'totals': self.totals,
+            'by_state': self.by_state,
+            'by_profile': self.by_profile
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict, budget: int = 0) -> 'UsageLedger':
+        ledger = cls(data.get('budget', budget) if data else budget)
+        if data:
+            ledger.totals = {**_empty_totals(), **data.get('totals', {})}
+            ledger.by_state = data.get('by_state', {})
+            ledger.by_profile = data.get('by_profile', {})
+        return ledger
@@ -0,0 +1,246 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional
+
+from AI_writer_auto_writer_OPENAI import CollabState, ContentCollaborator, LLMConfig
+
+# Upper bound on interview turns per section, guards against a run that never converges
+MAX_TURNS_PER_SECTION = 8
+
+_rate_limiter = None
+
+
+class SharedRateLimiter:
+    """Token bucket shared by every process in the pool"""
+    def __init__(self, requests_per_minute: int):
+        self.capacity = float(requests_per_minute)
+        self.refill_per_second = requests_per_minute / 60.0
+        self.tokens = multiprocessing.Value('d', self.capacity)
+        self.updated = multiprocessing.Value('d', time.time())
+        self.lock = multiprocessing.Lock()
+
+    def acquire(self):
+        """Block until a request token is available"""
+        while True:
+            with self.lock:
+                now = time.time()
+                tokens = min(self.capacity, self.tokens.value + (now - self.updated.value) * self.refill_per_second)
+                self.updated.value = now
+                if tokens >= 1:
+                    self.tokens.value = tokens - 1
+                    return
+                self.tokens.value = tokens
+                wait = (1 - tokens) / self.refill_per_second
+            time.sleep(wait)
+
+
+class RateLimitedLLM:
+    """Wraps a LocalLLMClient so every call goes through the shared limiter"""
+    def __init__(self, llm, limiter: SharedRateLimiter):
+        self.llm = llm
+        self.limiter = limiter
+        self.calls = 0
+
+    def generate(self, prompt: str, system_prompt: str = None) -> Optional[str]:
+        self.limiter.acquire()
+        self.calls += 1
+        return self.llm.generate(prompt, system_prompt)
+
+
+def _init_worker(limiter: SharedRateLimiter):
+    global _rate_limiter
+    _rate_limiter = limiter
+
+
+def job_id(job: Dict, index: int) -> str:
+    """Stable id for a job: explicit 'id' or a hash of its parameters and position"""
+    if job.get('id'):
+        return str(job['id'])
+    raw = json.dumps([index, job.get('topic'), job.get('type'), job.get('word_count')], ensure_ascii=False)
+    return f"job-{index:05d}-{hashlib.sha1(raw.encode('utf-8')).hexdigest()[:8]}"
+
+
+def load_jobs(path: str) -> List[Dict]:
+    """Read topic/type/word-count jobs from a JSONL file"""
+    jobs = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for index, line in enumerate(f):
+            line = line.strip()
+            if not line:
+                continue
+            raw = json.loads(line)
+            job = {
+                'topic': raw['topic'],
+                'type': raw.get('type') or raw.get('content_type') or raw.get('articleType') or 'article',
+                'word_count': int(raw.get('word_count') or raw.get('wordCount') or 1000)
+            }
+            if raw.get('id'):
+                job['id'] = raw['id']
+            job['id'] = job_id(job, index)
+            jobs.append(job)
+    return jobs
+
+
+class Checkpoint:
+    """Per-job progress file so an interrupted batch resumes where it stopped"""
+    def __init__(self, directory: str, job: Dict):
+        self.path = os.path.join(directory, f"{job['id']}.json")
+        self.data = {'job': job, 'stage': 'outline', 'timings': {}}
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.data = json.load(f)
+
+    def save(self, **updates):
+        self.data.update(updates)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+def _snapshot(collaborator: ContentCollaborator) -> Dict:
+    return {
+        'outline': collaborator.outline,
+        'interview_responses': collaborator.interview_responses,
+        'current_section': collaborator.current_section,
+        'draft': collaborator.draft
+    }
+
+
+def run_job(job: Dict, config: LLMConfig, checkpoint_dir: str, output_dir: str) -> Dict:
+    """Run outline -> auto-answered interview -> draft for one job without user input"""
+    checkpoint = Checkpoint(checkpoint_dir, job)
+    if checkpoint.data['stage'] == 'done':
+        return {'id': job['id'], 'status': 'skipped', **checkpoint.data['timings']}
+
+    started = time.time()
+    collaborator = ContentCollaborator(config)
+    llm = RateLimitedLLM(collaborator.llm, _rate_limiter) if _rate_limiter else collaborator.llm
+    collaborator.llm = llm
+    collaborator.topic = job['topic']
+    collaborator.content_type = job['type']
+    collaborator.target_length = job['word_count']
+
+    timings = dict(checkpoint.data['timings'])
+    log_path = os.path.join(checkpoint_dir, f"{job['id']}.log")
+    try:
+        # The collaborator narrates every step on stdout; keep it in a per-job log
+        with open(log_path, 'a', encoding='utf-8') as log, contextlib.redirect_stdout(log):
+            if checkpoint.data['stage'] == 'outline':
+                stage_started = time.time()
+                collaborator.outline = collaborator._generate_initial_outline()
+                collaborator.current_section = list(collaborator.outline.keys())[0]
+                timings['outline'] = time.time() - stage_started
+                checkpoint.save(stage='interview', timings=timings, **_snapshot(collaborator))
+            else:
+                collaborator.outline = checkpoint.data['outline']
+                collaborator.interview_responses = checkpoint.data['interview_responses']
+                collaborator.current_section = checkpoint.data['current_section']
+
+            if checkpoint.data['stage'] == 'interview':
+                stage_started = time.time()
+                collaborator.state = CollabState.INTERVIEW
+                max_turns = MAX_TURNS_PER_SECTION * len(collaborator.outline)
+                turns = 0
+                # The last interview turn generates the draft and moves to DRAFT_REVIEW
+                while collaborator.state == CollabState.INTERVIEW and turns < max_turns:
+                    collaborator.process_user_input(None)
+                    turns += 1
+                    checkpoint.save(**_snapshot(collaborator))
+                if collaborator.state == CollabState.INTERVIEW:
+                    collaborator.draft = collaborator._generate_draft()
+                timings['interview_and_draft'] = timings.get('interview_and_draft', 0) + time.time() - stage_started
+
+        if not collaborator.draft or collaborator.draft == "Error generating draft.":
+            raise RuntimeError("draft generation failed")
+
+        draft_path = os.path.join(output_dir, f"{job['id']}.md")
+        with open(draft_path, 'w', encoding='utf-8') as f:
+            f.write(collaborator.draft)
+
+        timings['total'] = timings.get('total', 0) + time.time() - started
+        checkpoint.save(stage='done', timings=timings, draft_path=draft_path, **_snapshot(collaborator))
+        return {'id': job['id'], 'status': 'success', 'llm_calls': getattr(llm, 'calls', None), **timings}
+
+    except Exception as e:
+        timings['total'] = timings.get('total', 0) + time.time() - started
+        checkpoint.save(timings=timings, error=str(e))
+        return {'id': job['id'], 'status': 'failed', 'error': str(e), **timings}
+
+
+def _percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(results: List[Dict], wall_time: float) -> Dict:
+    """Throughput and latency summary for a batch run"""
+    completed = [r for r in results if r['status'] == 'success']
+    latencies = [r['total'] for r in completed]
+    return {
+        'jobs': len(results),
+        'succeeded': len(completed),
+        'failed': sum(1 for r in results if r['status'] == 'failed'),
+        'skipped': sum(1 for r in results if r['status'] == 'skipped'),
+        'wall_time_seconds': round(wall_time, 2),
+        'drafts_per_hour': round(len(completed) / wall_time * 3600, 2) if wall_time else 0.0,
+        'latency_seconds': {
+            'p50': round(_percentile(latencies, 0.5), 2),
+            'p95': round(_percentile(latencies, 0.95), 2),
+            'max': round(max(latencies), 2) if latencies else 0.0
+        },
+        'failures': {r['id']: r['error'] for r in results if r['status'] == 'failed'}
+    }
+
+
+def run_batch(jobs_path: str, output_dir: str, workers: int, requests_per_minute: int, config: LLMConfig) -> Dict:
+    """Run every job in the JSONL file across a bounded process pool"""
+    jobs = load_jobs(jobs_path)
+    checkpoint_dir = os.path.join(output_dir, 'checkpoints')
+    os.makedirs(checkpoint_dir, exist_ok=True)
+
+    limiter = SharedRateLimiter(requests_per_minute)
+    results = []
+    started = time.time()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(limiter,)) as pool:
+        futures = {pool.submit(run_job, job, config, checkpoint_dir, output_dir): job for job in jobs}
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            print(f"[{len(results)}/{len(jobs)}] {result['id']}: {result['status']}", file=sys.stderr)
+
+    summary = summarize(results, time.time() - started)
+    with open(os.path.join(output_dir, 'summary.json'), 'w', encoding='utf-8') as f:
+        json.dump({'summary': summary, 'results': results}, f, ensure_ascii=False, indent=2)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate article drafts in bulk from a JSONL job file')
+    parser.add_argument('jobs', help='JSONL file, one {"topic", "type", "word_count"} object per line')
+    parser.add_argument('--output-dir', default='batch_output')
+    parser.add_argument('--workers', type=int, default=4, help='Number of concurrent pipelines')
+    parser.add_argument('--rpm', type=int, default=60, help='Requests per minute shared by all workers')
+    parser.add_argument('--api-key', default=os.getenv('OPENAI_API_KEY', LLMConfig.api_key))
+    parser.add_argument('--base-url', default=os.getenv('OPENAI_API_BASE', LLMConfig.base_url))
+    parser.add_argument('--model', default=LLMConfig.model)
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    config = LLMConfig(api_key=args.api_key, base_url=args.base_url, model=args.model)
+    summary = run_batch(args.jobs, args.output_dir, args.workers, args.rpm, config)
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -10,6 +10,10 @@ export const API_ROUTES = {
   SEND_MESSAGE: (sessionId) => `/collaboration/sessions/${sessionId}/input`,
   GET_MESSAGES: (sessionId) => `/collaboration/sessions/${sessionId}/messages`,
   
+  // 历史会话与搜索
+  SESSION_HISTORY: '/collaboration/history',
+  SEARCH_SESSIONS: '/collaboration/search',
+
   // 会话状态
   GET_SESSION_STATE: (sessionId) => `/collaboration/sessions/${sessionId}/state`,
   
@@ -19,7 +23,8 @@ export const API_ROUTES = {
   
   // 草稿管理
   GET_DRAFT: (sessionId) => `/collaboration/sessions/${sessionId}/draft`,
-  UPDATE_DRAFT: (sessionId) => `/collaboration/sessions/${sessionId}/draft`
+  UPDATE_DRAFT: (sessionId) => `/collaboration/sessions/${sessionId}/draft`,
+  EXPORT_DRAFT: (sessionId, format = 'markdown') => `/draft/sessions/${sessionId}/export?format=${format}`
 }
 
 // API 响应状态码
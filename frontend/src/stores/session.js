@@ -2,18 +2,46 @@ import { defineStore } from 'pinia'
 import { inject } from 'vue'
 import { API_BASE_URL, API_ROUTES, API_STATUS, API_ERROR_CODES } from '../config/api'
 import { withRetry } from '../utils/retry'
+import { createTurnId } from '../utils/idempotency'
 
 export const useSessionStore = defineStore('session', {
   state: () => ({
     currentSession: null,
     sessions: [],
+    // 已同步的服务端状态版本和合并后的上下文，发送输入时只需拉取之后的变化
+    stateVersion: null,
+    sessionContext: {},
+    // 按章节同步的草稿：章节顺序和 id -> 章节
+    draftOrder: [],
+    draftChunks: {},
     unsavedChanges: false,
     lastSaveTime: null,
     loading: false,
     error: null
   }),
+
+  getters: {
+    // 由已同步的章节拼接的草稿全文
+    draftMarkdown: (state) => state.draftOrder
+      .filter(id => state.draftChunks[id])
+      .map(id => state.draftChunks[id].content)
+      .join('\n\n')
+  },
   
   actions: {
+    // 合并草稿变化：完整快照替换全部章节，增量响应只更新变化和删除的章节
+    applyDraftChanges(changes, delta) {
+      const chunks = delta ? { ...this.draftChunks } : {}
+      for (const id of changes.removed || []) {
+        delete chunks[id]
+      }
+      for (const chunk of changes.chunks || []) {
+        chunks[chunk.id] = chunk
+      }
+      this.draftOrder = changes.order || []
+      this.draftChunks = chunks
+    },
+
     async createSession(topic, type, wordCount, settings = {}) {
       const showLoading = inject('showLoading')
       const hideLoading = inject('hideLoading')
@@ -74,6 +102,10 @@ export const useSessionStore = defineStore('session', {
         if (result.status === 'success' && result.data?.session) {
           this.currentSession = result.data.session
           this.sessions.push(result.data.session)
+          this.stateVersion = null
+          this.sessionContext = {}
+          this.draftOrder = []
+          this.draftChunks = {}
           return result.data.session
         } else {
           throw new Error(result.error?.message || '创建会话失败')
@@ -95,6 +127,8 @@ export const useSessionStore = defineStore('session', {
       
       try {
         if (showLoading) showLoading('发送中...')
+        // 在重试循环外生成，保证所有重试使用同一个幂等键
+        const turnId = createTurnId()
         return await withRetry(async () => {
           if (!sessionId) {
             throw new Error('无效的会话ID')
@@ -107,7 +141,8 @@ export const useSessionStore = defineStore('session', {
               sessionId,
               currentState: this.currentSession?.state || 'TOPIC_SELECTION',
               topic: this.currentSession?.topic,
-              type: this.currentSession?.type
+              type: this.currentSession?.type,
+              ...(this.stateVersion !== null && { knownVersion: this.stateVersion })
             }
           }
           
@@ -121,6 +156,7 @@ export const useSessionStore = defineStore('session', {
             method: 'POST',
             headers: {
               'Content-Type': 'application/json',
+              'Idempotency-Key': turnId
             },
             body: JSON.stringify(requestBody),
           })
@@ -132,7 +168,12 @@ export const useSessionStore = defineStore('session', {
           })
           
           if (!response.ok) {
-            throw new Error(`HTTP error! status: ${response.status}`)
+            const error = new Error(`HTTP error! status: ${response.status}`)
+            // 服务过载时按 Retry-After 等待后再重试
+            if (response.status === 503 && response.headers.get('Retry-After')) {
+              error.retryAfterMs = Number(response.headers.get('Retry-After')) * 1000
+            }
+            throw error
           }
           
           const data = JSON.parse(responseText)
@@ -146,11 +187,26 @@ export const useSessionStore = defineStore('session', {
               state: data.data.state
             }
           }
+
+          // 增量响应只包含变化的字段，完整快照则整体替换；草稿变化单独按章节合并
+          const { draftChanges, ...context } = data.data?.context || {}
+          this.sessionContext = data.data?.delta
+            ? { ...this.sessionContext, ...context }
+            : context
+          if (draftChanges) {
+            this.applyDraftChanges(draftChanges, data.data.delta)
+          } else if (!data.data?.delta) {
+            this.draftOrder = []
+            this.draftChunks = {}
+          }
+          if (data.data?.version !== undefined) {
+            this.stateVersion = data.data.version
+          }
           
           return {
             response: data.data?.response || data.response,
             state: data.data?.state,
-            context: data.data?.context || {}
+            context: this.sessionContext
           }
         })
       } catch (error) {
@@ -0,0 +1,9 @@
+/**
+ * 为一次用户操作生成幂等键，重试时复用同一个键，服务端据此重放结果而不是重复执行
+ */
+export function createTurnId() {
+  if (typeof crypto !== 'undefined' && crypto.randomUUID) {
+    return crypto.randomUUID()
+  }
+  return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 10)}`
+}
@@ -7,7 +7,7 @@ export async function withRetry(operation, maxRetries = 3, delay = 1000) {
       console.log(`Attempt ${i + 1} failed:`, error);
       lastError = error;
       if (i < maxRetries - 1) {
-        await new Promise(resolve => setTimeout(resolve, delay * (i + 1)));
+        await new Promise(resolve => setTimeout(resolve, error.retryAfterMs || delay * (i + 1)));
       }
     }
   }
@@ -0,0 +1,194 @@
+import os
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import itertools
+import threading
+import contextlib
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from AI_writer_auto_writer_OPENAI import CollabState, ContentCollaborator, LLMConfig, LocalLLMClient
+
+
+class Interviewee(ABC):
+    """Answers interview questions in place of a human expert"""
+    @abstractmethod
+    def answer(self, topic: str, section: str, question: str, rationale: str) -> str:
+        """Return the answer to one interview question"""
+
+
+class ScriptedInterviewee(Interviewee):
+    """Replays answers from a file
+
+    The file is either a JSON list of answers used in order, or a JSON object
+    mapping section names to answer lists (with an optional "*" fallback list).
+    Answers are cycled when a section asks more questions than the script has.
+    """
+    def __init__(self, path: str):
+        with open(path, 'r', encoding='utf-8') as f:
+            script = json.load(f)
+        if isinstance(script, list):
+            script = {'*': script}
+        self.script = {section: itertools.cycle(answers) for section, answers in script.items() if answers}
+        self.lock = threading.Lock()
+
+    def answer(self, topic: str, section: str, question: str, rationale: str) -> str:
+        with self.lock:
+            answers = self.script.get(section) or self.script.get('*')
+            if not answers:
+                return f"I don't have anything prepared about {section}."
+            return next(answers)
+
+
+class CorpusInterviewee(Interviewee):
+    """Picks the canned answer whose words overlap most with the question
+
+    The corpus is a text file with one answer per paragraph, or a JSON list.
+    Ties are broken randomly so repeated runs exercise different paths.
+    """
+    def __init__(self, path: str, seed: Optional[int] = None):
+        with open(path, 'r', encoding='utf-8') as f:
+            content = f.read()
+        if path.endswith('.json'):
+            self.answers = json.loads(content)
+        else:
+            self.answers = [p.strip() for p in re.split(r'\n\s*\n', content) if p.strip()]
+        if not self.answers:
+            raise ValueError(f"Corpus {path} has no answers")
+        self.vocabularies = [self._words(answer) for answer in self.answers]
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _words(text: str) -> set:
+        return set(re.findall(r'\w+', (text or '').lower()))
+
+    def answer(self, topic: str, section: str, question: str, rationale: str) -> str:
+        words = self._words(f"{topic} {section} {question}")
+        scores = [len(words & vocabulary) for vocabulary in self.vocabularies]
+        best = max(scores)
+        candidates = [i for i, score in enumerate(scores) if score == best]
+        with self.lock:
+            return self.answers[self.random.choice(candidates)]
+
+
+class PersonaInterviewee(Interviewee):
+    """Lets the LLM answer in character as a described persona"""
+    def __init__(self, llm: LocalLLMClient, persona: str):
+        self.llm = llm
+        self.persona = persona
+
+    def answer(self, topic: str, section: str, question: str, rationale: str) -> str:
+        prompt = f"""Topic: {topic}
+        Section: {section}
+
+        Question: {question}
+        Rationale: {rationale}
+
+        Answer the question in about 200 words, staying in character."""
+        return self.llm.generate(
+            prompt,
+            system_prompt=f"You are being interviewed about this topic. Your persona: {self.persona}"
+        ) or ""
+
+
+def start_interview(collaborator: ContentCollaborator, topic: str, content_type: str = 'article',
+                    target_length: int = 1000):
+    """Skip topic selection and outline review: generate the outline and enter INTERVIEW"""
+    collaborator.topic = topic
+    collaborator.content_type = content_type
+    collaborator.target_length = target_length
+    collaborator.outline = collaborator._generate_initial_outline()
+    collaborator.current_section = list(collaborator.outline.keys())[0]
+    collaborator.state = CollabState.INTERVIEW
+
+
+def run_interview(collaborator: ContentCollaborator, max_turns: int = 100) -> int:
+    """Drive interview turns back-to-back until the draft is generated; returns the turn count"""
+    turns = 0
+    while collaborator.state == CollabState.INTERVIEW and turns < max_turns:
+        collaborator.process_user_input(None)
+        turns += 1
+    return turns
+
+
+def build_interviewee(args, config: LLMConfig) -> Optional[Interviewee]:
+    if args.script:
+        return ScriptedInterviewee(args.script)
+    if args.corpus:
+        return CorpusInterviewee(args.corpus, args.seed)
+    if args.persona:
+        return PersonaInterviewee(LocalLLMClient(config), args.persona)
+    return None
+
+
+def run_many(topics: List[str], config: LLMConfig, interviewee: Optional[Interviewee],
+             concurrency: int, content_type: str = 'article', target_length: int = 1000) -> Dict:
+    """Run one interview per topic, several at a time, and report turn throughput"""
+    def run_one(topic: str) -> Dict:
+        started = time.time()
+        collaborator = ContentCollaborator(config, interviewee=interviewee)
+        try:
+            start_interview(collaborator, topic, content_type, target_length)
+            turns = run_interview(collaborator)
+            return {
+                'topic': topic,
+                'status': 'success' if collaborator.state == CollabState.DRAFT_REVIEW else 'incomplete',
+                'turns': turns,
+                'seconds': time.time() - started
+            }
+        except Exception as e:
+            return {'topic': topic, 'status': 'failed', 'error': str(e), 'turns': 0, 'seconds': time.time() - started}
+
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(run_one, topics))
+    elapsed = time.time() - started
+    turns = sum(r['turns'] for r in results)
+    return {
+        'interviews': len(results),
+        'completed': sum(1 for r in results if r['status'] == 'success'),
+        'turns': turns,
+        'seconds': round(elapsed, 2),
+        'turns_per_second': round(turns / elapsed, 2) if elapsed else 0.0,
+        'results': results
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run interviews unattended with a simulated interviewee')
+    parser.add_argument('topics', nargs='+', help='Topics to interview about')
+    parser.add_argument('--repeat', type=int, default=1, help='Run every topic this many times')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--type', default='article')
+    parser.add_argument('--word-count', type=int, default=1000)
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--script', help='JSON answers file')
+    source.add_argument('--corpus', help='Canned answer corpus (paragraphs or JSON list)')
+    source.add_argument('--persona', help='Let the LLM answer as this persona')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--verbose', action='store_true', help='Show the collaborator output')
+    parser.add_argument('--api-key', default=os.getenv('OPENAI_API_KEY', LLMConfig.api_key))
+    parser.add_argument('--base-url', default=os.getenv('OPENAI_API_BASE', LLMConfig.base_url))
+    parser.add_argument('--model', default=LLMConfig.model)
+    args = parser.parse_args()
+
+    config = LLMConfig(api_key=args.api_key, base_url=args.base_url, model=args.model)
+    interviewee = build_interviewee(args, config)
+    topics = args.topics * args.repeat
+
+    with contextlib.ExitStack() as stack:
+        if not args.verbose:
+            stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, 'w'))))
+        report = run_many(topics, config, interviewee, args.concurrency, args.type, args.word_count)
+    json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()